@@ -0,0 +1,56 @@
+"""
+Benchmark Block serialization: write and read round trips of each Block class through a cached device
+
+Run with: python -m benchmarks.bench_codec
+
+Author: Angad Gill
+"""
+import os
+import tempfile
+import time
+
+from unix_fs import data_structures as ds
+from unix_fs import utils
+
+BLOCK_SIZE = 4096
+NUM_OPS = 50000
+NUM_BLOCKS = 256
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print('{:<50} {:8.3f} s  {:8.2f} us/op'.format(label, elapsed, elapsed / NUM_OPS * 1e6))
+
+
+def round_trips(disk, cls):
+    blocks = [cls(device=disk) for _ in range(NUM_BLOCKS)]
+    for block in blocks:
+        block.__write__()
+
+    def run():
+        for i in range(NUM_OPS):
+            block = blocks[i % NUM_BLOCKS]
+            block.__write__()
+            block.__read__()
+    bench('{} write + read'.format(cls.__name__), run)
+
+
+def main():
+    _, path = tempfile.mkstemp()
+    try:
+        for use_mmap in [False, True]:
+            for cache_size in [0, 2 * NUM_BLOCKS]:
+                print('{}, cache_size={}'.format('MmapDisk' if use_mmap else 'Disk', cache_size))
+                utils.makefs(path, block_size=BLOCK_SIZE, num_inodes=NUM_BLOCKS + 1, num_data_blocks=10 * NUM_BLOCKS)
+                disk = utils.mount(path, cache_size=cache_size, use_mmap=use_mmap)
+                for cls in [ds.Inode, ds.IndirectBlock, ds.DirectoryHeader, ds.DirectoryBlock, ds.DataBlock]:
+                    round_trips(disk, cls)
+                disk.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark interleaved streaming writers with and without delayed allocation: files appended to one block at a time
+in turn, as Files constructed directly (allocated at every write) and as Files held by the InodeCache (allocated
+when closed)
+
+Run with: python -m benchmarks.bench_delayed_allocation
+
+Author: Angad Gill
+"""
+import os
+import tempfile
+import time
+
+from unix_fs import data_structures as ds
+from unix_fs import system
+from unix_fs import utils
+
+BLOCK_SIZE = 4096
+NUM_FILES = 16
+FILE_BLOCKS = 500
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print('{:<50} {:8.3f} s'.format(label, elapsed))
+    return result
+
+
+def count_writes(disk) -> dict:
+    counts = {'writes': 0}
+    write_raw, pwritev = disk._write_raw, disk._pwritev
+
+    def counted_write_raw(*args):
+        counts['writes'] += 1
+        return write_raw(*args)
+
+    def counted_pwritev(*args):
+        counts['writes'] += 1
+        return pwritev(*args)
+    disk._write_raw, disk._pwritev = counted_write_raw, counted_pwritev
+    return counts
+
+
+def workload(path, delayed):
+    disk = utils.mount(path)
+    counts = count_writes(disk)
+    inodes = system.InodeCache.for_device(disk)
+    files = [inodes.create(system.File) if delayed else system.File(device=disk) for _ in range(NUM_FILES)]
+    block = b'x' * BLOCK_SIZE
+
+    def write():
+        for _ in range(FILE_BLOCKS):
+            for f in files:
+                f.write(block)
+        if delayed:
+            for f in files:
+                inodes.release(f)
+    bench('  append {} blocks to {} files in turn'.format(FILE_BLOCKS, NUM_FILES), write)
+    runs = [len(ds.to_extents(system.File(device=disk, index=f.index)._block_indices())) for f in files]
+    print('  device writes: {}, runs of consecutive blocks per file: {}'.format(counts['writes'], runs))
+    disk.close()
+
+
+def main():
+    for delayed in [False, True]:
+        print('delayed allocation' if delayed else 'allocation at every write')
+        _, path = tempfile.mkstemp()
+        try:
+            utils.makefs(path, block_size=BLOCK_SIZE, num_inodes=NUM_FILES + 1,
+                         num_data_blocks=NUM_FILES * FILE_BLOCKS * 2)
+            workload(path, delayed)
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
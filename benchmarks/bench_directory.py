@@ -0,0 +1,63 @@
+"""
+Benchmark creating and looking up 100k entries in one hashed Directory
+
+Run with: python -m benchmarks.bench_directory
+
+Author: Angad Gill
+"""
+import os
+import random
+import tempfile
+import time
+
+from unix_fs import system
+from unix_fs import utils
+
+BLOCK_SIZE = 4096
+NUM_DATA_BLOCKS = 10000
+NUM_ENTRIES = 100000
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print('{:<50} {:8.3f} s  {:8.1f} us/op'.format(label, elapsed, elapsed / NUM_ENTRIES * 1e6))
+    return result
+
+
+def entry_name(i: int) -> str:
+    """ Base 36 name, short enough for MAX_FILENAME_LENGTH """
+    name = ''
+    while True:
+        i, digit = divmod(i, len(DIGITS))
+        name = DIGITS[digit] + name
+        if i == 0:
+            return name
+
+
+def main():
+    _, path = tempfile.mkstemp()
+    try:
+        utils.makefs(path, block_size=BLOCK_SIZE, num_data_blocks=NUM_DATA_BLOCKS)
+        disk = utils.mount(path, cache_size=1024)
+        directory = system.Directory(device=disk)
+        names = [entry_name(i) for i in range(NUM_ENTRIES)]
+        bench('add {} entries'.format(NUM_ENTRIES), lambda: [directory.add(name, i) for i, name in enumerate(names)])
+        print('buckets: {}, cache: {}'.format(directory.header.num_buckets, disk.cache.stats))
+
+        directory = system.Directory(device=disk, index=directory.index)
+        random.seed(0)
+        random.shuffle(names)
+        bench('lookup {} entries'.format(NUM_ENTRIES), lambda: [directory.lookup(name) for name in names])
+        bench('remove {} entries'.format(NUM_ENTRIES),
+              lambda: [directory.remove(name, directory.lookup(name)) for name in names])
+        assert directory.read() == ([], [])
+        disk.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
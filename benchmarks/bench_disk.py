@@ -0,0 +1,66 @@
+"""
+Benchmark the Disk and MmapDisk backends on the unit test workloads, scaled up
+
+Run with: python -m benchmarks.bench_disk
+
+Author: Angad Gill
+"""
+import os
+import random
+import tempfile
+import time
+
+from unix_fs import data_structures as ds
+from unix_fs import system
+from unix_fs import utils
+
+NUM_DATA_BLOCKS = 20000
+NUM_FILES = 8
+FILE_BLOCKS = 2000
+NUM_RANDOM_READS = 50000
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print('{:<50} {:8.3f} s'.format(label, elapsed))
+    return result
+
+
+def workload(path, use_mmap):
+    disk = utils.mount(path, use_mmap=use_mmap)
+    data = bytes(ord('a') + i % 26 for i in range(disk.block_size * FILE_BLOCKS))
+    files = [system.File(device=disk) for _ in range(NUM_FILES)]
+    bench('  write {} files of {} blocks'.format(NUM_FILES, FILE_BLOCKS),
+          lambda: [f.write(data) for f in files])
+    bench('  append {} blocks, one block at a time'.format(FILE_BLOCKS),
+          lambda: [files[0].write(data[:disk.block_size]) for _ in range(FILE_BLOCKS)])
+    bench('  read {} files'.format(NUM_FILES), lambda: [system.File(device=disk, index=f.index).read() for f in files])
+
+    random.seed(0)
+    indices = [random.choice(files)._block_address(random.randrange(FILE_BLOCKS)) for _ in range(NUM_RANDOM_READS)]
+    bench('  {} random DataBlock reads'.format(NUM_RANDOM_READS),
+          lambda: [ds.DataBlock(device=disk, index=i).data for i in indices])
+    bench('  {} inode reads'.format(NUM_RANDOM_READS),
+          lambda: [system.File(device=disk, index=files[i % NUM_FILES].index) for i in range(NUM_RANDOM_READS)])
+    inodes = system.InodeCache.for_device(disk)
+    bench('  {} cached inode opens'.format(NUM_RANDOM_READS),
+          lambda: [inodes.release(inodes.get(files[i % NUM_FILES].index)) for i in range(NUM_RANDOM_READS)])
+    print('  inode cache: {}'.format(inodes.stats))
+    bench('  close', disk.close)
+
+
+def main():
+    for use_mmap in [False, True]:
+        print('MmapDisk' if use_mmap else 'Disk')
+        _, path = tempfile.mkstemp()
+        try:
+            utils.makefs(path, num_data_blocks=NUM_DATA_BLOCKS)
+            workload(path, use_mmap)
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Benchmark fragmentation of data block allocation with next-fit and best-fit freelists: a churn of files written by
+interleaved appends and deleted at random, then the average number of runs of consecutive blocks per file
+
+Run with: python -m benchmarks.bench_fragmentation
+
+Author: Angad Gill
+"""
+import os
+import random
+import tempfile
+import time
+
+from unix_fs import data_structures as ds
+from unix_fs import system
+from unix_fs import utils
+
+BLOCK_SIZE = 512
+NUM_DATA_BLOCKS = 8192
+NUM_INODES = 256
+NUM_ROUNDS = 20
+NUM_WRITERS = [1, 4]  # files appended to in turn
+MAX_FILE_BLOCKS = 64
+FULL = 0.8  # fraction of the data blocks used after each round
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print('{:<50} {:8.3f} s'.format(label, elapsed))
+    return result
+
+
+def churn(disk, rng, num_writers: int) -> list:
+    """ Deletes a third of the files and writes new ones, num_writers at a time, until the device is FULL """
+    freelist = ds.DataBlockFreeList.for_device(disk)
+    files = []  # type: list
+    for _ in range(NUM_ROUNDS):
+        for f in rng.sample(files, len(files) // 3):
+            files.remove(f)
+            f.free()
+        while freelist.num_free > NUM_DATA_BLOCKS * (1 - FULL) and len(files) + num_writers < NUM_INODES:
+            writers = [(system.File(device=disk), rng.randint(1, MAX_FILE_BLOCKS)) for _ in range(num_writers)]
+            while any(f.size < num_blocks * BLOCK_SIZE for f, num_blocks in writers):
+                for f, num_blocks in writers:
+                    remaining = num_blocks * BLOCK_SIZE - f.size
+                    if remaining > 0:
+                        f.write(bytes(min(remaining, rng.randint(1, 4) * BLOCK_SIZE)))
+            files += [f for f, _ in writers]
+    return files
+
+
+def workload(path, best_fit, num_writers):
+    ds.BEST_FIT = best_fit
+    disk = utils.mount(path)
+    files = bench('  {} rounds of churn, {} writer(s)'.format(NUM_ROUNDS, num_writers),
+                  lambda: churn(disk, random.Random(0), num_writers))
+    runs = [len(ds.to_extents(f._block_indices())) for f in files]
+    free_runs = len(ds.DataBlockFreeList.for_device(disk).free_extents)
+    print('  files: {}, runs per file: {:.2f} (max {}), free runs: {}'.format(
+        len(files), sum(runs) / len(runs), max(runs), free_runs))
+    disk.close()
+
+
+def main():
+    for best_fit in [False, True]:
+        print('best fit' if best_fit else 'next fit')
+        for num_writers in NUM_WRITERS:
+            _, path = tempfile.mkstemp()
+            try:
+                utils.makefs(path, block_size=BLOCK_SIZE, num_inodes=NUM_INODES, num_data_blocks=NUM_DATA_BLOCKS)
+                workload(path, best_fit, num_writers)
+            finally:
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+Benchmark FreeList allocation and deallocation of 1M items
+
+Run with: python -m benchmarks.bench_freelist
+
+Author: Angad Gill
+"""
+import random
+import time
+
+from unix_fs import data_structures as ds
+
+N = 1000000
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print('{:<40} {:8.3f} s'.format(label, elapsed))
+
+
+def main(n=N):
+    freelist = ds.FreeList(n=n)
+    print('FreeList of {} items: {} bytes on disk'.format(n, len(bytes(freelist))))
+
+    bench('allocate {} sequentially'.format(n),
+          lambda: [freelist.allocate(write_through=False) for _ in range(n)])
+
+    indices = list(range(n))
+    random.seed(0)
+    random.shuffle(indices)
+    bench('deallocate {} in random order'.format(n),
+          lambda: [freelist.deallocate(i, write_through=False) for i in indices])
+
+    # Free every 64th item so each allocation has to skip a full word
+    freelist.list = [i % 64 == 0 for i in range(n)]
+    bench('allocate {} sparse free items'.format(freelist.num_free),
+          lambda: [freelist.allocate(write_through=False) for _ in range(freelist.num_free)])
+
+
+if __name__ == '__main__':
+    main()
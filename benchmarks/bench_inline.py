@@ -0,0 +1,91 @@
+"""
+Benchmark many small files, like configuration files and symlink-sized data, with and without inline data: files of
+up to Inode.max_inline bytes created, then read back after remounting
+
+Run with: python -m benchmarks.bench_inline
+
+Author: Angad Gill
+"""
+import os
+import random
+import tempfile
+import time
+
+from unix_fs import data_structures as ds
+from unix_fs import system
+from unix_fs import utils
+
+BLOCK_SIZE = 4096
+NUM_FILES = 5000
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print('{:<50} {:8.3f} s'.format(label, elapsed))
+    return result
+
+
+def count_io(disk) -> dict:
+    """ Counts the read and write calls of disk """
+    counts = {'reads': 0, 'writes': 0}
+
+    def counted(name, method):
+        def counted_method(*args):
+            counts[name] += 1
+            return method(*args)
+        return counted_method
+    disk._read_raw, disk._readinto_raw, disk._preadv = [counted('reads', method) for method in
+                                                        [disk._read_raw, disk._readinto_raw, disk._preadv]]
+    disk._write_raw, disk._pwritev = [counted('writes', method) for method in [disk._write_raw, disk._pwritev]]
+    return counts
+
+
+def workload(path, inline):
+    system.INLINE_DATA = inline
+    rng = random.Random(0)
+    data = [bytes(rng.randint(1, ds.Inode().max_inline)) for _ in range(NUM_FILES)]
+    disk = utils.mount(path)
+    freelist = ds.DataBlockFreeList.for_device(disk)
+    num_free = freelist.num_free
+    counts = count_io(disk)
+    inodes = system.InodeCache.for_device(disk)
+
+    def create():
+        indices = []
+        for d in data:
+            f = inodes.create(system.File)
+            f.write(d)
+            inodes.release(f)
+            indices.append(f.index)
+        disk.sync()
+        return indices
+    indices = bench('  create {} files'.format(NUM_FILES), create)
+    print('  device writes: {}, data blocks used: {}'.format(counts['writes'], num_free - freelist.num_free))
+    disk.close()
+
+    disk = utils.mount(path)
+    counts = count_io(disk)
+
+    def read():
+        for index in indices:
+            system.File(device=disk, index=index).read()
+    bench('  read them back', read)
+    print('  device reads: {}'.format(counts['reads']))
+    disk.close()
+
+
+def main():
+    for inline in [False, True]:
+        print('inline data' if inline else 'data in blocks')
+        _, path = tempfile.mkstemp()
+        try:
+            utils.makefs(path, block_size=BLOCK_SIZE, num_inodes=NUM_FILES + 1, num_data_blocks=NUM_FILES + 64)
+            workload(path, inline)
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
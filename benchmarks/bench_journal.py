@@ -0,0 +1,99 @@
+"""
+Benchmark metadata-heavy workloads with and without the journal: small files created and made durable one by one,
+and by many threads at once, where concurrent commits share an fsync
+
+Run with: python -m benchmarks.bench_journal
+
+Author: Angad Gill
+"""
+import os
+import tempfile
+import threading
+import time
+
+from unix_fs import data_structures as ds
+from unix_fs import journal
+from unix_fs import system
+from unix_fs import utils
+
+NUM_FILES = 2000
+NUM_THREADS = 8
+JOURNAL_BLOCKS = journal.DEFAULT_JOURNAL_BLOCKS
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print('{:<50} {:8.3f} s'.format(label, elapsed))
+    return result
+
+
+def count_io(disk) -> dict:
+    """ Counts the write calls and fsyncs of disk """
+    counts = {'writes': 0, 'fsyncs': 0}
+    write_raw, pwritev, fsync = disk._write_raw, disk._pwritev, disk.fsync
+
+    def counted_write_raw(*args):
+        counts['writes'] += 1
+        return write_raw(*args)
+
+    def counted_pwritev(*args):
+        counts['writes'] += 1
+        return pwritev(*args)
+
+    def counted_fsync():
+        counts['fsyncs'] += 1
+        return fsync()
+    disk._write_raw, disk._pwritev, disk.fsync = counted_write_raw, counted_pwritev, counted_fsync
+    return counts
+
+
+def create_files(disk, first: int, count: int, durable) -> None:
+    """ Creates count small files in the root Directory, calling durable() after each """
+    inodes = system.InodeCache.for_device(disk)
+    root = inodes.get(ds.ROOT_INODE)
+    for i in range(first, first + count):
+        f = inodes.create(system.File)
+        root.add('f{}'.format(i), f.index)
+        f.write(b'x' * 100)
+        inodes.release(f)
+        durable()
+    inodes.release(root)
+
+
+def workload(journal_blocks, threads):
+    _, path = tempfile.mkstemp()
+    try:
+        utils.makefs(path, block_size=4096, num_inodes=NUM_FILES + 1, num_data_blocks=4 * NUM_FILES,
+                     journal_blocks=journal_blocks)
+        disk = utils.mount(path, cache_size=256)
+        counts = count_io(disk)
+        if journal_blocks:
+            durable = disk.sync  # commits the journal
+        else:
+            def durable():
+                disk.sync()
+                disk.fsync()
+        per_thread = NUM_FILES // threads
+        workers = [threading.Thread(target=create_files, args=(disk, i * per_thread, per_thread, durable))
+                   for i in range(threads)]
+        bench('  create {} files, durable after each, {} thread(s)'.format(NUM_FILES, threads),
+              lambda: [[worker.start() for worker in workers], [worker.join() for worker in workers]])
+        print('  writes: {writes}, fsyncs: {fsyncs}'.format(**counts))
+        if disk.journal is not None:
+            print('  journal: {}'.format(disk.journal.stats))
+        disk.close()
+    finally:
+        os.remove(path)
+
+
+def main():
+    for journal_blocks in [0, JOURNAL_BLOCKS]:
+        for threads in [1, NUM_THREADS]:
+            print('journal of {} blocks'.format(journal_blocks) if journal_blocks else 'no journal')
+            workload(journal_blocks, threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark sequential and random reads across a large file mapped with indirect blocks
+
+Run with: python -m benchmarks.bench_large_file
+
+Author: Angad Gill
+"""
+import os
+import random
+import tempfile
+import time
+
+from unix_fs import data_structures as ds
+from unix_fs import system
+from unix_fs import utils
+
+BLOCK_SIZE = 4096
+NUM_DATA_BLOCKS = 6000
+FILE_BLOCKS = 2500  # past the single indirect block, into the double indirect block
+NUM_RANDOM_READS = 5000
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print('{:<50} {:8.3f} s'.format(label, elapsed))
+    return result
+
+
+def main():
+    _, path = tempfile.mkstemp()
+    try:
+        utils.makefs(path, block_size=BLOCK_SIZE, num_data_blocks=NUM_DATA_BLOCKS)
+        disk = utils.mount(path)
+        # Use every other block so the file is too fragmented for extents and is mapped with block pointers
+        ds.DataBlockFreeList.for_device(disk).list = [i % 2 == 1 for i in range(NUM_DATA_BLOCKS)]
+        f = system.File(device=disk)
+        data = bytes(ord('a') + i % 26 for i in range(BLOCK_SIZE)) * FILE_BLOCKS
+        bench('write {} blocks'.format(FILE_BLOCKS), lambda: f.write(data))
+        print('extent mode: {}, indirect: {}, double indirect: {}'.format(
+            f.is_extent_mode, f.address_indirect, f.address_double_indirect))
+
+        f = system.File(device=disk, index=f.index)
+        output = bench('sequential read of {} blocks'.format(FILE_BLOCKS), f.read)
+        assert output == data
+        buffer = bytearray(len(data))
+        bench('sequential preadinto of {} blocks'.format(FILE_BLOCKS), lambda: f.preadinto(0, buffer))
+        assert buffer == data
+
+        random.seed(0)
+        logical_blocks = [random.randrange(FILE_BLOCKS) for _ in range(NUM_RANDOM_READS)]
+        bench('{} logical to physical lookups'.format(NUM_RANDOM_READS),
+              lambda: [f._block_address(i) for i in logical_blocks])
+        bench('{} random block reads'.format(NUM_RANDOM_READS),
+              lambda: [ds.DataBlock(device=disk, index=f._block_address(i)).data for i in logical_blocks])
+        disk.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
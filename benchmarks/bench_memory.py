@@ -0,0 +1,61 @@
+"""
+Benchmark the memory held per cached Inode, DirectoryBlock and InodeTable record
+
+Run with: python -m benchmarks.bench_memory
+
+Author: Angad Gill
+"""
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from unix_fs import data_structures as ds
+from unix_fs import system
+from unix_fs import utils
+
+BLOCK_SIZE = 4096
+NUM_INODES = 1000000
+NUM_OBJECTS = 100000
+
+
+def measure(label, func, count):
+    """ Prints the bytes allocated per object by func, which must return the objects so they stay alive """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    objects = func()
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<50} {:8.1f} bytes/object  {:8.3f} s'.format(label, size / count, elapsed))
+    return objects
+
+
+def main():
+    _, path = tempfile.mkstemp()
+    try:
+        utils.makefs(path, block_size=BLOCK_SIZE, num_inodes=NUM_INODES)
+        disk = utils.mount(path)
+        measure('{} Inodes'.format(NUM_OBJECTS),
+                lambda: [ds.Inode.from_allocated(disk, i) for i in range(NUM_OBJECTS)], NUM_OBJECTS)
+        measure('{} Files'.format(NUM_OBJECTS),
+                lambda: [system.File.from_allocated(disk, i) for i in range(NUM_OBJECTS)], NUM_OBJECTS)
+        measure('{} DirectoryBlocks'.format(NUM_OBJECTS // 10),
+                lambda: [ds.DirectoryBlock.from_allocated(disk, i) for i in range(NUM_OBJECTS // 10)],
+                NUM_OBJECTS // 10)
+        if hasattr(ds, 'InodeTable'):
+            def load_table():
+                table = ds.InodeTable.for_device(disk)
+                for i in range(0, NUM_INODES, disk.layout.inodes_per_block):
+                    table.read(i)
+                return table
+            measure('InodeTable of {} Inodes'.format(NUM_INODES), load_table, NUM_INODES)
+        disk.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
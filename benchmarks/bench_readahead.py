@@ -0,0 +1,83 @@
+"""
+Benchmark sequential File reads in small chunks, as FUSE reads files, with readahead off, reading ahead in the
+reader thread and reading ahead in the background
+
+Run with: python -m benchmarks.bench_readahead
+
+Author: Angad Gill
+"""
+import os
+import tempfile
+import time
+
+from unix_fs import system
+from unix_fs import utils
+
+BLOCK_SIZE = 4096
+FILE_BLOCKS = 8192
+CACHE_SIZE = 1024
+CHUNK_SIZE = BLOCK_SIZE
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print('{:<50} {:8.3f} s'.format(label, elapsed))
+    return result
+
+
+def count_reads(disk) -> dict:
+    counts = {'reads': 0}
+    read_raw, readinto_raw, preadv = disk._read_raw, disk._readinto_raw, disk._preadv
+
+    def counted_read_raw(*args):
+        counts['reads'] += 1
+        return read_raw(*args)
+
+    def counted_readinto_raw(*args):
+        counts['reads'] += 1
+        return readinto_raw(*args)
+
+    def counted_preadv(*args):
+        counts['reads'] += 1
+        return preadv(*args)
+    disk._read_raw, disk._readinto_raw, disk._preadv = counted_read_raw, counted_readinto_raw, counted_preadv
+    return counts
+
+
+def workload(path, index, mode):
+    disk = utils.mount(path, cache_size=CACHE_SIZE)
+    if mode == 'off':
+        disk.prefetch = lambda block_pos, n_blocks: None
+    else:
+        disk.readahead = system.Readahead(disk, background=mode == 'background')
+    counts = count_reads(disk)
+    f = system.File(device=disk, index=index)
+
+    def read():
+        for offset in range(0, f.size, CHUNK_SIZE):
+            f.pread(offset, CHUNK_SIZE)
+    bench('  read {} blocks in {} byte chunks'.format(FILE_BLOCKS, CHUNK_SIZE), read)
+    print('  device reads: {}, cache: {}'.format(counts['reads'], disk.cache.stats))
+    disk.close()
+
+
+def main():
+    _, path = tempfile.mkstemp()
+    try:
+        utils.makefs(path, block_size=BLOCK_SIZE, num_inodes=2, num_data_blocks=FILE_BLOCKS + 64)
+        disk = utils.mount(path)
+        f = system.File(device=disk)
+        f.write(os.urandom(FILE_BLOCKS * BLOCK_SIZE))
+        index = f.index
+        disk.close()
+        for mode in ['off', 'sync', 'background']:
+            print('readahead {}'.format(mode))
+            workload(path, index, mode)
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Benchmark a mostly empty file, like a VM image: a few blocks written far apart in a large file, written sparse (a
+hole up to each write) and dense (zeros written up to each write), then read back in full
+
+Run with: python -m benchmarks.bench_sparse
+
+Author: Angad Gill
+"""
+import os
+import tempfile
+import time
+
+from unix_fs import data_structures as ds
+from unix_fs import system
+from unix_fs import utils
+
+BLOCK_SIZE = 4096
+FILE_BLOCKS = 16384
+STRIDE = 256  # blocks between two written blocks
+
+
+def bench(label, func):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print('{:<50} {:8.3f} s'.format(label, elapsed))
+    return result
+
+
+def workload(path, sparse):
+    disk = utils.mount(path)
+    freelist = ds.DataBlockFreeList.for_device(disk)
+    num_free = freelist.num_free
+    f = system.File(device=disk)
+    block = b'x' * BLOCK_SIZE
+
+    def write():
+        for logical in range(0, FILE_BLOCKS, STRIDE):
+            if not sparse:
+                f.write(bytes(logical * BLOCK_SIZE - f.size))
+            f.pwrite(logical * BLOCK_SIZE, block)
+    bench('  write {} blocks of a {} block file'.format(FILE_BLOCKS // STRIDE, FILE_BLOCKS), write)
+    bench('  read the whole file', f.read)
+    print('  data blocks used: {}'.format(num_free - freelist.num_free))
+    disk.close()
+
+
+def main():
+    for sparse in [False, True]:
+        print('sparse' if sparse else 'dense')
+        _, path = tempfile.mkstemp()
+        try:
+            utils.makefs(path, block_size=BLOCK_SIZE, num_inodes=2, num_data_blocks=FILE_BLOCKS + 64)
+            workload(path, sparse)
+        finally:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
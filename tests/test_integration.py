@@ -3,9 +3,13 @@
 import unittest
 import subprocess
 import os
+import threading
+
+from unix_fs import utils
 
 MOUNTPOINT = 'tempfs_mountpoint'
 ROOT = 'tempfs_root'
+IMAGE = 'tempfs_image'
 
 class TestFileSystem(unittest.TestCase):
     """ Base test class for file systems with helper functions """
@@ -112,5 +116,101 @@ class TestLoopback(TestFileSystem):
         self.assertTrue(self.dir_exists(dirpath))
         self.delete_dir(dirpath)
 
+class TestUnixFS(TestFileSystem):
+    """ Names are short: unix_fs entries have at most MAX_FILENAME_LENGTH bytes """
+    @classmethod
+    def setUpClass(self):
+        """ Runs before first test is run """
+        if not os.path.exists(MOUNTPOINT):
+            os.makedirs(MOUNTPOINT)
+        utils.makefs(IMAGE, block_size=4096, num_inodes=1000, num_data_blocks=10000)
+        # mount file system
+        command = 'python -m unix_fs.unix_fs {} {} background'.format(IMAGE, MOUNTPOINT)
+        subprocess.call(command, shell=True)
+
+    @classmethod
+    def tearDownClass(self):
+        """ Runs after last test is run """
+        # unmount file system
+        command = 'umount UnixFS'
+        subprocess.call(command, shell=True)
+        os.removedirs(MOUNTPOINT)
+        os.remove(IMAGE)
+
+    def test_ls(self):
+        self.assertCommandSuccessful('ls {}'.format(MOUNTPOINT))
+
+    def test_file_create_delete(self):
+        filepath = self.name_to_path('f1')
+        self.create_file(filepath)
+        self.assertTrue(self.file_exists(filepath))
+        self.delete_file(filepath)
+        self.assertFalse(self.file_exists(filepath))
+
+    def test_file_write_read(self):
+        test_text = "this is the test text" * 1000
+        filepath = self.name_to_path('f2')
+        with open(filepath, 'w') as f:
+            f.write(test_text)
+        with open(filepath, 'r') as f:
+            text = f.read()
+        self.delete_file(filepath)
+        self.assertEqual(text, test_text)
+
+    def test_file_truncate(self):
+        filepath = self.name_to_path('f3')
+        with open(filepath, 'w') as f:
+            f.write('0123456789')
+        os.truncate(filepath, 4)
+        with open(filepath, 'r') as f:
+            text = f.read()
+        self.delete_file(filepath)
+        self.assertEqual(text, '0123')
+
+    def test_file_fsync(self):
+        filepath = self.name_to_path('f4')
+        with open(filepath, 'w') as f:
+            f.write('0123456789')
+            f.flush()
+            os.fsync(f.fileno())
+        with open(filepath, 'r') as f:
+            text = f.read()
+        self.delete_file(filepath)
+        self.assertEqual(text, '0123456789')
+
+    def test_dir_create_delete(self):
+        dirpath = self.name_to_path('d1')
+        self.create_dir(dirpath)
+        self.assertTrue(self.dir_exists(dirpath))
+        os.rmdir(dirpath)
+        self.assertFalse(self.dir_exists(dirpath))
+
+    def test_rename(self):
+        dirpath = self.name_to_path('d2')
+        self.create_dir(dirpath)
+        filepath = self.name_to_path('f4')
+        with open(filepath, 'w') as f:
+            f.write('test')
+        os.rename(filepath, os.path.join(dirpath, 'f5'))
+        self.assertEqual(os.listdir(dirpath), ['f5'])
+        self.delete_file(os.path.join(dirpath, 'f5'))
+        os.rmdir(dirpath)
+
+    def test_concurrent_write_read(self):
+        def worker(i):
+            filepath = self.name_to_path('c{}'.format(i))
+            with open(filepath, 'wb') as f:
+                f.write(bytes([i]) * 100000)
+            with open(filepath, 'rb') as f:
+                results[i] = f.read() == bytes([i]) * 100000
+            self.delete_file(filepath)
+        results = {}
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {i: True for i in range(8)})
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
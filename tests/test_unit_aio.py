@@ -0,0 +1,125 @@
+"""
+Unit tests for unix_fs/aio.py
+
+Author: Angad Gill
+"""
+
+import asyncio
+import os
+import unittest
+from importlib import reload
+
+from unix_fs import aio
+from unix_fs import device_io
+from unix_fs import data_structures as ds
+from unix_fs import system
+from unix_fs import utils
+
+PATH = 'temp_unit_test_file'
+
+
+class TestAsyncFS(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        reload(device_io)
+        reload(ds)
+        reload(system)
+        reload(utils)
+        reload(aio)
+
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH)
+        self.disk = utils.mount(PATH, cache_size=64)
+
+    def tearDown(self):
+        self.disk.close()
+        os.remove(PATH)
+
+    def run_fs(self, coroutine):
+        """ Runs coroutine(fs) on a new AsyncFS and closes it """
+        async def main():
+            fs = aio.AsyncFS(self.disk)
+            try:
+                return await coroutine(fs)
+            finally:
+                await fs.close()
+        return asyncio.run(main())
+
+    def test_create_write_read(self):
+        data = bytes(range(ds.BLOCK_SIZE)) * 3
+
+        async def run(fs):
+            async with await fs.create('/f') as f:
+                self.assertEqual(await f.write(data[:70]), 70)
+                self.assertEqual(await f.write(data[70:]), len(data) - 70)
+            async with await fs.open('/f') as f:
+                return await f.read(), await f.pread(ds.BLOCK_SIZE - 5, 10)
+        self.assertEqual(self.run_fs(run), (data, data[ds.BLOCK_SIZE - 5:ds.BLOCK_SIZE + 5]))
+        self.assertEqual(system.File(device=self.disk, index=system.resolve(self.disk, '/f')).read(), data)
+
+    def test_pread_past_end(self):
+        async def run(fs):
+            async with await fs.create('/f') as f:
+                await f.write(b'abc')
+                return await f.pread(1, 100), await f.pread(3, 1)
+        self.assertEqual(self.run_fs(run), (b'bc', b''))
+
+    def test_open_errors(self):
+        async def run(fs):
+            await (await fs.create('/f')).close()
+            with self.assertRaises(FileNotFoundError):
+                await fs.open('/g')
+            with self.assertRaises(IsADirectoryError):
+                await fs.open('/')
+            with self.assertRaises(FileExistsError):
+                await fs.create('/f')
+            with self.assertRaises(NotADirectoryError):
+                await fs.create('/f/g')
+        self.run_fs(run)
+
+    def test_readdir(self):
+        async def run(fs):
+            await asyncio.gather(*[(await fs.create('/f{}'.format(i))).close() for i in range(3)])
+            return await fs.readdir('/')
+        self.assertEqual(sorted(self.run_fs(run)), ['f0', 'f1', 'f2'])
+
+    def test_coalesced_reads(self):
+        data = b't' * (ds.BLOCK_SIZE * 4)
+
+        async def run(fs):
+            async with await fs.create('/f') as f:
+                await f.write(data)
+                reads = await asyncio.gather(*[f.read() for _ in range(10)])
+            return reads, fs.reads, fs.coalesced
+        reads, num_reads, coalesced = self.run_fs(run)
+        self.assertEqual(reads, [data] * 10)
+        self.assertEqual(num_reads, 1)
+        self.assertEqual(coalesced, 9 * 4)
+
+    def test_read_after_write(self):
+        async def run(fs):
+            async with await fs.create('/f') as f:
+                await f.write(b'a' * ds.BLOCK_SIZE)
+                first = asyncio.ensure_future(f.read())
+                await asyncio.sleep(0)
+                write = asyncio.ensure_future(f.pwrite(0, b'b' * ds.BLOCK_SIZE))
+                await asyncio.sleep(0)
+                second = asyncio.ensure_future(f.read())
+                await write
+                return await first, await second
+        first, second = self.run_fs(run)
+        self.assertIn(first, [b'a' * ds.BLOCK_SIZE, b'b' * ds.BLOCK_SIZE])  # concurrent with the write
+        self.assertEqual(second, b'b' * ds.BLOCK_SIZE)
+
+    def test_close_releases(self):
+        async def run(fs):
+            f = await fs.create('/f')
+            self.assertEqual(fs.inodes.stats['referenced'], 1)
+            await f.close()
+            return fs.inodes.stats['referenced']
+        self.assertEqual(self.run_fs(run), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,8 @@ Author: Angad Gill
 """
 
 import os
+import sys
+import threading
 import unittest
 from importlib import reload
 
@@ -180,7 +182,8 @@ class TestSuperBlock(TestDataStructures):
         self.cls = ds.SuperBlock()
         expected = b'\x1e\x00\x00\x00\x00\x00\x00\x00' + \
                    b'\x0A\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                   b'\x64\x00\x00\x00\x00\x00\x00\x00' + \
+                   b'\x00\x00\x00\x00\x00\x00'
         output = bytes(self.cls)
         self.assertEqual(output, expected)
 
@@ -189,8 +192,9 @@ class TestSuperBlock(TestDataStructures):
         self.cls = ds.SuperBlock()
         input_data = b'\x1e\x00\x00\x00\x00\x00\x00\x00' + \
                      b'\x0A\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        expected = [30, 10]
+                     b'\x64\x00\x00\x00\x00\x00\x00\x00' + \
+                     b'\x00\x00\x00\x00\x00\x00'
+        expected = [30, 10, 100]
         output = self.cls.__decode__(input_data)
         self.assertEqual(output, expected)
 
@@ -199,8 +203,9 @@ class TestSuperBlock(TestDataStructures):
         self.cls = ds.SuperBlock()
         input_data = b'\x0A\x00\x00\x00\x00\x00\x00\x00' + \
                      b'\x0A\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        expected = [10, 10]
+                     b'\x64\x00\x00\x00\x00\x00\x00\x00' + \
+                     b'\x00\x00\x00\x00\x00\x00'
+        expected = [10, 10, 100]
         output = self.cls.__decode__(input_data)
         self.assertEqual(output, expected)
 
@@ -208,40 +213,47 @@ class TestSuperBlock(TestDataStructures):
         self.cls = ds.SuperBlock(None)
         input_data = b'\x1e\x00\x00\x00\x00\x00\x00\x00' + \
                      b'\x0A\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        expected = [30, 10]
+                     b'\x64\x00\x00\x00\x00\x00\x00\x00' + \
+                     b'\x00\x00\x00\x00\x00\x00'
+        expected = [30, 10, 100]
         output = self.cls.__decode__(input_data)
         self.assertEqual(output, expected)
 
     def test_read_1(self):
         input_data = b'\x1e\x00\x00\x00\x00\x00\x00\x00' + \
                      b'\x0A\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                     b'\x64\x00\x00\x00\x00\x00\x00\x00' + \
+                     b'\x00\x00\x00\x00\x00\x00'
         with open(PATH, 'wb') as f:
             f.write(input_data)
         device = device_io.Disk(PATH)
         self.cls = ds.SuperBlock(device)
         self.assertEqual(self.cls.block_size, 30)
         self.assertEqual(self.cls.num_inodes, 10)
+        self.assertEqual(self.cls.num_data_blocks, 100)
 
     def test_read_2(self):
         input_data = b'\x0A\x00\x00\x00\x00\x00\x00\x00' + \
                      b'\x0A\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                     b'\x64\x00\x00\x00\x00\x00\x00\x00' + \
+                     b'\x00\x00\x00\x00\x00\x00'
         with open(PATH, 'wb') as f:
             f.write(input_data)
         device = device_io.Disk(PATH)
         self.cls = ds.SuperBlock(device)
         self.assertEqual(self.cls.block_size, 10)
         self.assertEqual(self.cls.num_inodes, 10)
+        self.assertEqual(self.cls.num_data_blocks, 100)
 
     def test_write_1(self):
         ds.BLOCK_SIZE = 30
         device_io.BLOCK_SIZE = 30
         ds.NUM_INODES = 10
+        ds.NUM_DATA_BLOCKS = 100
         expected = b'\x1e\x00\x00\x00\x00\x00\x00\x00' + \
                    b'\x0A\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                   b'\x64\x00\x00\x00\x00\x00\x00\x00' + \
+                   b'\x00\x00\x00\x00\x00\x00'
         self.cls = ds.SuperBlock(None)
         self.cls._device = device_io.Disk(PATH)
         self.cls.__write__()
@@ -254,9 +266,10 @@ class TestSuperBlock(TestDataStructures):
         device_io.BLOCK_SIZE = 20
         device_io.BLOCK_SIZE = 20
         ds.NUM_INODES = 10
+        ds.NUM_DATA_BLOCKS = 100
         expected = b'\x14\x00\x00\x00\x00\x00\x00\x00' + \
                    b'\x0A\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x00\x00\x00\x00'
+                   b'\x64\x00\x00\x00\x00\x00\x00\x00'
         self.cls = ds.SuperBlock(None)
         self.cls._device = device_io.Disk(PATH)
         self.cls.__write__()
@@ -265,11 +278,80 @@ class TestSuperBlock(TestDataStructures):
         self.assertEqual(output, expected)
 
 
+class TestLayout(TestDataStructures):
+    def setUp(self):
+        ds.BLOCK_SIZE = 50
+        device_io.BLOCK_SIZE = 50
+        ds.NUM_INODES = 10
+        ds.NUM_DATA_BLOCKS = 100
+        self.cls = ds.Layout()
+        open(PATH, 'a').close()
+
+    def tearDown(self):
+        del self.cls
+        os.remove(PATH)
+
+    def test_region_starts(self):
+        self.assertEqual(self.cls.inode_start, 1)
+        self.assertEqual(self.cls.inode_blocks, 3)
+        self.assertEqual(self.cls.inode_freelist_start, 31)
+        self.assertEqual(self.cls.data_block_freelist_start, 32)
+        self.assertEqual(self.cls.data_start, 33)
+
+    def test_from_superblock(self):
+        superblock = ds.SuperBlock()
+        superblock.num_inodes = 20
+        self.cls = ds.Layout.from_superblock(superblock)
+        self.assertEqual(self.cls.inode_freelist_start, 61)
+        self.assertEqual(self.cls.data_start, 63)
+
+    def test_from_superblock_block_size(self):
+        superblock = ds.SuperBlock()
+        superblock.block_size = 30
+        superblock.num_data_blocks = 300
+        self.cls = ds.Layout.from_superblock(superblock)
+        self.assertEqual(self.cls.block_size, 30)
+        self.assertEqual(self.cls.num_data_blocks, 300)
+        self.assertEqual(self.cls.inode_blocks, 5)
+        self.assertEqual(self.cls.inode_freelist_start, 51)
+        self.assertEqual(self.cls.data_block_freelist_start, 52)
+        self.assertEqual(self.cls.data_start, 54)
+
+    def test_packed_inodes(self):
+        self.cls = ds.Layout(block_size=4096, num_inodes=100)
+        self.assertEqual(self.cls.inodes_per_block, 4096 // self.cls.inode_size)
+        self.assertEqual(self.cls.inode_blocks, 1)
+        self.assertEqual(self.cls.inode_freelist_start, 1 + -(-100 // self.cls.inodes_per_block))
+
+    def test_computed_once_per_device(self):
+        device = device_io.Disk(PATH)
+        inode = ds.Inode(index=3)
+        inode._device = device
+        self.assertEqual(inode.address, 10)
+        block = ds.DataBlock(index=0)
+        block._device = device
+        self.assertIs(block._layout, device.layout)
+
+
 class TestInode(TestDataStructures):
+    # i_type=1, address_direct=[1, 2, 3, 4, 5], flags=0, no extents, no indirect blocks, size=0
+    inode_bytes = b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
+                  b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
+                  b'\x02\x00\x00\x00\x00\x00\x00\x00' + \
+                  b'\x03\x00\x00\x00\x00\x00\x00\x00' + \
+                  b'\x04\x00\x00\x00\x00\x00\x00\x00' + \
+                  b'\x05\x00\x00\x00\x00\x00\x00\x00' + \
+                  b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
+                  bytes(8 * 8) + \
+                  bytes(2 * 8) + \
+                  bytes(8)
+    inode_blocks = 3  # 144 bytes in 50 byte blocks
+
     def setUp(self):
         ds.BLOCK_SIZE = 50
         device_io.BLOCK_SIZE = 50
         ds.INODE_NUM_DIRECT_BLOCKS = 5
+        ds.INODE_NUM_EXTENTS = 4
         ds.NUM_INODES = 10
         self.cls = ds.Inode()
         open(PATH, 'a').close()
@@ -283,34 +365,62 @@ class TestInode(TestDataStructures):
         self.cls.index = 2
         self.cls.i_type = 1
         self.cls.address_direct = [1, 2, 3, 4, 5]
+        output = bytes(self.cls)
+        self.assertEqual(output, self.inode_bytes)
+
+    def test_bytes_extents(self):
+        self.cls = ds.Inode()
+        self.cls.i_type = 1
+        self.cls.flags = ds.INODE_FLAG_EXTENTS
+        self.cls.extents = [ds.Extent(3, 2)] + [ds.Extent(0, 0)] * 3
         expected = b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
+                   bytes(5 * 8) + \
                    b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x02\x00\x00\x00\x00\x00\x00\x00' + \
                    b'\x03\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x04\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x05\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                   b'\x02\x00\x00\x00\x00\x00\x00\x00' + \
+                   bytes(6 * 8) + \
+                   bytes(2 * 8) + \
+                   bytes(8)
         output = bytes(self.cls)
         self.assertEqual(output, expected)
 
-    def test_write_1(self):
-        write_data = bytes(ds.BLOCK_SIZE)+ \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    def test_bytes_inline(self):
+        self.cls = ds.Inode()
+        self.cls.i_type = 1
+        self.cls.flags = ds.INODE_FLAG_INLINE
+        self.cls._inline = b'inline data'
+        self.cls.size = len(self.cls._inline)
+        expected = b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
+                   b'inline d' + \
+                   b'ata\x00\x00\x00\x00\x00' + \
+                   bytes(3 * 8) + \
+                   b'\x02\x00\x00\x00\x00\x00\x00\x00' + \
+                   bytes(8 * 8) + \
+                   bytes(2 * 8) + \
+                   b'\x0b\x00\x00\x00\x00\x00\x00\x00'
+        output = bytes(self.cls)
+        self.assertEqual(output, expected)
 
+    def test_read_inline(self):
+        data = bytes(range(1, self.cls.max_inline + 1))
+        self.cls.i_type = 1
+        self.cls.flags = ds.INODE_FLAG_INLINE
+        self.cls._inline = data
+        self.cls.size = len(data)
+        inode = ds.Inode()
+        inode._items = self.cls._items
+        self.assertEqual(self.cls.max_inline, 15 * 8)
+        self.assertTrue(inode.is_inline)
+        self.assertEqual(inode._inline, data)
+        self.assertEqual(inode.address_direct, [0] * 5)
+        self.assertEqual(inode._block_indices(), [])
+
+    def test_write_1(self):
+        write_data = bytes(ds.BLOCK_SIZE) + bytes(len(self.inode_bytes))
         with open(PATH, 'wb') as f:
             f.write(write_data)
 
-        expected = bytes(ds.BLOCK_SIZE)+ \
-                   b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x02\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x03\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x04\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x05\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+        expected = bytes(ds.BLOCK_SIZE) + self.inode_bytes
 
         self.cls = ds.Inode(device=device_io.Disk(PATH), index=0)
         self.cls.i_type = 1
@@ -321,24 +431,12 @@ class TestInode(TestDataStructures):
         self.assertEqual(output, expected)
 
     def test_write_2(self):
-        write_data = bytes(ds.BLOCK_SIZE * 3) + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-
+        offset = ds.BLOCK_SIZE * (1 + 2 * self.inode_blocks)
+        write_data = bytes(offset) + bytes(len(self.inode_bytes))
         with open(PATH, 'wb') as f:
             f.write(write_data)
 
-        expected = bytes(ds.BLOCK_SIZE * 3)+ \
-                   b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x02\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x03\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x04\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x05\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+        expected = bytes(offset) + self.inode_bytes
         self.cls = ds.Inode(device=device_io.Disk(PATH), index=2)
         self.cls.i_type = 1
         self.cls.address_direct = [1, 2, 3, 4, 5]
@@ -348,14 +446,8 @@ class TestInode(TestDataStructures):
         self.assertEqual(output, expected)
 
     def test_read_1(self):
-        input_data = bytes(ds.BLOCK_SIZE ) + \
-                     b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x02\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x03\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x04\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x05\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        expected = [1, 1, 2, 3, 4, 5]
+        input_data = bytes(ds.BLOCK_SIZE) + self.inode_bytes
+        expected = [1, 1, 2, 3, 4, 5, 0] + [0] * 8 + [0, 0] + [0]
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.Inode(device=device_io.Disk(PATH), index=0)
@@ -363,14 +455,8 @@ class TestInode(TestDataStructures):
         self.assertEqual(output, expected)
 
     def test_read_2(self):
-        input_data = bytes(ds.BLOCK_SIZE * 3) + \
-                     b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x01\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x02\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x03\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x04\x00\x00\x00\x00\x00\x00\x00' + \
-                     b'\x05\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        expected = [1, 1, 2, 3, 4, 5]
+        input_data = bytes(ds.BLOCK_SIZE * (1 + 2 * self.inode_blocks)) + self.inode_bytes
+        expected = [1, 1, 2, 3, 4, 5, 0] + [0] * 8 + [0, 0] + [0]
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.Inode(device=device_io.Disk(PATH), index=2)
@@ -378,8 +464,7 @@ class TestInode(TestDataStructures):
         self.assertEqual(output, expected)
 
     def test_allocate_with_device(self):
-        input_data = bytes(ds.SuperBlock()) + \
-                     bytes(ds.NUM_INODES * ds.BLOCK_SIZE) + \
+        input_data = bytes(ds.Layout().inode_freelist_start * ds.BLOCK_SIZE) + \
                      bytes(ds.InodeFreeList())
         with open(PATH, 'wb') as f:
             f.write(input_data)
@@ -391,8 +476,7 @@ class TestInode(TestDataStructures):
             self.cls.allocate()
 
     def test_deallocate_with_device(self):
-        input_data = bytes(ds.BLOCK_SIZE) + \
-                     bytes(ds.NUM_INODES * ds.BLOCK_SIZE) + \
+        input_data = bytes(ds.Layout().inode_freelist_start * ds.BLOCK_SIZE) + \
                      bytes(ds.InodeFreeList())
         with open(PATH, 'wb') as f:
             f.write(input_data)
@@ -405,16 +489,93 @@ class TestInode(TestDataStructures):
         with self.assertRaises(Exception):
             self.cls.deallocate()
 
-    def test_find_last_assigned_address(self):
-        self.cls.address_direct = [1, 2, 3, 0, 0]
-        output = self.cls._last_assigned_address()
-        self.assertEqual(output, 3)
+    def test_block_indices_extents(self):
+        self.cls.flags = ds.INODE_FLAG_EXTENTS
+        self.cls.extents = [ds.Extent(1, 2), ds.Extent(6, 3)] + [ds.Extent(0, 0)] * 2
+        self.assertEqual(self.cls._block_indices(), [1, 2, 6, 7, 8])
+
+    def test_holes_extents(self):
+        self.cls.flags = ds.INODE_FLAG_EXTENTS
+        self.cls.extents = [ds.Extent(0, 2), ds.Extent(6, 2)] + [ds.Extent(0, 0)] * 2
+        self.assertEqual(self.cls._block_indices(), [0, 0, 6, 7])
+        self.assertEqual(self.cls._block_address(1), 0)
+        self.assertEqual(self.cls._block_address(2), 6)
+        self.assertEqual(ds.to_extents([0, 0, 1, 2, 0, 5]),
+                         [ds.Extent(0, 2), ds.Extent(1, 2), ds.Extent(0, 1), ds.Extent(5, 1)])
+
+    def test_holes_block_pointers(self):
+        self.cls.address_direct = [0, 3, 0, 0, 0]
+        self.assertEqual(self.cls._block_indices(), [0, 3])
+        self.assertTrue(self.cls._has_blocks())
+
+    def test_add_extents_merges_adjacent(self):
+        self.cls.flags = ds.INODE_FLAG_EXTENTS
+        self.cls._add_extents([ds.Extent(1, 2)], write_through=False)
+        self.cls._add_extents([ds.Extent(3, 4), ds.Extent(9, 1)], write_through=False)
+        self.assertEqual(self.cls.extents, [ds.Extent(1, 6), ds.Extent(9, 1), ds.Extent(0, 0), ds.Extent(0, 0)])
+
+    def test_block_address_direct(self):
+        self.cls.address_direct = [4, 5, 0, 0, 0]
+        self.assertEqual(self.cls._block_address(1), 5)
+        self.assertEqual(self.cls._block_address(2), 0)
+        self.assertEqual(self.cls._block_address(ds.INODE_NUM_DIRECT_BLOCKS), 0)  # no indirect block yet
+
+    def test_block_address_extents(self):
+        self.cls.flags = ds.INODE_FLAG_EXTENTS
+        self.cls.extents = [ds.Extent(1, 2), ds.Extent(6, 3)] + [ds.Extent(0, 0)] * 2
+        self.assertEqual(self.cls._block_address(1), 2)
+        self.assertEqual(self.cls._block_address(2), 6)
+        self.assertEqual(self.cls._block_address(5), 0)
+
+    def test_max_blocks(self):
+        p = ds.IndirectBlock.num_pointers()
+        self.assertEqual(self.cls._max_blocks(), 5 + p + p * p)
+
+    def test_add_extents_overflow(self):
+        self.cls.flags = ds.INODE_FLAG_EXTENTS
+        with self.assertRaises(Exception):
+            self.cls._add_extents([ds.Extent(i * 2, 1) for i in range(5)], write_through=False)
+
+class TestInodeTable(TestDataStructures):
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH, block_size=4096, num_inodes=100)
+        self.disk = utils.mount(PATH)
+        self.cls = ds.InodeTable.for_device(self.disk)
+
+    def tearDown(self):
+        self.disk.close()
+        os.remove(PATH)
+
+    def test_read(self):
+        self.assertEqual(self.cls.read(ds.ROOT_INODE)[0], 2)  # root Directory
+        self.assertEqual(self.cls.read(1), (0,) * 18)
+
+    def test_write_read(self):
+        inode = ds.Inode(device=self.disk, index=30)
+        inode.i_type = 1
+        inode.size = 7
+        inode.__write__()
+        self.assertEqual(self.cls.read(30), tuple(inode._items))
+        # Written through to the device, without touching the other Inodes in the block
+        self.disk.inode_table = None
+        self.assertEqual(ds.Inode(device=self.disk, index=30).size, 7)
+        self.assertEqual(ds.Inode(device=self.disk, index=ds.ROOT_INODE).i_type, 2)
+
+    def test_grows_to_highest_inode(self):
+        inodes_per_block = self.disk.layout.inodes_per_block
+        self.cls.read(0)
+        self.assertEqual(self.cls.nbytes, inodes_per_block * self.disk.layout.inode_size + len(self.cls._loaded))
+        self.cls.read(99)
+        self.assertEqual(self.cls.nbytes, 100 * self.disk.layout.inode_size + len(self.cls._loaded))
+
+    def test_out_of_range(self):
+        with self.assertRaises(Exception):
+            self.cls.read(100)
 
-    def test_add_to_address_list(self):
-        block = ds.DataBlock()
-        block.index = 1
-        self.cls._add_to_address_list(block=block, write_through=False)
-        self.assertEqual(self.cls.address_direct, [1, 0, 0, 0, 0])
+    def test_slots(self):
+        for obj in [ds.Inode(), ds.DataBlock(), ds.IndirectBlock(), ds.DirectoryBlock(), ds.DirectoryHeader()]:
+            self.assertFalse(hasattr(obj, '__dict__'), obj.__class__)
 
 
 class TestFreeList(TestDataStructures):
@@ -431,14 +592,14 @@ class TestFreeList(TestDataStructures):
         reload(ds)
 
     def test_bytes(self):
-        expected = b'\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01' + \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+        expected = b'\xff\x03' + \
+                   bytes(18)
         output = bytes(self.cls)
         self.assertEqual(output, expected)
 
     def test_read(self):
-        input_data = b'\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+        input_data = b'\xff\x03' + \
+                     bytes(18)
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.FreeList(n=10, device=device_io.Disk(PATH))
@@ -447,8 +608,8 @@ class TestFreeList(TestDataStructures):
         self.assertEqual(output, expected)
 
     def test_write(self):
-        expected = b'\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01' + \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+        expected = b'\xff\x03' + \
+                   bytes(18)
         self.cls._device = device_io.Disk(PATH)
         self.cls.__write__()
         with open(PATH, 'rb') as f:
@@ -482,9 +643,116 @@ class TestFreeList(TestDataStructures):
         expected = [True, False] + [True]*8
         self.assertEqual(output, expected)
 
+    def test_allocate_next_fit_no_device(self):
+        for i in range(3):
+            _ = self.cls.allocate(write_through=False)
+        self.cls.deallocate(index=0, write_through=False)
+        self.assertEqual(self.cls.allocate(write_through=False), 3)
+
+    def test_allocate_wraps_around_no_device(self):
+        for i in range(10):
+            _ = self.cls.allocate(write_through=False)
+        self.cls.deallocate(index=2, write_through=False)
+        self.assertEqual(self.cls.allocate(write_through=False), 2)
+
+    def test_allocate_across_words_no_device(self):
+        self.cls = ds.FreeList(n=200)
+        self.cls.list = [False] * 150 + [True] * 50
+        self.assertEqual(self.cls.allocate(write_through=False), 150)
+        self.assertEqual(self.cls.num_free, 49)
+
+    def test_allocate_many_contiguous_no_device(self):
+        self.cls.list = [False, True, False] + [True] * 7
+        extents = self.cls.allocate_many(4, write_through=False)
+        self.assertEqual(extents, [ds.Extent(3, 4)])
+        self.assertEqual(self.cls.list, [False, True] + [False] * 5 + [True] * 3)
+
+    def test_allocate_many_near_contiguous_no_device(self):
+        self.cls.list = [True, False, True, True, False] + [False] * 4 + [True]
+        extents = self.cls.allocate_many(4, write_through=False)
+        self.assertEqual(extents, [ds.Extent(0, 1), ds.Extent(2, 2), ds.Extent(9, 1)])
+        self.assertEqual(self.cls.num_free, 0)
+
+    def test_allocate_many_not_contiguous_no_device(self):
+        self.cls.list = [True, False] + [True] * 8
+        extents = self.cls.allocate_many(3, contiguous=False, write_through=False)
+        self.assertEqual(extents, [ds.Extent(0, 1), ds.Extent(2, 2)])
+
+    def test_allocate_many_overflow_no_device(self):
+        with self.assertRaises(Exception):
+            self.cls.allocate_many(11, write_through=False)
+        self.assertEqual(self.cls.num_free, 10)
+
+    def test_deallocate_many_no_device(self):
+        extents = self.cls.allocate_many(5, write_through=False)
+        self.cls.deallocate_many(extents, write_through=False)
+        self.assertEqual(self.cls.list, [True] * 10)
+
+    def test_allocate_many_best_fit_no_device(self):
+        self.cls.list = [True] * 4 + [False] + [True] * 2 + [False] + [True] * 2
+        self.assertEqual(self.cls.allocate_many(2, write_through=False), [ds.Extent(5, 2)])
+        self.assertEqual(self.cls.allocate_many(2, write_through=False), [ds.Extent(8, 2)])
+        self.assertEqual(self.cls.allocate_many(3, write_through=False), [ds.Extent(0, 3)])
+
+    def test_allocate_many_leaves_room_to_grow_no_device(self):
+        self.cls = ds.FreeList(n=40)
+        self.cls.list = [True] * 2 + [False] + [True] * 20 + [False] + [True] * 16
+        self.assertEqual(self.cls.allocate_many(2, write_through=False), [ds.Extent(24, 2)])
+        self.assertEqual(self.cls.allocate_many(17, write_through=False), [ds.Extent(3, 17)])
+
+    def test_allocate_many_next_fit_no_device(self):
+        ds.BEST_FIT = False
+        self.cls.list = [True] * 4 + [False] + [True] * 2 + [False] + [True] * 2
+        self.assertEqual(self.cls.allocate_many(2, write_through=False), [ds.Extent(0, 2)])
+        self.assertEqual(self.cls.allocate_many(2, write_through=False), [ds.Extent(2, 2)])
+
+    def test_allocate_many_goal_no_device(self):
+        self.cls.list = [True] * 4 + [False] + [True] * 5
+        self.assertEqual(self.cls.allocate_many(2, write_through=False, goal=6), [ds.Extent(6, 2)])
+        self.assertEqual(self.cls.allocate_many(3, write_through=False, goal=6), [ds.Extent(0, 3)])
+        self.assertEqual(self.cls.allocate_many(2, write_through=False, goal=1), [ds.Extent(8, 2)])
+
+    def test_free_extents_follow_bitmap_no_device(self):
+        self.cls.list = [True, False] + [True] * 8
+        self.assertEqual(list(self.cls.free_extents), [ds.Extent(0, 1), ds.Extent(2, 8)])
+        index = self.cls.allocate(write_through=False)
+        extents = self.cls.allocate_many(3, write_through=False)
+        self.cls.deallocate(index, write_through=False)
+        self.cls.deallocate_many(extents, write_through=False)
+        self.cls.deallocate(1, write_through=False)
+        self.assertEqual(list(self.cls.free_extents), [ds.Extent(0, 10)])
+        self.cls._items = [b'\x0f\x00']
+        self.assertEqual(list(self.cls.free_extents), [ds.Extent(0, 4)])
+
+    def test_num_free_counted_no_device(self):
+        self.cls.deallocate(4, write_through=False)  # already free
+        self.cls.allocate_many(3, write_through=False)
+        self.cls.deallocate_many([ds.Extent(1, 5)], write_through=False)
+        self.assertEqual(self.cls.num_free, 9)
+        self.assertEqual(self.cls.num_free, self.cls.list.count(True))
+
+    def test_write_only_changed_blocks(self):
+        with open(PATH, 'wb') as f:
+            f.write(b'\xff' * 112 + b'\xef' + b'\xff' * 12 + bytes(15))  # item 900 used
+        self.cls = ds.FreeList(n=1000, device=device_io.Disk(PATH))
+        written = []
+        writev = self.cls._device.writev
+        self.cls._device.writev = lambda blocks: written.append(sorted(blocks)) or writev(blocks)
+        self.cls.allocate()
+        self.cls.deallocate(900)
+        self.cls.__write__()  # nothing changed
+        self.assertEqual(written, [[0], [900 // 8 // ds.BLOCK_SIZE]])
+        self.assertEqual(ds.FreeList(n=1000, device=device_io.Disk(PATH)).list, self.cls.list)
+
+    def test_bits_past_n_not_free(self):
+        self.cls = ds.FreeList(n=3)
+        self.cls._items = [b'\xff']
+        self.assertEqual(self.cls.list, [True] * 3)
+        self.assertEqual(self.cls.num_free, 3)
+
     def test_allocate_with_device(self):
-        input_data = b'\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+        input_data = b'\xff\x03' + \
+                     bytes(18)
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.FreeList(n=10, device=device_io.Disk(PATH))
@@ -495,8 +763,8 @@ class TestFreeList(TestDataStructures):
         self.assertEqual(output, expected)
 
     def test_deallocate_with_device(self):
-        input_data = b'\x00\x00\x00\x00\x01\x01\x01\x01\x01\x01' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+        input_data = b'\xf0\x03' + \
+                     bytes(18)
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.FreeList(n=10, device=device_io.Disk(PATH))
@@ -506,6 +774,35 @@ class TestFreeList(TestDataStructures):
         self.assertEqual(output, expected)
 
 
+class TestFreeExtents(unittest.TestCase):
+    def setUp(self):
+        self.extents = ds.FreeExtents([ds.Extent(2, 3), ds.Extent(10, 1), ds.Extent(20, 6)])
+
+    def test_add_merges(self):
+        self.extents.add(5, 5)
+        self.assertEqual(list(self.extents), [ds.Extent(2, 9), ds.Extent(20, 6)])
+        self.assertEqual(len(self.extents), 2)
+
+    def test_remove_splits(self):
+        self.extents.remove(22, 2)
+        self.extents.remove(2, 3)
+        self.assertEqual(list(self.extents), [ds.Extent(10, 1), ds.Extent(20, 2), ds.Extent(24, 2)])
+
+    def test_find(self):
+        self.assertEqual(self.extents.find(4), ds.Extent(2, 3))
+        self.assertIsNone(self.extents.find(5))
+
+    def test_best_fit(self):
+        self.assertEqual(self.extents.best_fit(1), ds.Extent(10, 1))
+        self.assertEqual(self.extents.best_fit(2), ds.Extent(2, 3))
+        self.assertIsNone(self.extents.best_fit(7))
+
+    def test_largest(self):
+        self.extents.add(30, 6)
+        self.assertEqual(self.extents.largest(), ds.Extent(20, 6))
+        self.assertIsNone(ds.FreeExtents().largest())
+
+
 class TestInodeFreeList(TestFreeList):
     def setUp(self):
         ds.BLOCK_SIZE = 20
@@ -516,8 +813,8 @@ class TestInodeFreeList(TestFreeList):
 
     def test_write(self):
         expected = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                   b'\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01' + \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                   b'\xff\x03' + \
+                   bytes(18)
         self.cls._device = device_io.Disk(PATH)
         self.cls.__write__()
         with open(PATH, 'rb') as f:
@@ -526,8 +823,8 @@ class TestInodeFreeList(TestFreeList):
 
     def test_allocate_with_device(self):
         input_data = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                     b'\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                     b'\xff\x03' + \
+                     bytes(18)
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.InodeFreeList(device=device_io.Disk(PATH))
@@ -539,8 +836,8 @@ class TestInodeFreeList(TestFreeList):
 
     def test_deallocate_with_device(self):
         input_data = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                     b'\x00\x00\x00\x00\x01\x01\x01\x01\x01\x01' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                     b'\xf0\x03' + \
+                     bytes(18)
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.InodeFreeList(device=device_io.Disk(PATH))
@@ -560,8 +857,8 @@ class TestDataBlockFreelist(TestFreeList):
 
     def test_write(self):
         expected = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                   b'\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01' + \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                   b'\xff\x03' + \
+                   bytes(18)
         self.cls._device = device_io.Disk(PATH)
         self.cls.__write__()
         with open(PATH, 'rb') as f:
@@ -570,8 +867,8 @@ class TestDataBlockFreelist(TestFreeList):
 
     def test_allocate_with_device(self):
         input_data = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                     b'\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                     b'\xff\x03' + \
+                     bytes(18)
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.DataBlockFreeList(device=device_io.Disk(PATH))
@@ -583,8 +880,8 @@ class TestDataBlockFreelist(TestFreeList):
 
     def test_allocate_overflow_with_device(self):
         input_data = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                     b'\x01\x01\x01\x01\x01\x01\x01\x01\x01\x01' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                     b'\xff\x03' + \
+                     bytes(18)
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.DataBlockFreeList(device=device_io.Disk(PATH))
@@ -594,8 +891,8 @@ class TestDataBlockFreelist(TestFreeList):
 
     def test_deallocate_with_device(self):
         input_data = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                     b'\x00\x00\x00\x00\x01\x01\x01\x01\x01\x01' + \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+                     b'\xf0\x03' + \
+                     bytes(18)
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.DataBlockFreeList(device=device_io.Disk(PATH))
@@ -605,13 +902,106 @@ class TestDataBlockFreelist(TestFreeList):
         self.assertEqual(output, expected)
 
 
-class TestDirectoryBlock(TestDataStructures):
+class TestLocking(TestDataStructures):
     def setUp(self):
-        ds.BLOCK_SIZE = device_io.BLOCK_SIZE = 10
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # switch threads often, so races show up
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+
+    @staticmethod
+    def run_threads(target, num_threads=8):
+        threads = [threading.Thread(target=target) for _ in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_concurrent_allocate(self):
+        freelist = ds.FreeList(n=4000)
+        allocated = []
+
+        def allocate():
+            for _ in range(100):
+                allocated.append(freelist.allocate(write_through=False))
+                allocated.extend(index for extent in freelist.allocate_many(3, contiguous=False, write_through=False)
+                                 for index in range(extent.start, extent.start + extent.length))
+        self.run_threads(allocate)
+        self.assertEqual(len(set(allocated)), 8 * 400)  # no item allocated twice
+        self.assertEqual(freelist.num_free, 4000 - 8 * 400)
+
+    def test_rwlock_readers_share(self):
+        lock = ds.RWLock()
+        with lock.reading():
+            with lock.reading():
+                done = []
+                thread = threading.Thread(target=lambda: done.append(lock.reading().__enter__()))
+                thread.start()
+                thread.join(1)
+                self.assertEqual(len(done), 1)
+
+    def test_rwlock_writer_reenters(self):
+        lock = ds.RWLock()
+        with lock.writing():
+            with lock.writing(), lock.reading():
+                pass
+            blocked = threading.Thread(target=lambda: lock.reading().__enter__())
+            blocked.start()
+            blocked.join(0.05)
+            self.assertTrue(blocked.is_alive())  # still held for writing
+        blocked.join(1)
+        self.assertFalse(blocked.is_alive())
+
+    def test_inode_locks(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH)
+        disk = utils.mount(PATH)
+        try:
+            locks = ds.InodeLocks.for_device(disk)
+            self.assertIs(ds.InodeLocks.for_device(disk), locks)
+            inode = ds.Inode(device=disk)
+            self.assertIs(inode.lock, locks.get(inode.index))
+            self.assertIs(ds.Inode(device=disk, index=inode.index).lock, inode.lock)
+            self.assertIsNot(locks.get(inode.index + 1), inode.lock)
+        finally:
+            disk.close()
+            os.remove(PATH)
+
+
+class TestIndirectBlock(TestDataStructures):
+    def setUp(self):
+        ds.BLOCK_SIZE = 20
+        device_io.BLOCK_SIZE = 20
+        self.cls = ds.IndirectBlock()
+
+    def tearDown(self):
+        del self.cls
+
+    def test_num_pointers(self):
+        self.assertEqual(self.cls.num_pointers(), 2)
+
+    def test_bytes(self):
+        self.cls.pointers = [3, 4]
+        expected = b'\x03\x00\x00\x00\x00\x00\x00\x00' + \
+                   b'\x04\x00\x00\x00\x00\x00\x00\x00' + \
+                   b'\x00\x00\x00\x00'
+        self.assertEqual(bytes(self.cls), expected)
+
+    def test_decode(self):
+        input_data = b'\x03\x00\x00\x00\x00\x00\x00\x00' + \
+                     b'\x04\x00\x00\x00\x00\x00\x00\x00' + \
+                     b'\x00\x00\x00\x00'
+        self.cls._items = self.cls.__decode__(input_data)
+        self.assertEqual(self.cls.pointers, [3, 4])
+
+
+class TestDirectoryHeader(TestDataStructures):
+    def setUp(self):
+        ds.BLOCK_SIZE = device_io.BLOCK_SIZE = 50
         ds.NUM_DATA_BLOCKS = 10
         ds.MAX_FILENAME_LENGTH = 5
-        ds.NUM_FILES_PER_DIR_BLOCK = 5
-        self.cls = ds.DirectoryBlock()
+        self.cls = ds.DirectoryHeader()
         open(PATH, 'a').close()
 
     def tearDown(self):
@@ -620,113 +1010,153 @@ class TestDirectoryBlock(TestDataStructures):
 
     def test_bytes(self):
         self.cls.name = 'test'
-        self.cls.entry_names = ['f{}'.format(i) for i in range(5)]
-        self.cls.entry_inode_indices = list(range(5))
-        output = bytes(self.cls)
-        expected = b'test\x00' \
-                   b'f0\x00\x00\x00f1\x00\x00\x00f2\x00\x00\x00f3\x00\x00\x00f4\x00\x00\x00' \
-                   b'\x00\x00' \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00' + \
-                   b'\x01\x00\x00\x00\x00\x00\x00\x00' \
+        self.cls.level = 2
+        self.cls.split = 1
+        self.cls.num_entries = 7
+        expected = b'test\x00' + bytes(3) + \
                    b'\x02\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x03\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x04\x00\x00\x00\x00\x00\x00\x00'
-        self.assertEqual(output, expected)
+                   b'\x01\x00\x00\x00\x00\x00\x00\x00' \
+                   b'\x07\x00\x00\x00\x00\x00\x00\x00' + bytes(18)
+        self.assertEqual(bytes(self.cls), expected)
+        self.assertEqual(self.cls.num_buckets, 5)
+
+    def test_write_read(self):
+        self.cls = ds.DirectoryHeader(index=0)
+        self.cls._device = device_io.Disk(PATH)
+        self.cls.name = 'test'
+        self.cls.level = 3
+        self.cls.num_entries = 20
+        self.cls.__write__()
+        self.cls = ds.DirectoryHeader(device=device_io.Disk(PATH), index=0)
+        self.assertEqual(self.cls.name, 'test')
+        self.assertEqual((self.cls.level, self.cls.split, self.cls.num_entries), (3, 0, 20))
+
+
+class TestDirectoryBlock(TestDataStructures):
+    def setUp(self):
+        ds.BLOCK_SIZE = device_io.BLOCK_SIZE = 50
+        ds.NUM_DATA_BLOCKS = 10
+        ds.MAX_FILENAME_LENGTH = 5
+        self.cls = ds.DirectoryBlock()
+        open(PATH, 'a').close()
+
+    def tearDown(self):
+        del self.cls
+        os.remove(PATH)
+
+    block_bytes = b'\x07\x00\x00\x00\x00\x00\x00\x00' \
+                  b'\x00\x00\x00\x00\x00\x00\x00\x00' \
+                  b'\x01\x00\x00\x00\x00\x00\x00\x00' \
+                  b'\x02\x00\x00\x00\x00\x00\x00\x00' \
+                  b'f0\x00\x00\x00f1\x00\x00\x00f2\x00\x00\x00' \
+                  b'\x00\x00\x00'
+
+    def test_num_entries(self):
+        self.assertEqual(ds.DirectoryBlock.num_entries(), 3)
+        self.assertEqual(ds.DirectoryBlock.num_entries(4096), 314)
+        self.assertEqual(len(self.cls.entry_names), 3)
+
+    def test_bytes(self):
+        self.cls.overflow = 7
+        self.cls.entry_names = ['f{}'.format(i) for i in range(3)]
+        self.cls.entry_inode_indices = list(range(3))
+        self.assertEqual(bytes(self.cls), self.block_bytes)
 
     def test_write(self):
         self.cls = ds.DirectoryBlock(index=0)
         self.cls._device = device_io.Disk(PATH)
-        self.cls.name = 'test'
-        self.cls.entry_names = ['f{}'.format(i) for i in range(5)]
-        self.cls.entry_inode_indices = list(range(5))
+        self.cls.overflow = 7
+        self.cls.entry_names = ['f{}'.format(i) for i in range(3)]
+        self.cls.entry_inode_indices = list(range(3))
         self.cls.__write__()
-        expected = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                   b'test\x00' \
-                   b'f0\x00\x00\x00f1\x00\x00\x00f2\x00\x00\x00f3\x00\x00\x00f4\x00\x00\x00' \
-                   b'\x00\x00' \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x01\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x02\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x03\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x04\x00\x00\x00\x00\x00\x00\x00'
+        expected = bytes(self.cls.address * ds.BLOCK_SIZE) + self.block_bytes
         with open(PATH, 'rb') as f:
             output = f.read()
         self.assertEqual(output, expected)
 
     def test_read(self):
         self.cls = ds.DirectoryBlock(index=0)
-        input_data = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                     b'test\x00' \
-                     b'f0\x00\x00\x00f1\x00\x00\x00f2\x00\x00\x00f3\x00\x00\x00f4\x00\x00\x00' + \
-                     b'\x00\x00' \
-                     b'\x00\x00\x00\x00\x00\x00\x00\x00' \
-                     b'\x01\x00\x00\x00\x00\x00\x00\x00' \
-                     b'\x02\x00\x00\x00\x00\x00\x00\x00' \
-                     b'\x03\x00\x00\x00\x00\x00\x00\x00' \
-                     b'\x04\x00\x00\x00\x00\x00\x00\x00'
-
+        input_data = bytes(self.cls.address * ds.BLOCK_SIZE) + self.block_bytes
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.DirectoryBlock(device=device_io.Disk(PATH), index=0)
-        self.assertEqual(self.cls.name, 'test')
-        self.assertEqual(self.cls.entry_names, ['f{}'.format(i) for i in range(5)])
-        self.assertEqual(self.cls.entry_inode_indices, list(range(5)))
+        self.assertEqual(self.cls.overflow, 7)
+        self.assertEqual(self.cls.entry_names, ['f{}'.format(i) for i in range(3)])
+        self.assertEqual(self.cls.entry_inode_indices, list(range(3)))
 
     def test_add_entry_no_device_1(self):
         self.cls.add_entry('f', 1, write_through=False)
-        self.assertEqual(self.cls.entry_names, ['f', '', '', '', ''])
-        self.assertEqual(self.cls.entry_inode_indices, [1, 0, 0, 0, 0])
+        self.assertEqual(self.cls.entry_names, ['f', '', ''])
+        self.assertEqual(self.cls.entry_inode_indices, [1, 0, 0])
 
     def test_add_entry_no_device_2(self):
         self.cls.add_entry('f1', 1, write_through=False)
         self.cls.add_entry('f2', 2, write_through=False)
-        self.cls.add_entry('f3', 3, write_through=False)
-        self.assertEqual(self.cls.entry_names,
-                         ['f1', 'f2', 'f3', '', ''])
-        self.assertEqual(self.cls.entry_inode_indices, [1, 2, 3, 0, 0])
+        self.assertEqual(self.cls.entry_names, ['f1', 'f2', ''])
+        self.assertEqual(self.cls.entry_inode_indices, [1, 2, 0])
+
+    def test_add_entry_inode_0(self):
+        self.cls.add_entry('f1', 0, write_through=False)
+        self.cls.add_entry('f2', 2, write_through=False)
+        self.assertEqual(self.cls.entries, [('f1', 0), ('f2', 2)])
+
+    def test_add_entry_too_long(self):
+        with self.assertRaises(Exception):
+            self.cls.add_entry('f' * (ds.MAX_FILENAME_LENGTH + 1), 1, write_through=False)
 
     def test_remove_entry_no_device_1(self):
-        self.cls.entry_names = ['f1', 'f2', 'f3', '', '']
-        self.cls.entry_inode_indices = [1, 2, 3, 0, 0]
+        self.cls.entry_names = ['f1', 'f2', 'f3']
+        self.cls.entry_inode_indices = [1, 2, 3]
         self.cls.remove_entry('f1', 1, write_through=False)
-        self.assertEqual(self.cls.entry_names,
-                         ['', 'f2', 'f3', '', ''])
-        self.assertEqual(self.cls.entry_inode_indices, [0, 2, 3, 0, 0])
+        self.assertEqual(self.cls.entry_names, ['', 'f2', 'f3'])
+        self.assertEqual(self.cls.entry_inode_indices, [0, 2, 3])
 
     def test_remove_add_entry_no_device_1(self):
-        self.cls.entry_names = ['f1', 'f2', 'f3', '', '']
-        self.cls.entry_inode_indices = [1, 2, 3, 0, 0]
+        self.cls.entry_names = ['f1', 'f2', 'f3']
+        self.cls.entry_inode_indices = [1, 2, 3]
         self.cls.remove_entry('f1', 1, write_through=False)
         self.cls.add_entry('f4', 4, write_through=False)
-        self.assertEqual(self.cls.entry_names,
-                         ['f4', 'f2', 'f3', '', ''])
-        self.assertEqual(self.cls.entry_inode_indices, [4, 2, 3, 0, 0])
+        self.assertEqual(self.cls.entry_names, ['f4', 'f2', 'f3'])
+        self.assertEqual(self.cls.entry_inode_indices, [4, 2, 3])
 
     def test_add_entry_overflow_no_device(self):
         with self.assertRaises(Exception):
-            for i in range(ds.NUM_FILES_PER_DIR_BLOCK + 1):
+            for i in range(ds.DirectoryBlock.num_entries() + 1):
                 self.cls.add_entry('f{}'.format(i), i, write_through=False)
 
     def test_remove_entry_doesnt_exist_no_device(self):
         with self.assertRaises(Exception):
             self.cls.remove_entry('random_name', 4, write_through=False)
 
+    def test_is_full(self):
+        self.assertFalse(self.cls.is_full())
+        self.cls.entries = [('f1', 1), ('f2', 2), ('f3', 3)]
+        self.assertTrue(self.cls.is_full())
+
+    def test_entries(self):
+        self.cls.entries = [('f1', 1), ('f2', 2)]
+        self.assertEqual(self.cls.entry_names, ['f1', 'f2', ''])
+        self.assertEqual(self.cls.entry_inode_indices, [1, 2, 0])
+        self.assertEqual(self.cls.entries, [('f1', 1), ('f2', 2)])
+        with self.assertRaises(Exception):
+            self.cls.entries = [('f{}'.format(i), i) for i in range(4)]
+
+    def test_find(self):
+        self.cls.entries = [('f1', 1), ('f2', 2)]
+        self.assertEqual(self.cls.find('f2'), 2)
+        self.assertIsNone(self.cls.find('f3'))
+
     def test_add_item_with_device(self):
         self.cls = ds.DirectoryBlock(index=0)
         self.cls._device = device_io.Disk(PATH)
-        self.cls.name = 'test'
         self.cls.add_entry('f1', 1)
-        # self.cls.__write__()
         expected = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                   b'test\x00' \
-                   b'f1\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x00\x00' \
-                   b'\x01\x00\x00\x00\x00\x00\x00\x00' \
                    b'\x00\x00\x00\x00\x00\x00\x00\x00' \
+                   b'\x01\x00\x00\x00\x00\x00\x00\x00' \
                    b'\x00\x00\x00\x00\x00\x00\x00\x00' \
                    b'\x00\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00'
+                   b'f1\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00' \
+                   b'\x00\x00\x00'
         with open(PATH, 'rb') as f:
             output = f.read()
         self.assertEqual(output, expected)
@@ -734,37 +1164,31 @@ class TestDirectoryBlock(TestDataStructures):
     def test_remove_item_with_device(self):
         self.cls = ds.DirectoryBlock(index=0)
         self.cls._device = device_io.Disk(PATH)
-        self.cls.name = 'test'
         self.cls.add_entry('f1', 1)
         self.cls.add_entry('f2', 2)
         self.cls.add_entry('f3', 3)
         self.cls.remove_entry('f2', 2)
         expected = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                   b'test\x00' \
-                   b'f1\x00\x00\x00\x00\x00\x00\x00\x00f3\x00\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x00\x00\x00\x00\x00' + \
-                   b'\x00\x00' \
+                   b'\x00\x00\x00\x00\x00\x00\x00\x00' \
                    b'\x01\x00\x00\x00\x00\x00\x00\x00' \
                    b'\x00\x00\x00\x00\x00\x00\x00\x00' \
                    b'\x03\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00' \
-                   b'\x00\x00\x00\x00\x00\x00\x00\x00'
-
+                   b'f1\x00\x00\x00\x00\x00\x00\x00\x00f3\x00\x00\x00' \
+                   b'\x00\x00\x00'
         with open(PATH, 'rb') as f:
             output = f.read()
         self.assertEqual(output, expected)
 
     def test_add_write_read(self):
         reload(ds)
-        ds.NUM_FILES_PER_DIR_BLOCK = 5
         reload(utils)
         reload(device_io)
         utils.makefs(PATH)
         self.cls = ds.DirectoryBlock(device=device_io.Disk(PATH))
         self.cls.add_entry('f1', 1)
         self.cls = ds.DirectoryBlock(device=self.cls._device, index=1)
-        self.assertEqual(self.cls.entry_names, ['f1', '', '', '', ''])
-        self.assertEqual(self.cls.entry_inode_indices, [1, 0, 0, 0, 0])
+        self.assertEqual(self.cls.entry_names, ['f1', '', ''])
+        self.assertEqual(self.cls.entry_inode_indices, [1, 0, 0])
 
 
 class TestDataBlock(TestDataStructures):
@@ -780,7 +1204,7 @@ class TestDataBlock(TestDataStructures):
         os.remove(PATH)
 
     def test_bytes(self):
-        self.cls.data = 'this is test data'
+        self.cls.data = b'this is test data'
         expected = b'this is test data\x00\x00\x00'
         output = bytes(self.cls)
         self.assertEqual(output, expected)
@@ -790,7 +1214,7 @@ class TestDataBlock(TestDataStructures):
         expected = bytes(self.cls.address * ds.BLOCK_SIZE) + \
                    b'this is test data\x00\x00\x00'
         self.cls._device = device_io.Disk(PATH)
-        self.cls.data = 'this is test data'
+        self.cls.data = b'this is test data'
         self.cls.__write__()
         with open(PATH, 'rb') as f:
             output = f.read()
@@ -803,52 +1227,18 @@ class TestDataBlock(TestDataStructures):
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.DataBlock(device=device_io.Disk(PATH), index=0)
-        expected = 'this is test data'
+        expected = b'this is test data\x00\x00\x00'
         output = self.cls.data
         self.assertEqual(output, expected)
 
-    def test_is_full_true(self):
-        self.cls = ds.DataBlock(index=0)
-        input_data = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                     b'this is test data   '
-        with open(PATH, 'wb') as f:
-            f.write(input_data)
-        self.cls = ds.DataBlock(device=device_io.Disk(PATH), index=0)
-        self.assertTrue(self.cls.is_full())
-
-    def test_is_full_false(self):
+    def test_read_binary(self):
         self.cls = ds.DataBlock(index=0)
         input_data = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                     b'this is test data\x00\x00\x00'
+                     b'\x00binary\x00data\xff   \x00\x00\x00\x00'
         with open(PATH, 'wb') as f:
             f.write(input_data)
         self.cls = ds.DataBlock(device=device_io.Disk(PATH), index=0)
-        self.assertFalse(self.cls.is_full())
-
-    def test_append_with_device(self):
-        self.cls = ds.DataBlock(index=0)
-        expected = bytes(self.cls.address * ds.BLOCK_SIZE) + \
-                   b'this is test data\x00\x00\x00'
-        self.cls._device = device_io.Disk(PATH)
-        self.cls.data = 'this is'
-        self.cls.append(' test data')
-        self.cls.__write__()
-        with open(PATH, 'rb') as f:
-            output = f.read()
-        self.assertEqual(output, expected)
-
-    def test_append_return_no_device_1(self):
-        self.cls = ds.DataBlock()
-        self.cls.data = 'this is'
-        extra_data = self.cls.append(' test data   that is really really long', write_through=False)
-        self.assertEqual(self.cls.data, 'this is test data   ')
-        self.assertEqual(extra_data, 'that is really really long')
-
-    def test_append_return_no_device_2(self):
-        self.cls = ds.DataBlock()
-        extra_data = self.cls.append('this is test data   that is really really long', write_through=False)
-        self.assertEqual(self.cls.data, 'this is test data   ')
-        self.assertEqual(extra_data, 'that is really really long')
+        self.assertEqual(self.cls.data, input_data[-ds.BLOCK_SIZE:])
 
 
 if __name__ == '__main__':
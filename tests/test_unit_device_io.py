@@ -5,7 +5,10 @@ Author: Angad Gill
 """
 
 import os
+import struct
+import threading
 import unittest
+from importlib import reload
 
 from unix_fs import device_io
 
@@ -13,6 +16,10 @@ PATH = 'temp_unit_test_file'
 
 
 class TestDisk(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        reload(device_io)
+
     def setUp(self):
         """ Executed before each test case """
         open(PATH, 'a').close()  # create file
@@ -35,3 +42,280 @@ class TestDisk(unittest.TestCase):
     #     f.close()
     #     self.assertEqual(b, b2)
     #
+
+
+class TestBlockCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        reload(device_io)
+
+    def setUp(self):
+        device_io.BLOCK_SIZE = 4
+        with open(PATH, 'wb') as f:
+            f.write(bytes(range(16)))  # 4 blocks
+        self.disk = device_io.Disk(PATH, cache_size=2)
+
+    def tearDown(self):
+        self.disk.close()
+        os.remove(PATH)
+        reload(device_io)
+
+    @staticmethod
+    def read_file():
+        with open(PATH, 'rb') as f:
+            return f.read()
+
+    def test_read_miss_then_hit(self):
+        self.disk.seek(1)
+        self.assertEqual(self.disk.read(), bytes([4, 5, 6, 7]))
+        self.disk.seek(1)
+        self.assertEqual(self.disk.read(), bytes([4, 5, 6, 7]))
+        self.assertEqual(self.disk.cache.misses, 1)
+        self.assertEqual(self.disk.cache.hits, 1)
+
+    def test_read_multiple_blocks(self):
+        self.disk.seek(1)
+        self.assertEqual(self.disk.read(2), bytes(range(4, 12)))
+
+    def test_write_back_on_sync(self):
+        self.disk.seek(1)
+        self.disk.write(b'\xff\xff\xff\xff')
+        self.assertEqual(self.read_file(), bytes(range(16)))
+        self.disk.sync()
+        self.assertEqual(self.read_file(), bytes(range(4)) + b'\xff' * 4 + bytes(range(8, 16)))
+
+    def test_partial_block_write(self):
+        self.disk.seek(1)
+        self.disk.write(b'\xff\xff\xff\xff\xff\xff')
+        self.disk.seek(1)
+        self.assertEqual(self.disk.read(2), b'\xff' * 6 + bytes([10, 11]))
+
+    def test_eviction_writes_dirty_block(self):
+        self.disk.seek(0)
+        self.disk.write(b'\xff\xff\xff\xff')
+        for block_pos in [1, 2]:
+            self.disk.seek(block_pos)
+            self.disk.read()
+        self.assertEqual(self.disk.cache.evictions, 1)
+        self.assertNotIn(0, self.disk.cache)
+        self.assertEqual(self.read_file()[:4], b'\xff' * 4)
+
+    def test_close_flushes(self):
+        self.disk.seek(3)
+        self.disk.write(b'\xff\xff\xff\xff')
+        self.disk.close()
+        self.assertEqual(self.read_file()[12:], b'\xff' * 4)
+
+    def test_stats(self):
+        self.disk.seek(0)
+        self.disk.read()
+        self.disk.seek(0)
+        self.disk.read()
+        stats = self.disk.cache.stats
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_prefetch(self):
+        self.disk.prefetch(1, 2)
+        self.assertEqual(self.disk.cache.prefetched, 2)
+        self.assertEqual(self.disk.readv([1, 2]), [bytes(range(4, 8)), bytes(range(8, 12))])
+        self.assertEqual(self.disk.cache.misses, 0)
+
+    def test_prefetch_keeps_newer_blocks(self):
+        self.disk.pwrite(1, b'\xff' * 4)
+        self.disk.prefetch(0, 2)
+        self.assertEqual(self.disk.cache.prefetched, 1)
+        self.assertEqual(self.disk.pread(1), b'\xff' * 4)
+
+    def test_prefetch_dropped_after_write(self):
+        generation = self.disk.cache.generation
+        self.disk.pwrite(3, b'\xff' * 4)
+        self.disk.sync()  # block 3 written while the blocks were read
+        self.disk.cache.prefetch([(3, bytearray(4))], generation)
+        self.assertEqual(self.disk.cache.prefetched, 0)
+        self.assertEqual(self.disk.pread(3), b'\xff' * 4)
+
+
+class TestDiskVectored(unittest.TestCase):
+    disk_class = device_io.Disk
+    cache_size = 0
+
+    @classmethod
+    def setUpClass(cls):
+        reload(device_io)
+
+    def setUp(self):
+        device_io.BLOCK_SIZE = 4
+        with open(PATH, 'wb') as f:
+            f.write(bytes(range(24)))  # 6 blocks
+        self.disk = getattr(device_io, self.disk_class.__name__)(PATH, cache_size=self.cache_size)
+
+    def tearDown(self):
+        self.disk.close()
+        os.remove(PATH)
+        reload(device_io)
+
+    @staticmethod
+    def read_file():
+        with open(PATH, 'rb') as f:
+            return f.read()
+
+    def test_iovec_runs(self):
+        blocks = [(1, b'a' * 4), (2, b'b' * 4), (4, b'c' * 4), (5, b'd'), (6, b'e' * 4)]
+        runs = list(self.disk._iovec_runs(blocks))
+        self.assertEqual(runs, [(4, [b'a' * 4, b'b' * 4]), (16, [b'c' * 4, b'd']), (24, [b'e' * 4])])
+
+    def test_readv(self):
+        output = self.disk.readv([4, 1, 2, 5])
+        self.assertEqual(output, [bytes(range(16, 20)), bytes(range(4, 8)), bytes(range(8, 12)), bytes(range(20, 24))])
+
+    def test_readv_into_buffers(self):
+        buffer = bytearray(8)
+        view = memoryview(buffer)
+        self.disk.readv([3, 0], [view[:4], view[4:]])
+        self.assertEqual(buffer, bytes(range(12, 16)) + bytes(range(4)))
+
+    def test_readv_past_end(self):
+        self.assertEqual(self.disk.readv([5, 6]), [bytes(range(20, 24)), bytes(4)])
+
+    def test_writev(self):
+        self.assertEqual(self.disk.writev({4: b'\xff' * 4, 1: b'\xee' * 4, 2: b'\xdd' * 4}), 12)
+        self.disk.sync()
+        self.assertEqual(self.read_file(), bytes(range(4)) + b'\xee' * 4 + b'\xdd' * 4 + bytes(range(12, 16)) +
+                         b'\xff' * 4 + bytes(range(20, 24)))
+        self.assertEqual(self.disk.readv([1, 4]), [b'\xee' * 4, b'\xff' * 4])
+
+    def test_unpack_from(self):
+        self.assertEqual(self.disk.unpack_from(struct.Struct('BB'), 2), (8, 9))
+
+    def test_unpack_from_past_end(self):
+        self.assertEqual(self.disk.unpack_from(struct.Struct('BB'), 7), (0, 0))
+
+    def test_pack_into(self):
+        self.disk.pack_into(struct.Struct('BB'), 1, 0xff, 0xee)
+        self.assertEqual(self.disk.unpack_from(struct.Struct('4B'), 1), (0xff, 0xee, 0, 0))
+        self.disk.sync()
+        self.assertEqual(self.read_file(), bytes(range(4)) + b'\xff\xee\x00\x00' + bytes(range(8, 24)))
+
+    def test_pack_into_past_end(self):
+        self.disk.pack_into(struct.Struct('B'), 7, 0xff)
+        self.disk.sync()
+        self.assertEqual(self.read_file(), bytes(range(24)) + bytes(4) + b'\xff\x00\x00\x00')
+
+    def test_pread_pwrite_keep_position(self):
+        self.disk.seek(1)
+        self.assertEqual(self.disk.pread(4, 2), bytes(range(16, 24)))
+        self.assertEqual(self.disk.pwrite(0, b'\xff' * 4), 4)
+        self.assertEqual(self.disk.read(), bytes(range(4, 8)))
+        self.assertEqual(self.disk.pread(0), b'\xff' * 4)
+
+    def test_prefetch(self):
+        self.disk.prefetch(2, 3)
+        self.disk.prefetch(5, 4)  # past the end
+        self.assertEqual(self.disk.readv([2, 3, 4]), [bytes(range(8, 12)), bytes(range(12, 16)), bytes(range(16, 20))])
+
+    def test_concurrent_pwrite(self):
+        reads = []
+
+        def write(block_pos):
+            for _ in range(200):
+                self.disk.pwrite(block_pos, bytes([block_pos]) * 4)
+                reads.append(self.disk.pread(block_pos) == bytes([block_pos]) * 4)
+        threads = [threading.Thread(target=write, args=(block_pos,)) for block_pos in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(all(reads))
+        self.disk.sync()
+        self.assertEqual(self.read_file(), b''.join(bytes([block_pos]) * 4 for block_pos in range(8)))
+
+
+class TestDiskVectoredCached(TestDiskVectored):
+    cache_size = 2
+
+    def test_pack_into_does_not_read(self):
+        self.disk.pack_into(struct.Struct('BB'), 1, 0xff, 0xee)
+        self.assertEqual(self.disk.cache.misses, 0)
+        self.assertEqual(self.disk.unpack_from(struct.Struct('BB'), 1), (0xff, 0xee))
+        self.assertEqual(self.disk.cache.hits, 1)
+
+    def test_readv_counts(self):
+        self.disk.readv([1])
+        self.disk.readv([0, 1])
+        self.assertEqual(self.disk.cache.misses, 2)
+        self.assertEqual(self.disk.cache.hits, 1)
+
+
+class TestMmapDiskVectored(TestDiskVectored):
+    disk_class = device_io.MmapDisk
+
+
+class TestMmapDisk(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        reload(device_io)
+
+    def setUp(self):
+        device_io.BLOCK_SIZE = 4
+        with open(PATH, 'wb') as f:
+            f.write(bytes(range(16)))  # 4 blocks
+        self.disk = device_io.MmapDisk(PATH)
+
+    def tearDown(self):
+        self.disk.close()
+        os.remove(PATH)
+        reload(device_io)
+
+    @staticmethod
+    def read_file():
+        with open(PATH, 'rb') as f:
+            return f.read()
+
+    def test_read(self):
+        self.disk.seek(1)
+        self.assertEqual(self.disk.read(2), bytes(range(4, 12)))
+        self.assertEqual(self.disk.read(), bytes(range(12, 16)))
+        self.assertEqual(self.disk.read(), b'')
+
+    def test_readinto(self):
+        buffer = bytearray(6)
+        self.disk.seek(3)
+        self.assertEqual(self.disk.readinto(buffer), 4)
+        self.assertEqual(buffer, bytes(range(12, 16)) + bytes(2))
+
+    def test_write(self):
+        self.disk.seek(1)
+        self.disk.write(b'\xff\xff\xff\xff')
+        self.disk.sync()
+        self.assertEqual(self.read_file(), bytes(range(4)) + b'\xff' * 4 + bytes(range(8, 16)))
+
+    def test_write_past_end_grows(self):
+        self.disk.seek(5)
+        self.disk.write(b'\xff\xff\xff\xff')
+        self.disk.seek(5)
+        self.assertEqual(self.disk.read(), b'\xff' * 4)
+        self.disk.close()
+        self.assertEqual(self.read_file(), bytes(range(16)) + bytes(4) + b'\xff' * 4)
+
+    def test_empty_file(self):
+        self.disk.close()
+        open(PATH, 'wb').close()
+        self.disk = device_io.MmapDisk(PATH)
+        self.assertEqual(self.disk.read(), b'')
+        buffer = bytearray(4)
+        self.assertEqual(self.disk.readinto(buffer), 0)
+        self.assertEqual(self.disk.readv([0, 1]), [bytearray(4), bytearray(4)])
+        self.disk.write(b'\x01\x02')
+        self.disk.close()
+        self.assertEqual(self.read_file(), b'\x01\x02')
+
+    def test_cache(self):
+        self.disk.close()
+        self.disk = device_io.MmapDisk(PATH, cache_size=2)
+        self.disk.seek(2)
+        self.disk.write(b'\xff\xff')
+        self.disk.seek(2)
+        self.assertEqual(self.disk.read(), b'\xff\xff' + bytes([10, 11]))
+        self.disk.close()
+        self.assertEqual(self.read_file()[8:12], b'\xff\xff' + bytes([10, 11]))
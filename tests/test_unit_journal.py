@@ -0,0 +1,217 @@
+"""
+Unit tests for unix_fs/journal.py
+
+Author: Angad Gill
+"""
+
+import os
+import shutil
+import threading
+import time
+import unittest
+from importlib import reload
+
+from unix_fs import device_io
+from unix_fs import data_structures as ds
+from unix_fs import journal
+from unix_fs import system
+from unix_fs import utils
+
+PATH = 'temp_unit_test_file'
+CRASH_PATH = 'temp_unit_test_file_crash'
+
+
+class TestJournal(unittest.TestCase):
+    cache_size = 0
+    use_mmap = False
+    journal_blocks = 64
+
+    @classmethod
+    def setUpClass(cls):
+        reload(device_io)
+        reload(ds)
+        reload(journal)
+        reload(system)
+        reload(utils)
+
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH, block_size=256, num_inodes=64, num_data_blocks=1024, journal_blocks=self.journal_blocks)
+        self.disk = utils.mount(PATH, cache_size=self.cache_size, use_mmap=self.use_mmap)
+        self.inodes = system.InodeCache.for_device(self.disk)
+        self.crashed = None
+
+    def tearDown(self):
+        self.disk.close()
+        if self.crashed is not None:
+            self.crashed.close()
+            os.remove(CRASH_PATH)
+        os.remove(PATH)
+
+    def crash(self):
+        """ Mounts a copy of what the device has written so far: whatever is only in memory is lost """
+        if self.cache_size:
+            with self.disk.lock:
+                self.disk.cache._dirty.clear()
+        if self.use_mmap:
+            self.disk._map.flush()
+        shutil.copy(PATH, CRASH_PATH)
+        self.crashed = utils.mount(CRASH_PATH)
+        return self.crashed
+
+    def create(self, name: str, data: bytes) -> None:
+        root = self.inodes.get(ds.ROOT_INODE)
+        f = self.inodes.create(system.File)
+        root.add(name, f.index)
+        f.write(data)
+        self.inodes.release(f)
+        self.inodes.release(root)
+
+    def names(self, disk) -> list:
+        return sorted(system.Directory(device=disk, index=ds.ROOT_INODE).read()[0])
+
+    def test_makefs(self):
+        layout = self.disk.layout
+        self.assertEqual(os.path.getsize(PATH), (layout.total_blocks + self.journal_blocks) * layout.block_size)
+        self.assertEqual(self.disk.journal.start, layout.total_blocks)
+        self.assertEqual(self.disk.journal.num_blocks, self.journal_blocks)
+
+    def test_no_journal(self):
+        utils.makefs(CRASH_PATH)
+        disk = utils.mount(CRASH_PATH)
+        self.assertIsNone(disk.journal)
+        disk.close()
+        os.remove(CRASH_PATH)
+
+    def test_logged_until_checkpoint(self):
+        self.create('f', b'data')
+        self.inodes.flush()
+        self.assertEqual(self.names(self.disk), ['f'])  # reads see the logged blocks
+        self.assertEqual(self.names(self.crash()), [])  # nothing in place, nothing committed
+
+    def test_commit_recover(self):
+        self.create('f', b'data' * 100)
+        self.create('g', b'more')
+        self.disk.sync()
+        disk = self.crash()
+        self.assertEqual(disk.journal.recovered, 1)
+        self.assertEqual(self.names(disk), ['f', 'g'])
+        self.assertEqual(system.File(device=disk, index=system.resolve(disk, '/f')).read(), b'data' * 100)
+
+    def test_data_written_before_records(self):
+        self.create('f', b'data' * 100)
+        dirty = []
+        write_uncached = self.disk.write_uncached
+
+        def counted_write_uncached(blocks):
+            dirty.append(len(self.disk.cache._dirty) if self.cache_size else 0)
+            return write_uncached(blocks)
+        self.disk.write_uncached = counted_write_uncached
+        self.disk.journal.commit()
+        self.assertEqual(dirty, [0])  # no File data left in the cache when the journal is written
+
+    def test_uncommitted_lost(self):
+        self.create('f', b'data' * 100)
+        self.disk.sync()
+        num_free = ds.DataBlockFreeList.for_device(self.disk).num_free
+        self.create('g', b'more' * 100)
+        disk = self.crash()
+        self.assertEqual(self.names(disk), ['f'])
+        self.assertEqual(ds.DataBlockFreeList.for_device(disk).num_free, num_free)
+
+    def test_torn_commit(self):
+        self.create('f', b'data')
+        self.disk.sync()
+        journal_ = self.disk.journal
+        commit_block = journal_.start + journal_._head - 1
+        with open(PATH, 'rb+') as f:
+            f.seek(commit_block * self.disk.block_size + journal.COMMIT.size - 4)
+            f.write(b'\xff\xff\xff\xff')  # bad checksum
+        disk = self.crash()
+        self.assertEqual(disk.journal.recovered, 0)
+        self.assertEqual(self.names(disk), [])
+
+    def test_close_checkpoints(self):
+        self.create('f', b'data')
+        self.disk.close()
+        self.disk = utils.mount(PATH, cache_size=self.cache_size, use_mmap=self.use_mmap)
+        self.assertEqual(self.disk.journal.recovered, 0)
+        self.assertEqual(self.names(self.disk), ['f'])
+
+    def test_checkpoint_when_full(self):
+        for i in range(40):
+            self.create('f{}'.format(i), bytes([i]) * 300)
+            self.disk.sync()
+        self.assertGreater(self.disk.journal.checkpoints, 0)
+        disk = self.crash()
+        self.assertEqual(self.names(disk), sorted('f{}'.format(i) for i in range(40)))
+        self.assertEqual(system.File(device=disk, index=system.resolve(disk, '/f39')).read(), bytes([39]) * 300)
+
+    def test_revoke(self):
+        block = ds.DataBlock(device=self.disk)
+        block.data = b'm' * self.disk.block_size
+        block.__write__()
+        self.disk.journal.commit()
+        address = block.address
+        block.deallocate()
+        data = b'z' * self.disk.block_size
+        self.disk.pwrite(address, data)  # the freed block reused for File data
+        self.assertEqual(self.disk.pread(address), data)
+        self.disk.journal.commit()
+        self.assertEqual(self.crash().pread(address), data)
+
+    def test_transaction_nests(self):
+        journal_ = self.disk.journal
+        with journal.transaction(self.disk):
+            with journal.transaction(self.disk):
+                self.assertEqual(journal_._handles, 1)
+            with self.assertRaises(Exception):
+                journal_.commit()
+        self.assertEqual(journal_._handles, 0)
+
+    def test_group_commit(self):
+        journal_ = self.disk.journal
+        fsync = self.disk.fsync
+        in_fsync, release = threading.Event(), threading.Event()
+        fsyncs = []
+
+        def slow_fsync():
+            fsyncs.append(1)
+            in_fsync.set()
+            release.wait()
+            fsync()
+        self.disk.fsync = slow_fsync
+
+        self.create('a', b'a')
+        first = threading.Thread(target=journal_.commit)
+        first.start()
+        in_fsync.wait()
+        created = threading.Barrier(5)
+
+        def worker(name):
+            self.create(name, name.encode())
+            created.wait()
+            journal_.commit()
+        threads = [threading.Thread(target=worker, args=(name,)) for name in 'bcde']
+        for thread in threads:
+            thread.start()
+        created.wait()
+        time.sleep(0.1)  # the workers wait for the first commit
+        release.set()
+        for thread in [first] + threads:
+            thread.join()
+        self.assertEqual(journal_.commits, 2)
+        self.assertEqual(len(fsyncs), 2)
+        self.assertEqual(self.names(self.crash()), ['a', 'b', 'c', 'd', 'e'])
+
+
+class TestJournalCached(TestJournal):
+    cache_size = 64
+
+
+class TestJournalMmap(TestJournal):
+    use_mmap = True
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,7 +4,10 @@ Unit tests for unix_fs/system.py
 Author: Angad Gill
 """
 
+import errno
 import os
+import sys
+import threading
 import unittest
 from importlib import reload
 
@@ -30,8 +33,10 @@ class TestFile(TestSystem):
         open(PATH, 'a').close()
         utils.makefs(PATH)
         self.cls = system.File(device=device_io.Disk(PATH))
+        self.inline_data = system.INLINE_DATA
 
     def tearDown(self):
+        system.INLINE_DATA = self.inline_data
         del self.cls
         os.remove(PATH)
 
@@ -42,30 +47,241 @@ class TestFile(TestSystem):
         self.assertEqual(output, expected)
 
     def test_write_read_short(self):
-        input_text = ''.join(['t' for _ in range(ds.BLOCK_SIZE)])
+        input_text = b't' * ds.BLOCK_SIZE
         self.cls.write(input_text)
-        self.cls = system.File(device=device_io.Disk(PATH), index=0)
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
         self.assertEqual(self.cls.read(), input_text)
 
     def test_write_read_long(self):
-        input_text = ''.join(['t' for _ in range(ds.BLOCK_SIZE*2)])
+        input_text = b't' * (ds.BLOCK_SIZE*2)
         self.cls.write(input_text)
-        self.cls = system.File(device=device_io.Disk(PATH), index=0)
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
         self.assertEqual(self.cls.read(), input_text)
 
     def test_multiple_write_partial_block_read(self):
-        input_text1 = ''.join(['t' for _ in range(int(ds.BLOCK_SIZE/2))])
-        input_text2 = ''.join(['t' for _ in range(ds.BLOCK_SIZE*2)])
+        input_text1 = b't' * int(ds.BLOCK_SIZE/2)
+        input_text2 = b't' * (ds.BLOCK_SIZE*2)
         self.cls.write(input_text1)
         self.cls.write(input_text2)
-        self.cls = system.File(device=device_io.Disk(PATH), index=0)
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
         output = self.cls.read()
         self.assertEqual(output, input_text1+input_text2)
 
+    def test_write_read_binary(self):
+        input_data = b'\x00\xffbinary\x00' * ds.BLOCK_SIZE + bytes(3)
+        self.cls.write(input_data)
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        self.assertEqual(self.cls.read(), input_data)
+
+    def test_write_str(self):
+        self.assertEqual(self.cls.write('test data'), 9)
+        self.assertEqual(self.cls.read(), b'test data')
+
+    def test_write_memoryview(self):
+        input_data = bytearray(b't' * ds.BLOCK_SIZE * 2)
+        self.cls.write(memoryview(input_data)[1:])
+        self.assertEqual(self.cls.read(), bytes(input_data[1:]))
+
+    def test_write_allocates_one_extent(self):
+        input_text = b't' * (ds.BLOCK_SIZE*3)
+        self.cls.write(input_text)
+        self.assertTrue(self.cls.is_extent_mode)
+        self.assertEqual(self.cls.address_direct, [0] * ds.INODE_NUM_DIRECT_BLOCKS)
+        self.assertEqual(self.cls._used_extents, [ds.Extent(1, 3)])
+
+    def test_write_grows_in_place(self):
+        system.INLINE_DATA = False
+        g, h = system.File(device=self.cls._device), system.File(device=self.cls._device)
+        for f in [self.cls, g, h]:
+            f.write(b't' * ds.BLOCK_SIZE)
+        g.free()  # frees block 2, which best fit would take
+        h.write(b't' * ds.BLOCK_SIZE)
+        self.assertEqual(h._used_extents, [ds.Extent(3, 2)])
+        self.assertTrue(ds.DataBlockFreeList.for_device(self.cls._device).is_free(2))
+
+    def test_write_maps_only_range(self):
+        calls = []
+
+        class File(system.File):
+            __slots__ = ()
+
+            def _block_indices(self):
+                calls.append(1)
+                return super()._block_indices()
+        f = File(device=self.cls._device)
+        f.write(b't' * (ds.BLOCK_SIZE * 3))
+        f.pwrite(ds.BLOCK_SIZE + 2, b'data')
+        f.write(b'a' * ds.BLOCK_SIZE)
+        self.assertEqual(calls, [])  # overwrites and appends do not walk the whole map
+        self.assertEqual(f._used_extents, [ds.Extent(1, 4)])
+        self.assertEqual(f.pread(ds.BLOCK_SIZE, 8), b'ttdatatt')
+
+    def test_write_read_beyond_direct_blocks(self):
+        input_text = b't' * (ds.BLOCK_SIZE*ds.INODE_NUM_DIRECT_BLOCKS + 1)
+        self.cls.write(input_text)
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        self.assertEqual(self.cls.read(), input_text)
+
+    def test_write_read_fragmented(self):
+        freelist = ds.DataBlockFreeList.for_device(self.cls._device)
+        freelist.list = [False, True, False, True, True, False, True] + [False] * (ds.NUM_DATA_BLOCKS - 7)
+        input_text = bytes(ord('a') + i % 26 for i in range(ds.BLOCK_SIZE*4))
+        self.cls.write(input_text)
+        self.assertEqual(self.cls._used_extents, [ds.Extent(1, 1), ds.Extent(3, 2), ds.Extent(6, 1)])
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        self.assertEqual(self.cls.read(), input_text)
+
+    def test_read_direct_mode(self):
+        system.INLINE_DATA = False
+        self.cls.write(b'existing')
+        # Files written before extents were added map their data with address_direct
+        self.cls.flags = 0
+        self.cls.address_direct = [self.cls._used_extents[0].start, 0, 0, 0, 0]
+        self.cls.__write__()
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        self.cls.write(b' data')
+        self.assertEqual(self.cls.read(), b'existing data')
+
+    def test_size(self):
+        self.cls.write(b't' * (ds.BLOCK_SIZE + 3))
+        self.cls.write(b't' * 4)
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        self.assertEqual(self.cls.size, ds.BLOCK_SIZE + 7)
+
+    def test_pread(self):
+        input_text = bytes(ord('a') + i % 26 for i in range(ds.BLOCK_SIZE*3))
+        self.cls.write(input_text)
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        offset = ds.BLOCK_SIZE - 2
+        self.assertEqual(self.cls.pread(offset, 10), input_text[offset:offset + 10])
+        self.assertEqual(self.cls.pread(0, 1), input_text[:1])
+
+    def test_preadinto(self):
+        input_text = bytes(ord('a') + i % 26 for i in range(ds.BLOCK_SIZE*3))
+        self.cls.write(input_text)
+        buffer = bytearray(ds.BLOCK_SIZE + 4)
+        self.assertEqual(self.cls.preadinto(ds.BLOCK_SIZE - 2, buffer), ds.BLOCK_SIZE + 4)
+        self.assertEqual(bytes(buffer), input_text[ds.BLOCK_SIZE - 2:ds.BLOCK_SIZE*2 + 2])
+        buffer = bytearray(10)
+        self.assertEqual(self.cls.preadinto(ds.BLOCK_SIZE*3 - 4, buffer), 4)
+        self.assertEqual(bytes(buffer), input_text[-4:] + bytes(6))
+
+    def test_pread_past_end(self):
+        self.cls.write(b'test data')
+        self.assertEqual(self.cls.pread(5, 100), b'data')
+        self.assertEqual(self.cls.pread(9, 1), b'')
+        self.assertEqual(self.cls.pread(20, 1), b'')
+
+    def test_pread_reads_only_covering_blocks(self):
+        self.cls.write(b't' * (ds.BLOCK_SIZE*4))
+        self.cls = system.File(device=device_io.Disk(PATH, cache_size=16), index=self.cls.index)
+        misses = self.cls._device.cache.misses
+        self.cls.pread(ds.BLOCK_SIZE * 2 + 1, 3)
+        self.assertEqual(self.cls._device.cache.misses - misses, 1)
+
+    def test_read_coalesces_blocks(self):
+        num_blocks = ds.INODE_NUM_DIRECT_BLOCKS * 2
+        self.cls.write(b't' * (ds.BLOCK_SIZE*num_blocks))
+        calls = []
+        preadv = self.cls._device._preadv
+        self.cls._device._preadv = lambda offset, buffers: calls.append(len(buffers)) or preadv(offset, buffers)
+        self.cls.read()
+        self.assertEqual(calls, [num_blocks])
+
+    def test_pwrite_overwrite(self):
+        input_text = b't' * (ds.BLOCK_SIZE*2)
+        self.cls.write(input_text)
+        offset = ds.BLOCK_SIZE - 2
+        self.assertEqual(self.cls.pwrite(offset, b'abcd'), 4)
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        expected = input_text[:offset] + b'abcd' + input_text[offset + 4:]
+        self.assertEqual(self.cls.read(), expected)
+        self.assertEqual(self.cls.size, ds.BLOCK_SIZE*2)
+
+    def test_pwrite_overwrite_and_append(self):
+        self.cls.write(b'test data')
+        self.cls.pwrite(5, b'file system')
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        self.assertEqual(self.cls.read(), b'test file system')
+        self.assertEqual(self.cls.size, 16)
+
+    def test_pwrite_at_end(self):
+        self.cls.write(b't' * ds.BLOCK_SIZE)
+        self.cls.pwrite(ds.BLOCK_SIZE, b'abc')
+        self.assertEqual(self.cls.read(), b't' * ds.BLOCK_SIZE + b'abc')
+
+    def test_pwrite_past_end(self):
+        self.cls.write(b'test')
+        self.cls.pwrite(5, b'data')
+        self.assertEqual(self.cls.read(), b'test\x00data')
+
     def test_write_overflow(self):
-        input_text = ''.join(['t' for _ in range(ds.BLOCK_SIZE*ds.INODE_NUM_DIRECT_BLOCKS + 1)])
+        input_text = b't' * (ds.BLOCK_SIZE*ds.NUM_DATA_BLOCKS)
         with self.assertRaises(Exception):
             self.cls.write(input_text)
+        self.assertEqual(ds.DataBlockFreeList.for_device(self.cls._device).num_free, ds.NUM_DATA_BLOCKS - 1)
+
+    def test_write_fragmented_converts_to_block_mode(self):
+        freelist = ds.DataBlockFreeList.for_device(self.cls._device)
+        freelist.list = [i % 2 == 1 for i in range(ds.NUM_DATA_BLOCKS)]
+        num_blocks = ds.INODE_NUM_DIRECT_BLOCKS + ds.IndirectBlock.num_pointers() + 2  # uses double indirect
+        input_text = bytes(ord('a') + i % 26 for i in range(ds.BLOCK_SIZE*num_blocks))
+        self.cls.write(input_text[:ds.BLOCK_SIZE])
+        self.cls.write(input_text[ds.BLOCK_SIZE:])
+        self.assertFalse(self.cls.is_extent_mode)
+        self.assertEqual(self.cls.address_direct, [1, 3, 5, 7, 9])
+        self.assertEqual(self.cls._block_addresses(2, num_blocks), [self.cls._block_address(logical)
+                                                                    for logical in range(2, num_blocks + 2)])
+        self.assertNotEqual(self.cls.address_indirect, [0])
+        self.assertNotEqual(self.cls.address_double_indirect, [0])
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        self.assertEqual(len(self.cls._block_indices()), num_blocks)
+        self.assertEqual(self.cls.read(), input_text)
+
+    def test_write_overflow_block_mode(self):
+        freelist = ds.DataBlockFreeList.for_device(self.cls._device)
+        freelist.list = [i % 2 == 1 for i in range(ds.NUM_DATA_BLOCKS)]
+        self.cls.write(b't')
+        input_text = b't' * (ds.BLOCK_SIZE*self.cls._max_blocks())
+        with self.assertRaises(Exception):
+            self.cls.write(input_text)
+        self.assertEqual(freelist.num_free, ds.NUM_DATA_BLOCKS // 2 - 1)
+
+    def test_truncate_shrink(self):
+        input_text = bytes(ord('a') + i % 26 for i in range(ds.BLOCK_SIZE*3))
+        self.cls.write(input_text)
+        self.cls.truncate(ds.BLOCK_SIZE + 1)
+        self.assertEqual(ds.DataBlockFreeList.for_device(self.cls._device).num_free, ds.NUM_DATA_BLOCKS - 3)
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        self.assertEqual(self.cls.read(), input_text[:ds.BLOCK_SIZE + 1])
+        self.cls.write(b'xyz')
+        self.assertEqual(self.cls.read(), input_text[:ds.BLOCK_SIZE + 1] + b'xyz')
+
+    def test_truncate_extend(self):
+        self.cls.write(b'abc')
+        self.cls.truncate(ds.BLOCK_SIZE + 3)
+        self.assertEqual(self.cls.read(), b'abc' + bytes(ds.BLOCK_SIZE))
+
+    def test_truncate_block_mode(self):
+        freelist = ds.DataBlockFreeList.for_device(self.cls._device)
+        freelist.list = [i % 2 == 1 for i in range(ds.NUM_DATA_BLOCKS)]
+        num_blocks = ds.INODE_NUM_DIRECT_BLOCKS + ds.IndirectBlock.num_pointers() + 2  # uses double indirect
+        input_text = bytes(ord('a') + i % 26 for i in range(ds.BLOCK_SIZE*num_blocks))
+        self.cls.write(input_text[:ds.BLOCK_SIZE])
+        self.cls.write(input_text[ds.BLOCK_SIZE:])
+        self.cls.truncate(ds.BLOCK_SIZE*2)
+        self.assertTrue(self.cls.is_extent_mode)  # two blocks fit in the extent list again
+        self.assertEqual(freelist.num_free, ds.NUM_DATA_BLOCKS // 2 - 2)  # IndirectBlocks freed too
+        self.cls = system.File(device=device_io.Disk(PATH), index=self.cls.index)
+        self.assertEqual(self.cls.read(), input_text[:ds.BLOCK_SIZE*2])
+
+    def test_free(self):
+        self.cls.write(b't' * (ds.BLOCK_SIZE*3))
+        index = self.cls.index
+        self.cls.free()
+        self.assertEqual(ds.DataBlockFreeList.for_device(self.cls._device).num_free, ds.NUM_DATA_BLOCKS - 1)
+        self.assertTrue(ds.InodeFreeList.for_device(self.cls._device).is_free(index))
+        self.assertEqual(ds.Inode(device=device_io.Disk(PATH), index=index).i_type, 0)
 
 
 class TestDirectory(TestSystem):
@@ -86,16 +302,16 @@ class TestDirectory(TestSystem):
     def test_add_with_device(self):
         expected = (['test1'], [1])
         self.cls.add('test1', 1)
-        self.cls = system.Directory(device=device_io.Disk(PATH), index=0)
+        self.cls = system.Directory(device=device_io.Disk(PATH), index=self.cls.index)
         self.assertEqual(self.cls.read(), expected)
 
     def test_add_few__with_device(self):
-        expected = (['test1', 'test2'], [1, 2])
+        expected = [('test1', 1), ('test2', 2)]
         self.cls.add('test1', 1)
         self.cls.add('test2', 2)
-        block = ds.DirectoryBlock(device=self.cls._device, index=1)
-        self.cls = system.Directory(device=device_io.Disk(PATH), index=0)
-        self.assertEqual(self.cls.read(), expected)
+        self.cls = system.Directory(device=device_io.Disk(PATH), index=self.cls.index)
+        names, inodes = self.cls.read()
+        self.assertEqual(sorted(zip(names, inodes)), expected)
 
     def test_add_few_same_name_with_device(self):
         self.cls.add('test1', 1)
@@ -103,12 +319,766 @@ class TestDirectory(TestSystem):
             self.cls.add('test1', 1)
 
     def test_add_many_no_device(self):
-        expected = (['test{}'.format(i+1) for i in range(ds.NUM_FILES_PER_DIR_BLOCK)],
-                    list(range(1, ds.NUM_FILES_PER_DIR_BLOCK+1)))
-        for i in range(ds.NUM_FILES_PER_DIR_BLOCK):
-            self.cls.add('test{}'.format(i+1), i+1)
-        self.assertEqual(self.cls.read(), expected)
+        num_entries = ds.DirectoryBlock.num_entries() * 2
+        expected = [('test{}'.format(i+1), i+1) for i in range(num_entries)]
+        for name, inode in expected:
+            self.cls.add(name, inode)
+        names, inodes = self.cls.read()
+        self.assertEqual(sorted(zip(names, inodes)), sorted(expected))
+
+    def test_add_splits_buckets(self):
+        expected = {'e{}'.format(i): i for i in range(60)}
+        for name, inode in expected.items():
+            self.cls.add(name, inode)
+        self.assertEqual(self.cls.header.num_entries, 60)
+        self.assertGreater(self.cls.header.num_buckets, 60 // ds.DirectoryBlock.num_entries())
+        self.cls = system.Directory(device=device_io.Disk(PATH), index=self.cls.index)
+        names, inodes = self.cls.read()
+        self.assertEqual(dict(zip(names, inodes)), expected)
+        for name, inode in expected.items():
+            self.assertEqual(self.cls.lookup(name), inode)
+
+    def test_add_past_max_buckets(self):
+        utils.makefs(PATH, num_data_blocks=400)
+        self.cls = system.Directory(device=device_io.Disk(PATH))
+        expected = {'e{}'.format(i): i for i in range(150)}
+        for name, inode in expected.items():
+            self.cls.add(name, inode)
+        self.assertEqual(self.cls.header.num_buckets, self.cls._max_blocks() - 1)  # the table stopped growing
+        self.cls = system.Directory(device=device_io.Disk(PATH), index=self.cls.index)
+        names, inodes = self.cls.read()
+        self.assertEqual(dict(zip(names, inodes)), expected)
+        for name, inode in expected.items():
+            self.assertEqual(self.cls.lookup(name), inode)
+
+    def test_lookup(self):
+        self.cls.add('test1', 1)
+        self.cls.add('test2', 0)
+        self.assertEqual(self.cls.lookup('test1'), 1)
+        self.assertEqual(self.cls.lookup('test2'), 0)
+        with self.assertRaises(Exception):
+            self.cls.lookup('test3')
+
+    def test_lookup_empty(self):
+        with self.assertRaises(Exception):
+            self.cls.lookup('test1')
+
+    def test_lookup_reads_one_block(self):
+        for i in range(30):
+            self.cls.add('e{}'.format(i), i)
+        self.cls = system.Directory(device=device_io.Disk(PATH, cache_size=64), index=self.cls.index)
+        self.cls.header
+        misses = self.cls._device.cache.misses
+        self.cls.lookup('e7')
+        self.assertLessEqual(self.cls._device.cache.misses - misses, 2)  # bucket, and an overflow block at most
+
+    def test_remove(self):
+        for i in range(30):
+            self.cls.add('e{}'.format(i), i)
+        self.cls.remove('e7', 7)
+        self.cls = system.Directory(device=device_io.Disk(PATH), index=self.cls.index)
+        self.assertEqual(self.cls.header.num_entries, 29)
+        with self.assertRaises(Exception):
+            self.cls.lookup('e7')
+        with self.assertRaises(Exception):
+            self.cls.remove('e7', 7)
+        self.cls.add('e7', 8)
+        self.assertEqual(self.cls.lookup('e7'), 8)
+
+    def test_overflow_blocks(self):
+        num_entries = ds.DirectoryBlock.num_entries()
+        expected = {'e{}'.format(i): i for i in range(num_entries * 2 + 1)}
+        max_load = system.DIRECTORY_MAX_LOAD
+        system.DIRECTORY_MAX_LOAD = len(expected)  # never split
+        try:
+            for name, inode in expected.items():
+                self.cls.add(name, inode)
+        finally:
+            system.DIRECTORY_MAX_LOAD = max_load
+        self.assertEqual(self.cls.header.num_buckets, 1)
+        self.assertEqual(len(list(self.cls._chain(0))), 3)
+        for name, inode in expected.items():
+            self.assertEqual(self.cls.lookup(name), inode)
+
+        # The next add splits bucket 0 and frees the overflow blocks that are no longer needed
+        free = ds.DataBlockFreeList.for_device(self.cls._device).num_free
+        self.cls.add('last', 100)
+        expected['last'] = 100
+        self.assertEqual(self.cls.header.num_buckets, 2)
+        num_blocks = len(list(self.cls._chain(0))) + len(list(self.cls._chain(1)))
+        self.assertEqual(ds.DataBlockFreeList.for_device(self.cls._device).num_free, free + 3 - num_blocks)
+        names, inodes = self.cls.read()
+        self.assertEqual(dict(zip(names, inodes)), expected)
+
+    def test_free(self):
+        max_load = system.DIRECTORY_MAX_LOAD
+        system.DIRECTORY_MAX_LOAD = 10  # never split: the one bucket gets overflow blocks
+        try:
+            for i in range(10):
+                self.cls.add(str(i), i)
+        finally:
+            system.DIRECTORY_MAX_LOAD = max_load
+        self.assertGreater(len(list(self.cls._chain(0))), 1)
+        for i in range(10):
+            self.cls.remove(str(i), i)
+        self.cls.free()
+        self.assertEqual(ds.DataBlockFreeList.for_device(self.cls._device).num_free, ds.NUM_DATA_BLOCKS - 1)
 
     def test_name(self):
         self.cls.name = 'test'
         self.assertEqual(self.cls.name, 'test')
+
+
+class TestResolve(TestSystem):
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH)
+        self.disk = utils.mount(PATH, cache_size=64)
+        inodes = system.InodeCache.for_device(self.disk)
+        self.root = inodes.get(ds.ROOT_INODE)
+        self.dir = inodes.create(system.Directory)
+        self.file = inodes.create(system.File)
+        self.root.add('a', self.dir.index)
+        self.dir.add('f', self.file.index)
+        self.disk.dentries.invalidate()
+
+    def tearDown(self):
+        self.disk.close()
+        os.remove(PATH)
+
+    def test_resolve(self):
+        self.assertEqual(system.resolve(self.disk, '/'), ds.ROOT_INODE)
+        self.assertEqual(system.resolve(self.disk, '/a'), self.dir.index)
+        self.assertEqual(system.resolve(self.disk, '/a/f'), self.file.index)
+        self.assertEqual(system.resolve(self.disk, '//a/./f'), self.file.index)
+
+    def test_resolve_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            system.resolve(self.disk, '/b')
+        with self.assertRaises(FileNotFoundError):
+            system.resolve(self.disk, '/a/g')
+
+    def test_resolve_name_too_long(self):
+        name = 'f' * (ds.MAX_FILENAME_LENGTH + 1)
+        for path in ['/' + name, '/a/' + name, '/' + name + '/f']:
+            with self.assertRaises(FileNotFoundError):
+                system.resolve(self.disk, path)
+        self.assertIsNone(self.disk.dentries.get(self.dir.index, name))  # a negative entry
+
+    def test_resolve_not_a_directory(self):
+        with self.assertRaises(NotADirectoryError):
+            system.resolve(self.disk, '/a/f/g')
+
+    def test_resolve_cached(self):
+        system.resolve(self.disk, '/a/f')
+        self.disk.sync()
+        misses = self.disk.cache.misses, self.disk.dentries.misses
+        hits = self.disk.cache.hits
+        self.assertEqual(system.resolve(self.disk, '/a/f'), self.file.index)
+        self.assertEqual((self.disk.cache.misses, self.disk.dentries.misses), misses)
+        self.assertEqual(self.disk.cache.hits, hits)  # nothing read from the device
+        self.assertEqual(self.disk.dentries.stats['hit_rate'], 0.5)
+
+    def test_negative_entry(self):
+        with self.assertRaises(FileNotFoundError):
+            system.resolve(self.disk, '/a/g')
+        self.assertIsNone(self.disk.dentries.get(self.dir.index, 'g'))
+        hits = self.disk.cache.hits
+        with self.assertRaises(FileNotFoundError):
+            system.resolve(self.disk, '/a/g')
+        self.assertEqual(self.disk.cache.hits, hits)
+
+    def test_add_replaces_negative_entry(self):
+        with self.assertRaises(FileNotFoundError):
+            system.resolve(self.disk, '/a/g')
+        self.dir.add('g', 7)
+        self.assertEqual(system.resolve(self.disk, '/a/g'), 7)
+
+    def test_add_after_lookup_not_hidden(self):
+        lookup = system.Directory.lookup
+
+        def lookup_then_add(directory, name):
+            try:
+                return lookup(directory, name)
+            finally:
+                if name == 'g':
+                    # another thread adds the entry once the lookup is done, before resolve returns
+                    thread = threading.Thread(target=directory.add, args=(name, 7))
+                    thread.start()
+                    thread.join()
+        system.Directory.lookup = lookup_then_add
+        try:
+            with self.assertRaises(FileNotFoundError):
+                system.resolve(self.disk, '/a/g')
+        finally:
+            system.Directory.lookup = lookup
+        self.assertEqual(system.resolve(self.disk, '/a/g'), 7)
+
+    def test_remove(self):
+        system.resolve(self.disk, '/a/f')
+        self.dir.remove('f', self.file.index)
+        with self.assertRaises(FileNotFoundError):
+            system.resolve(self.disk, '/a/f')
+
+    def test_rename(self):
+        system.resolve(self.disk, '/a/f')
+        self.dir.rename('f', self.root, 'g')
+        with self.assertRaises(FileNotFoundError):
+            system.resolve(self.disk, '/a/f')
+        self.assertEqual(system.resolve(self.disk, '/g'), self.file.index)
+
+    def test_rename_directory_keeps_children(self):
+        self.root.rename('a', self.root, 'b')
+        self.assertEqual(system.resolve(self.disk, '/b/f'), self.file.index)
+        with self.assertRaises(FileNotFoundError):
+            system.resolve(self.disk, '/a/f')
+
+    def test_persisted(self):
+        self.disk.close()
+        self.disk = utils.mount(PATH)
+        self.assertEqual(system.resolve(self.disk, '/a/f'), self.file.index)
+
+
+class TestInodeCache(TestSystem):
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH)
+        self.disk = utils.mount(PATH)
+        self.inodes = system.InodeCache.for_device(self.disk)
+
+    def tearDown(self):
+        self.disk.close()
+        os.remove(PATH)
+
+    def test_get(self):
+        root = self.inodes.get(ds.ROOT_INODE)
+        self.assertIsInstance(root, system.Directory)
+        self.assertIs(self.inodes.get(ds.ROOT_INODE), root)
+        self.assertEqual(self.inodes.stats['hits'], 1)
+        self.assertEqual(self.inodes.stats['misses'], 1)
+        self.assertEqual(self.inodes.stats['hit_rate'], 0.5)
+
+    def test_get_free_inode(self):
+        with self.assertRaises(FileNotFoundError):
+            self.inodes.get(ds.ROOT_INODE + 1)
+
+    def test_create(self):
+        f = self.inodes.create(system.File)
+        self.assertIs(self.inodes.get(f.index), f)
+        self.assertEqual(self.inodes.stats['referenced'], 1)
+        self.assertEqual(self.inodes.stats['dirty'], 1)
+
+    def test_write_back(self):
+        f = self.inodes.create(system.File)
+        f.write(b'test data')
+        self.assertEqual(system.File(device=self.disk, index=f.index).size, 0)  # not written yet
+        self.disk.sync()
+        self.assertEqual(self.inodes.stats['dirty'], 0)
+        self.assertEqual(system.File(device=self.disk, index=f.index).read(), b'test data')
+
+    def test_write_back_on_close(self):
+        f = self.inodes.create(system.File)
+        f.write(b'test data')
+        self.disk.close()
+        self.disk = utils.mount(PATH)
+        self.assertEqual(system.InodeCache.for_device(self.disk).get(f.index).read(), b'test data')
+
+    def test_release(self):
+        f = self.inodes.create(system.File)
+        self.inodes.release(f)
+        self.assertEqual(self.inodes.stats['referenced'], 0)
+        with self.assertRaises(Exception):
+            self.inodes.release(f)
+
+    def test_eviction(self):
+        self.inodes.capacity = 2
+        files = [self.inodes.create(system.File) for _ in range(3)]
+        self.assertEqual(len(self.inodes), 3)  # every File is referenced
+        for f in files:
+            f.write(bytes([f.index]))
+            self.inodes.release(f)
+        self.assertEqual(len(self.inodes), 2)
+        self.assertNotIn(files[0].index, self.inodes)
+        self.assertEqual(self.inodes.stats['evictions'], 1)
+        # Evicted dirty Inodes are written back
+        self.assertEqual(system.File(device=self.disk, index=files[0].index).read(), bytes([files[0].index]))
+        self.assertIsNot(self.inodes.get(files[0].index), files[0])
+
+    def test_unlink(self):
+        f = self.inodes.create(system.File)
+        f.write(b'test data')
+        index = f.index
+        self.inodes.unlink(f)  # still referenced
+        self.assertEqual(f.read(), b'test data')
+        self.assertFalse(ds.InodeFreeList.for_device(self.disk).is_free(index))
+        self.inodes.release(f)
+        self.assertNotIn(index, self.inodes)
+        self.assertTrue(ds.InodeFreeList.for_device(self.disk).is_free(index))
+        self.assertEqual(ds.DataBlockFreeList.for_device(self.disk).num_free, ds.NUM_DATA_BLOCKS - 1)
+        with self.assertRaises(FileNotFoundError):
+            self.inodes.get(index)
+
+
+class TestDelayedAllocation(TestSystem):
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH)
+        self.disk = utils.mount(PATH)
+        self.inodes = system.InodeCache.for_device(self.disk)
+        self.freelist = ds.DataBlockFreeList.for_device(self.disk)
+        self.max_delayed_blocks = system.MAX_DELAYED_BLOCKS
+        self.inline_data = system.INLINE_DATA
+        system.INLINE_DATA = False  # small Files are not delayed, they are inline
+
+    def tearDown(self):
+        system.MAX_DELAYED_BLOCKS = self.max_delayed_blocks
+        system.INLINE_DATA = self.inline_data
+        self.disk.close()
+        os.remove(PATH)
+
+    def test_delayed_until_flush(self):
+        f = self.inodes.create(system.File)
+        data = bytes(range(30)) * 20
+        for start in range(0, len(data), 30):
+            f.write(data[start:start + 30])
+        self.assertEqual(f._block_indices(), [])
+        self.assertEqual(self.freelist.num_free, ds.NUM_DATA_BLOCKS - 1)
+        self.assertEqual(f.size, len(data))
+        self.assertEqual(f.read(), data)
+        self.assertEqual(f.pread(45, 10), data[45:55])
+        self.disk.sync()
+        self.assertEqual(f.delayed, 0)
+        self.assertEqual(len(f._used_extents), 1)
+        self.assertEqual(system.File(device=self.disk, index=f.index).read(), data)
+
+    def test_written_without_delayed_data(self):
+        f = self.inodes.create(system.File)
+        f.write(b'a' * ds.BLOCK_SIZE)
+        self.disk.sync()
+        f.write(b'b' * 10)
+        f.pwrite(5, b'c' * 10)  # over allocated and delayed data
+        self.inodes.write_back()  # as Journal.commit does: the File is written as it is
+        self.assertEqual(system.File(device=self.disk, index=f.index).size, ds.BLOCK_SIZE)
+        self.assertEqual(f.read(), b'a' * 5 + b'c' * 10 + b'a' * (ds.BLOCK_SIZE - 15) + b'b' * 10)
+        self.disk.sync()
+        self.assertEqual(system.File(device=self.disk, index=f.index).read(), f.read())
+
+    def test_interleaved_writers_contiguous(self):
+        files = [self.inodes.create(system.File) for _ in range(2)]
+        for i in range(10):
+            for f in files:
+                f.write(bytes([f.index]) * ds.BLOCK_SIZE)
+        for f in files:
+            self.inodes.release(f)  # closed: allocated at once
+            self.assertEqual(f.delayed, 0)
+            self.assertEqual(len(f._used_extents), 1)
+            self.assertEqual(f.read(), bytes([f.index]) * ds.BLOCK_SIZE * 10)
+
+    def test_uncached_not_delayed(self):
+        f = system.File(device=self.disk)
+        f.write(b'test data')
+        self.assertEqual(f.delayed, 0)
+        self.assertEqual(len(f._block_indices()), 1)
+
+    def test_max_delayed_blocks(self):
+        system.MAX_DELAYED_BLOCKS = 2
+        f = self.inodes.create(system.File)
+        f.write(b'x' * ds.BLOCK_SIZE * 2)
+        self.assertEqual(f._block_indices(), [])
+        f.write(b'x')
+        self.assertEqual(len(f._block_indices()), 3)
+        self.assertEqual(f.delayed, 0)
+
+    def test_truncate(self):
+        f = self.inodes.create(system.File)
+        f.write(b'a' * ds.BLOCK_SIZE * 2)
+        self.disk.sync()
+        f.write(b'b' * ds.BLOCK_SIZE)
+        f.truncate(ds.BLOCK_SIZE * 2 + 10)  # in the delayed data
+        self.assertEqual(f.read(), b'a' * ds.BLOCK_SIZE * 2 + b'b' * 10)
+        f.truncate(ds.BLOCK_SIZE + 5)  # in the allocated blocks
+        self.assertEqual(f.delayed, 0)
+        self.assertEqual(len(f._block_indices()), 2)
+        f.truncate(ds.BLOCK_SIZE * 3)  # extended with delayed zeros
+        self.assertEqual(f.read(), b'a' * (ds.BLOCK_SIZE + 5) + bytes(ds.BLOCK_SIZE * 2 - 5))
+        self.disk.sync()
+        self.assertEqual(system.File(device=self.disk, index=f.index).read(), f.read())
+
+    def test_unlink_drops_delayed(self):
+        f = self.inodes.create(system.File)
+        f.write(b'test data')
+        self.inodes.unlink(f)
+        self.inodes.release(f)
+        self.assertEqual(self.freelist.num_free, ds.NUM_DATA_BLOCKS - 1)
+
+    def test_disk_full(self):
+        self.disk.close()
+        utils.makefs(PATH, num_data_blocks=20)
+        self.disk = utils.mount(PATH)
+        self.inodes = system.InodeCache.for_device(self.disk)
+        freelist = ds.DataBlockFreeList.for_device(self.disk)
+        f = self.inodes.create(system.File)
+        written = 0
+        with self.assertRaises(OSError) as context:
+            for i in range(30):
+                f.write(bytes([i]) * ds.BLOCK_SIZE)
+                written += 1
+        self.assertEqual(context.exception.errno, errno.ENOSPC)
+        self.assertEqual(written, 19)  # data block 0 is reserved
+        self.assertEqual(f.size, ds.BLOCK_SIZE * 19)
+        self.assertEqual(freelist.num_available, 0)
+        self.inodes.release(f)
+        self.assertEqual(freelist.num_free, 0)
+        self.assertEqual(freelist.num_available, 0)
+        data = b''.join(bytes([i]) * ds.BLOCK_SIZE for i in range(19))
+        self.assertEqual(system.File(device=self.disk, index=f.index).read(), data)
+        f = system.File(device=self.disk, index=f.index)
+        f.truncate(ds.BLOCK_SIZE)
+        self.assertEqual(freelist.num_free, 18)
+
+
+class TestSparseFile(TestSystem):
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH)
+        self.disk = utils.mount(PATH)
+        self.freelist = ds.DataBlockFreeList.for_device(self.disk)
+        self.f = system.File(device=self.disk)
+
+    def tearDown(self):
+        self.disk.close()
+        os.remove(PATH)
+
+    def reopen(self) -> system.File:
+        return system.File(device=self.disk, index=self.f.index)
+
+    def test_write_past_end(self):
+        offset = ds.BLOCK_SIZE * 20 + 7
+        self.f.write(b'abc')
+        self.f.pwrite(offset, b'data')
+        self.assertEqual(self.f.size, offset + 4)
+        self.assertEqual(self.f._block_indices(), [1] + [0] * 19 + [2])
+        self.assertEqual(self.freelist.num_free, ds.NUM_DATA_BLOCKS - 3)
+        self.assertEqual(self.reopen().read(), b'abc' + bytes(offset - 3) + b'data')
+
+    def test_runs(self):
+        self.f.pwrite(ds.BLOCK_SIZE, b't' * ds.BLOCK_SIZE * 2)
+        self.assertEqual(self.f._block_addresses(0, 5), [0, 1, 2, 0, 0])
+        self.assertEqual(self.f._runs(0, 5), [(0, 0, 1), (1, 1, 2), (3, 0, 2)])
+
+    def test_hole_reads_no_blocks(self):
+        self.f.pwrite(ds.BLOCK_SIZE * 10, b'data')
+        readv = self.disk.readv
+        positions = []
+        self.disk.readv = lambda blocks, buffers=None: positions.extend(blocks) or readv(blocks, buffers)
+        self.assertEqual(self.f.pread(ds.BLOCK_SIZE, ds.BLOCK_SIZE * 5), bytes(ds.BLOCK_SIZE * 5))
+        self.assertEqual(positions, [])
+        self.assertEqual(self.f.pread(ds.BLOCK_SIZE * 9 + 10, ds.BLOCK_SIZE), bytes(ds.BLOCK_SIZE - 10) + b'data')
+        self.assertEqual(len(positions), 1)
+
+    def test_write_into_hole(self):
+        self.freelist.deallocate_many(self.freelist.allocate_many(10))  # leave garbage in the free blocks
+        for index in range(1, 11):
+            self.disk.pwrite(self.disk.layout.data_start + index, b'\xff' * ds.BLOCK_SIZE)
+        self.f.pwrite(ds.BLOCK_SIZE * 6, b'end')
+        self.f.pwrite(ds.BLOCK_SIZE * 2 + 5, b'middle')
+        expected = bytearray(ds.BLOCK_SIZE * 6 + 3)
+        expected[ds.BLOCK_SIZE * 2 + 5:ds.BLOCK_SIZE * 2 + 11] = b'middle'
+        expected[-3:] = b'end'
+        self.assertEqual(self.reopen().read(), expected)
+        self.assertEqual(len([index for index in self.f._block_indices() if index]), 2)
+
+    def test_many_holes_block_mode(self):
+        for logical in range(0, 30, 3):
+            self.f.pwrite(ds.BLOCK_SIZE * logical, bytes([logical + 1]))
+        self.assertFalse(self.f.is_extent_mode)
+        f = self.reopen()
+        expected = bytearray(ds.BLOCK_SIZE * 27 + 1)
+        expected[::ds.BLOCK_SIZE * 3] = bytes(range(1, 30, 3))
+        self.assertEqual(f.read(), expected)
+        f.truncate(ds.BLOCK_SIZE * 4)
+        self.assertTrue(f.is_extent_mode)
+        self.assertEqual(self.freelist.num_free, ds.NUM_DATA_BLOCKS - 3)
+
+    def test_truncate_extend(self):
+        self.f.write(b'a' * (ds.BLOCK_SIZE + 10))
+        self.f.truncate(ds.BLOCK_SIZE + 5)
+        self.f.truncate(ds.BLOCK_SIZE * 30)
+        self.assertEqual(self.freelist.num_free, ds.NUM_DATA_BLOCKS - 3)
+        self.assertEqual(self.reopen().read(), b'a' * (ds.BLOCK_SIZE + 5) + bytes(ds.BLOCK_SIZE * 29 - 5))
+        self.f.truncate(ds.BLOCK_SIZE * 10)
+        self.assertEqual(self.reopen().size, ds.BLOCK_SIZE * 10)
+
+    def test_delayed(self):
+        inodes = system.InodeCache.for_device(self.disk)
+        f = inodes.create(system.File)
+        f.write(b'abc')
+        f.pwrite(ds.BLOCK_SIZE * 20, b'data')
+        f.write(b'more')
+        inodes.release(f)
+        self.assertEqual(self.freelist.num_free, ds.NUM_DATA_BLOCKS - 3)
+        self.assertEqual(system.File(device=self.disk, index=f.index).read(),
+                         b'abc' + bytes(ds.BLOCK_SIZE * 20 - 3) + b'datamore')
+
+
+class TestInlineData(TestSystem):
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH)
+        self.disk = utils.mount(PATH)
+        self.freelist = ds.DataBlockFreeList.for_device(self.disk)
+        self.f = system.File(device=self.disk)
+        self.inline_data = system.INLINE_DATA
+
+    def tearDown(self):
+        system.INLINE_DATA = self.inline_data
+        self.disk.close()
+        os.remove(PATH)
+
+    def reopen(self) -> system.File:
+        return system.File(device=self.disk, index=self.f.index)
+
+    def test_write_inline(self):
+        self.f.write(b'test')
+        self.f.write(b' data')
+        self.assertTrue(self.f.is_inline)
+        self.assertEqual(self.f._block_indices(), [])
+        self.assertEqual(self.freelist.num_free, ds.NUM_DATA_BLOCKS - 1)
+        self.assertEqual(self.reopen().read(), b'test data')
+
+    def test_read_inline_no_blocks(self):
+        self.f.write(b't' * self.f.max_inline)
+        f = self.reopen()
+        readv = self.disk.readv
+        positions = []
+        self.disk.readv = lambda blocks, buffers=None: positions.extend(blocks) or readv(blocks, buffers)
+        self.assertEqual(f.read(), b't' * self.f.max_inline)
+        self.assertEqual(f.pread(10, 5), b'ttttt')
+        self.assertEqual(positions, [])
+
+    def test_pwrite_past_end(self):
+        self.f.write(b'test')
+        self.f.pwrite(10, b'data')
+        self.assertTrue(self.f.is_inline)
+        self.assertEqual(self.reopen().read(), b'test' + bytes(6) + b'data')
+
+    def test_grows_to_blocks(self):
+        data = bytes(i % 251 for i in range(self.f.max_inline + ds.BLOCK_SIZE))
+        self.f.write(data[:self.f.max_inline])
+        self.f.write(data[self.f.max_inline:])
+        self.assertFalse(self.f.is_inline)
+        self.assertEqual(len(self.f._block_indices()), len(data) // ds.BLOCK_SIZE + 1)
+        self.assertEqual(self.reopen().read(), data)
+        self.f.truncate(10)  # stays in blocks
+        self.assertFalse(self.f.is_inline)
+        self.assertEqual(self.reopen().read(), data[:10])
+
+    def test_large_write_not_inline(self):
+        self.f.write(b't' * (self.f.max_inline + 1))
+        self.assertFalse(self.f.is_inline)
+        self.assertEqual(self.reopen().read(), b't' * (self.f.max_inline + 1))
+
+    def test_truncate(self):
+        self.f.write(b'test data')
+        self.f.truncate(4)
+        self.assertEqual(self.reopen().read(), b'test')
+        self.f.truncate(8)
+        self.assertTrue(self.f.is_inline)
+        self.assertEqual(self.reopen().read(), b'test' + bytes(4))
+        self.f.truncate(ds.BLOCK_SIZE * 10)
+        self.assertFalse(self.f.is_inline)
+        self.assertEqual(self.f._block_indices(), [1])
+        self.assertEqual(self.reopen().read(), b'test' + bytes(ds.BLOCK_SIZE * 10 - 4))
+
+    def test_free(self):
+        self.f.write(b'test data')
+        self.f.free()
+        inode = ds.Inode(device=self.disk, index=self.f.index)
+        self.assertFalse(inode.is_inline)
+        self.assertEqual(inode._items, ds.Inode()._items)
+
+    def test_journal(self):
+        self.disk.close()
+        utils.makefs(PATH, journal_blocks=16)
+        self.disk = utils.mount(PATH)
+        inodes = system.InodeCache.for_device(self.disk)
+        f = inodes.create(system.File)
+        f.write(b'test data')
+        inodes.release(f)
+        self.disk.close()
+        self.disk = utils.mount(PATH)
+        self.assertEqual(system.File(device=self.disk, index=f.index).read(), b'test data')
+
+    def test_disabled(self):
+        system.INLINE_DATA = False
+        self.f.write(b'test data')
+        self.assertFalse(self.f.is_inline)
+        self.assertEqual(self.f._block_indices(), [1])
+
+
+class TestReadahead(TestSystem):
+    num_blocks = 64
+
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH)
+        self.disk = utils.mount(PATH, cache_size=128)
+        f = system.File(device=self.disk)
+        self.data = bytes(i % 251 for i in range(self.num_blocks * ds.BLOCK_SIZE))
+        f.write(self.data)
+        self.disk.sync()
+        self.disk.cache.invalidate()
+        self.f = system.File(device=self.disk, index=f.index)
+        self.readahead = system.Readahead.for_device(self.disk)
+
+    def tearDown(self):
+        self.disk.close()
+        os.remove(PATH)
+
+    def read_blocks(self, first: int, last: int) -> None:
+        for i in range(first, last):
+            self.assertEqual(self.f.pread(i * ds.BLOCK_SIZE, ds.BLOCK_SIZE),
+                             self.data[i * ds.BLOCK_SIZE:(i + 1) * ds.BLOCK_SIZE])
+
+    def test_sequential(self):
+        self.read_blocks(0, self.num_blocks)
+        cache = self.disk.cache
+        self.assertEqual(self.readahead.sequential, self.num_blocks)
+        self.assertEqual(self.readahead.blocks, self.num_blocks)
+        self.assertEqual(cache.prefetched, self.num_blocks)
+        self.assertGreaterEqual(cache.hits, self.num_blocks)  # every data block read ahead of use
+        self.assertEqual(self.readahead._files[self.f.index][1], self.readahead.max_window)
+
+    def test_window_grows(self):
+        self.read_blocks(0, 3)
+        self.assertEqual(self.readahead._files[self.f.index][1], system.READAHEAD_MIN_BLOCKS * 4)
+
+    def test_random_reads_reset(self):
+        self.read_blocks(0, 3)
+        self.read_blocks(40, 41)
+        self.assertEqual(self.readahead._files[self.f.index], (41, system.READAHEAD_MIN_BLOCKS, 0))
+        blocks = self.readahead.blocks
+        self.read_blocks(20, 21)
+        self.assertEqual(self.readahead.blocks, blocks)
+        self.assertGreater(self.disk.cache.misses, 0)
+
+    def test_window_limited_by_cache(self):
+        self.disk.cache.capacity = 8
+        self.read_blocks(0, self.num_blocks)
+        self.assertEqual(self.readahead._files[self.f.index][1], 4)
+
+    def test_background(self):
+        self.readahead = self.disk.readahead = system.Readahead(self.disk, background=True)
+        self.read_blocks(0, self.num_blocks)
+        self.readahead.close()
+        self.assertEqual(self.readahead.blocks, self.num_blocks - 1)  # the first block is read by the reader
+        self.assertEqual(self.f.read(), self.data)
+
+    def test_without_cache(self):
+        self.disk.close()
+        self.disk = utils.mount(PATH)
+        self.f = system.File(device=self.disk, index=self.f.index)
+        self.read_blocks(0, self.num_blocks)
+        self.assertEqual(system.Readahead.for_device(self.disk).blocks, self.num_blocks)
+
+
+class TestConcurrency(TestSystem):
+    """ Many threads creating, writing and reading files in shared Directories at once """
+    cache_size = 0
+    use_mmap = False
+    journal_blocks = 0
+    num_threads = 8
+    files_per_thread = 12
+
+    def setUp(self):
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-5)  # switch threads often, so races show up
+        open(PATH, 'a').close()
+        utils.makefs(PATH, block_size=64, num_inodes=256, num_data_blocks=4096, journal_blocks=self.journal_blocks)
+        self.disk = utils.mount(PATH, cache_size=self.cache_size, use_mmap=self.use_mmap)
+        self.errors = []
+
+    def tearDown(self):
+        sys.setswitchinterval(self.switch_interval)
+        self.disk.close()
+        os.remove(PATH)
+
+    @staticmethod
+    def data(thread: int, i: int) -> bytes:
+        return bytes([thread * 16 + i]) * (50 + 37 * i)
+
+    def worker(self, thread: int) -> None:
+        try:
+            inodes = system.InodeCache.for_device(self.disk)
+            root = inodes.get(ds.ROOT_INODE)
+            directory = inodes.create(system.Directory)
+            root.add('d{}'.format(thread), directory.index)
+            for i in range(self.files_per_thread):
+                f = inodes.create(system.File)
+                (root if i % 2 else directory).add('t{}-{}'.format(thread, i), f.index)
+                data = self.data(thread, i)
+                for start in range(0, len(data), 45):
+                    f.write(data[start:start + 45])
+                f.pwrite(10, data[10:30])
+                if f.read() != data:
+                    self.errors.append((thread, i))
+                inodes.release(f)
+            inodes.release(directory)
+            inodes.release(root)
+        except Exception as e:
+            self.errors.append(e)
+
+    def test_create_and_write(self):
+        threads = [threading.Thread(target=self.worker, args=(thread,)) for thread in range(self.num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.errors, [])
+
+        self.disk.close()
+        self.disk = utils.mount(PATH, cache_size=self.cache_size, use_mmap=self.use_mmap)
+        freelist = ds.DataBlockFreeList.for_device(self.disk)
+        blocks = []  # type: list
+        for thread in range(self.num_threads):
+            for i in range(self.files_per_thread):
+                path = '/t{}-{}'.format(thread, i) if i % 2 else '/d{}/t{}-{}'.format(thread, thread, i)
+                f = system.File(device=self.disk, index=system.resolve(self.disk, path))
+                self.assertEqual(f.read(), self.data(thread, i), path)
+                blocks += f._block_indices() + f._indirect_indices()
+        self.assertEqual(len(blocks), len(set(blocks)))  # no block belongs to two files
+        self.assertFalse(any(freelist.is_free(index) for index in blocks))
+        self.assertEqual(len(system.Directory(device=self.disk, index=ds.ROOT_INODE).read()[0]),
+                         self.num_threads * (1 + self.files_per_thread // 2))
+
+
+class TestConcurrencyCached(TestConcurrency):
+    cache_size = 64
+
+
+class TestConcurrencyMmap(TestConcurrency):
+    use_mmap = True
+
+
+class TestConcurrencyJournal(TestConcurrency):
+    cache_size = 64
+    journal_blocks = 128  # small enough to commit and checkpoint while the threads run
+
+
+class TestDentryCache(unittest.TestCase):
+    def test_lru(self):
+        dentries = system.DentryCache(capacity=2)
+        dentries.put(0, 'a', 1)
+        dentries.put(0, 'b', None)
+        self.assertEqual(dentries.get(0, 'a'), 1)
+        dentries.put(0, 'c', 3)
+        self.assertIs(dentries.get(0, 'b'), system.DentryCache.MISSING)
+        self.assertEqual(len(dentries), 2)
+
+    def test_invalidate_parent(self):
+        dentries = system.DentryCache()
+        dentries.put(0, 'a', 1)
+        dentries.put(1, 'b', 2)
+        dentries.invalidate(1)
+        self.assertEqual(dentries.get(0, 'a'), 1)
+        self.assertIs(dentries.get(1, 'b'), system.DentryCache.MISSING)
@@ -0,0 +1,131 @@
+"""
+Unit tests for unix_fs/unix_fs.py: the FUSE operations, called directly without mounting
+
+Author: Angad Gill
+"""
+
+import errno
+import os
+import unittest
+from importlib import reload
+from itertools import count
+
+from unix_fs import device_io
+from unix_fs import data_structures as ds
+from unix_fs import journal
+from unix_fs import system
+from unix_fs import utils
+
+try:
+    from unix_fs import unix_fs
+except ImportError:  # fusepy is not installed
+    unix_fs = None
+
+PATH = 'temp_unit_test_file'
+
+
+@unittest.skipIf(unix_fs is None, 'needs fusepy')
+class TestUnixFS(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        reload(device_io)
+        reload(ds)
+        reload(journal)
+        reload(system)
+        reload(utils)
+        reload(unix_fs)
+
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH, block_size=256, num_inodes=64, num_data_blocks=1024, journal_blocks=64)
+        self.disk = utils.mount(PATH)
+        self.fs = unix_fs.UnixFS(self.disk)
+
+    def tearDown(self):
+        self.disk.close()
+        os.remove(PATH)
+
+    def create(self, path: str, data: bytes) -> int:
+        """ Creates a File at path holding data, and returns its inode index """
+        fh = self.fs('create', path, 0o644)
+        self.fs('write', path, data, 0, fh)
+        self.fs('release', path, fh)
+        return system.resolve(self.disk, path)
+
+    def assertErrno(self, code: int, op: str, *args):
+        with self.assertRaises(OSError) as context:
+            self.fs(op, *args)
+        self.assertEqual(context.exception.errno, code)
+
+    def record_transactions(self, *names: str) -> list:
+        """ Records, for each call of the Directory methods names, the outermost journal transaction it runs in """
+        log = self.disk.journal
+        transaction = log.transaction
+        numbers = count(1)
+        current = [0]
+        calls = []
+
+        def numbered():
+            if not getattr(log._local, 'depth', 0):
+                current[0] = next(numbers)
+            return transaction()
+        log.transaction = numbered
+        for name in names:
+            method = getattr(system.Directory, name)
+
+            def recorded(directory, *args, method=method):
+                calls.append(current[0])
+                return method(directory, *args)
+            setattr(system.Directory, name, recorded)
+            self.addCleanup(setattr, system.Directory, name, method)
+        return calls
+
+    def test_rename_over_existing(self):
+        index = self.create('/a', b'new')
+        replaced = self.create('/b', b'old')
+        calls = self.record_transactions('remove', 'rename')
+        self.fs('rename', '/a', '/b')
+        self.assertGreater(len(calls), 1)
+        self.assertEqual(len(set(calls)), 1)  # the old /b is removed in the transaction of the move
+        self.assertEqual(system.resolve(self.disk, '/b'), index)
+        self.assertErrno(errno.ENOENT, 'getattr', '/a')
+        self.assertTrue(ds.InodeFreeList.for_device(self.disk).is_free(replaced))
+        fh = self.fs('open', '/b', os.O_RDONLY)
+        self.assertEqual(self.fs('read', '/b', 10, 0, fh), b'new')
+        self.fs('release', '/b', fh)
+
+    def test_rename_over_not_empty(self):
+        self.fs('mkdir', '/d', 0o755)
+        self.fs('mkdir', '/e', 0o755)
+        self.create('/e/f', b'data')
+        self.assertErrno(errno.ENOTEMPTY, 'rename', '/d', '/e')
+        self.assertErrno(errno.EISDIR, 'rename', '/e/f', '/d')
+        self.assertEqual(self.fs('readdir', '/', None), ['.', '..', 'd', 'e'])
+        self.assertEqual(self.fs('readdir', '/e', None), ['.', '..', 'f'])
+
+    def test_unlink_open(self):
+        self.create('/a', b'test data')
+        fh = self.fs('open', '/a', os.O_RDWR)
+        index = system.resolve(self.disk, '/a')
+        self.fs('unlink', '/a')
+        self.assertErrno(errno.ENOENT, 'getattr', '/a')
+        self.assertEqual(self.fs('read', '/a', 100, 0, fh), b'test data')  # still open
+        self.assertFalse(ds.InodeFreeList.for_device(self.disk).is_free(index))
+        self.fs('release', '/a', fh)
+        self.assertTrue(ds.InodeFreeList.for_device(self.disk).is_free(index))
+
+    def test_rmdir_not_empty(self):
+        self.fs('mkdir', '/d', 0o755)
+        self.create('/d/f', b'data')
+        self.assertErrno(errno.ENOTEMPTY, 'rmdir', '/d')
+        self.fs('unlink', '/d/f')
+        self.fs('rmdir', '/d')
+        self.assertErrno(errno.ENOENT, 'getattr', '/d')
+
+    def test_name_too_long(self):
+        name = '/' + 'f' * (ds.MAX_FILENAME_LENGTH + 1)
+        self.assertErrno(errno.ENAMETOOLONG, 'create', name, 0o644)
+        self.assertErrno(errno.ENAMETOOLONG, 'mkdir', name, 0o755)
+        self.assertErrno(errno.ENOENT, 'getattr', name)
+        self.create('/a', b'data')
+        self.assertErrno(errno.ENAMETOOLONG, 'rename', '/a', name)
@@ -0,0 +1,79 @@
+"""
+Unit tests for unix_fs/utils.py
+
+Author: Angad Gill
+"""
+
+import os
+import unittest
+from importlib import reload
+
+from unix_fs import device_io
+from unix_fs import data_structures as ds
+from unix_fs import system
+from unix_fs import utils
+
+PATH = 'temp_unit_test_file'
+
+
+class TestUtils(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        reload(device_io)
+        reload(ds)
+        reload(system)
+        reload(utils)
+
+    def setUp(self):
+        open(PATH, 'a').close()
+        utils.makefs(PATH)
+
+    def tearDown(self):
+        os.remove(PATH)
+
+    def test_mount_layout(self):
+        disk = utils.mount(PATH)
+        self.assertEqual(disk.layout.inode_start, 1)
+        self.assertEqual(disk.layout.data_start, 33)
+        disk.close()
+
+    def test_mount_write_read(self):
+        disk = utils.mount(PATH, cache_size=16)
+        f = system.File(device=disk)
+        f.write(b'test data')
+        disk.close()
+        disk = utils.mount(PATH)
+        self.assertEqual(system.File(device=disk, index=f.index).read(), b'test data')
+        disk.close()
+
+    def test_mount_mmap(self):
+        disk = utils.mount(PATH, use_mmap=True)
+        self.assertIsInstance(disk, device_io.MmapDisk)
+        f = system.File(device=disk)
+        f.write(b'test data')
+        disk.close()
+        disk = utils.mount(PATH)
+        self.assertEqual(system.File(device=disk, index=f.index).read(), b'test data')
+        disk.close()
+
+    def test_makefs_geometry(self):
+        utils.makefs(PATH, block_size=4096, num_inodes=1000, num_data_blocks=10000)
+        disk = utils.mount(PATH)
+        self.assertEqual(disk.block_size, 4096)
+        self.assertEqual(disk.layout.num_inodes, 1000)
+        self.assertEqual(ds.InodeFreeList.for_device(disk).num_free, 999)  # root directory
+        self.assertEqual(ds.DataBlockFreeList.for_device(disk).num_free, 9999)
+        self.assertEqual(os.path.getsize(PATH), disk.layout.total_blocks * 4096)
+        disk.close()
+
+    def test_makefs_geometry_write_read(self):
+        utils.makefs(PATH, block_size=4096, num_inodes=100, num_data_blocks=1000)
+        disk = utils.mount(PATH, cache_size=16)
+        files = [system.File(device=disk) for _ in range(3)]  # Inodes sharing one block
+        for i, f in enumerate(files):
+            f.write(bytes([i + 1]) * (4096 * i + 10))
+        disk.close()
+        disk = utils.mount(PATH)
+        for i, f in enumerate(files):
+            self.assertEqual(system.File(device=disk, index=f.index).read(), bytes([i + 1]) * (4096 * i + 10))
+        disk.close()
@@ -0,0 +1,203 @@
+"""
+asyncio front end of the file system
+
+Author: Angad Gill
+"""
+import asyncio
+import posixpath
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from unix_fs import system
+from unix_fs.journal import transaction
+
+DEFAULT_MAX_WORKERS = 4  # executor threads doing device I/O
+
+
+class AsyncFS(object):
+    """
+    Async open, create, readdir and File reads and writes on a mounted device. Every call into the file system runs
+    on a bounded ThreadPoolExecutor, so the event loop never blocks on device I/O, and calls on different files
+    run in parallel.
+    Concurrent reads of the same block of a File share one executor call. Writes to a File run one at a time,
+    and reads wait for the write in flight, so a read sees every write that was issued before it.
+    """
+    def __init__(self, device, max_workers: int = DEFAULT_MAX_WORKERS):
+        self.device = device
+        self.inodes = system.InodeCache.for_device(device)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='unix_fs.aio')
+        self._reads = {}  # type: Dict[Tuple[int, int], asyncio.Future] # (inode index, logical block) -> its data
+        self._writes = {}  # type: Dict[int, asyncio.Future] # inode index -> write in flight
+        self._write_locks = weakref.WeakValueDictionary()  # type: weakref.WeakValueDictionary # index -> Lock
+        self.reads = 0  # executor calls reading File data
+        self.coalesced = 0  # blocks read by a call already in flight for another request
+
+    async def _run(self, func, *args):
+        """ Runs func on the executor """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _directory(self, path: str) -> system.Directory:
+        """ The Directory at path, with a reference the caller releases """
+        directory = self.inodes.get(system.resolve(self.device, path))
+        if not isinstance(directory, system.Directory):
+            self.inodes.release(directory)
+            raise NotADirectoryError('{} is not a directory'.format(path))
+        return directory
+
+    def _open(self, path: str) -> system.File:
+        f = self.inodes.get(system.resolve(self.device, path))
+        if not isinstance(f, system.File):
+            self.inodes.release(f)
+            raise IsADirectoryError('{} is a directory'.format(path))
+        return f
+
+    def _create(self, path: str) -> system.File:
+        parent, name = posixpath.split(path)
+        directory = self._directory(parent)
+        try:
+            with directory.lock.writing():
+                try:
+                    directory.lookup(name)
+                except FileNotFoundError:
+                    with transaction(self.device):
+                        f = self.inodes.create(system.File)
+                        directory.add(name, f.index)
+                    return f
+                raise FileExistsError('{} exists'.format(path))
+        finally:
+            self.inodes.release(directory)
+
+    def _readdir(self, path: str) -> List[str]:
+        directory = self._directory(path)
+        try:
+            return directory.read()[0]
+        finally:
+            self.inodes.release(directory)
+
+    async def open(self, path: str) -> 'AsyncFile':
+        return AsyncFile(self, await self._run(self._open, path))
+
+    async def create(self, path: str) -> 'AsyncFile':
+        """ Creates an empty File at path and opens it """
+        return AsyncFile(self, await self._run(self._create, path))
+
+    async def readdir(self, path: str) -> List[str]:
+        return await self._run(self._readdir, path)
+
+    async def close(self) -> None:
+        """ Writes everything cached to the device and stops the executor. The device stays open """
+        await self._run(self.device.sync)
+        self._executor.shutdown()
+
+    def _read_blocks(self, f: system.File, first: int, last: int) -> List[asyncio.Future]:
+        """
+        Returns a Future of the data of each logical block from first to last. Blocks already being read share
+        that read. The others are read with one executor call per run of consecutive blocks.
+        """
+        futures = []  # type: List[asyncio.Future]
+        run = []  # type: List[int]
+        for logical in range(first, last + 1):
+            future = self._reads.get((f.index, logical))
+            if future is None:
+                future = asyncio.get_running_loop().create_future()
+                self._reads[(f.index, logical)] = future
+                run.append(logical)
+            else:
+                self.coalesced += 1
+                if run:
+                    self._start_read(f, run, futures[-len(run):])
+                    run = []
+            futures.append(future)
+        if run:
+            self._start_read(f, run, futures[-len(run):])
+        return futures
+
+    def _start_read(self, f: system.File, run: List[int], futures: List[asyncio.Future]) -> None:
+        asyncio.ensure_future(self._read_run(f, run, futures))
+
+    async def _read_run(self, f: system.File, run: List[int], futures: List[asyncio.Future]) -> None:
+        block_size = f._block_size
+        self.reads += 1
+        try:
+            data = await self._run(f.pread, run[0] * block_size, len(run) * block_size)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for i, future in enumerate(futures):
+                future.set_result(data[i * block_size:(i + 1) * block_size])
+        finally:
+            for logical, future in zip(run, futures):
+                if self._reads.get((f.index, logical)) is future:
+                    del self._reads[(f.index, logical)]
+
+    def _write_lock(self, index: int) -> asyncio.Lock:
+        lock = self._write_locks.get(index)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._write_locks[index] = lock
+        return lock
+
+    async def _write(self, f: system.File, offset, data) -> int:
+        """ Writes data at offset, or appends it if offset is None """
+        async with self._write_lock(f.index):
+            done = asyncio.get_running_loop().create_future()
+            self._writes[f.index] = done
+            # Reads in flight may miss this write: reads issued from now on must not share them
+            for key in [key for key in self._reads if key[0] == f.index]:
+                del self._reads[key]
+            try:
+                return await self._run(f.pwrite, f.size if offset is None else offset, data)
+            finally:
+                del self._writes[f.index]
+                done.set_result(None)
+
+
+class AsyncFile(object):
+    """ File opened by AsyncFS. Holds a reference in the InodeCache until close() """
+    def __init__(self, fs: AsyncFS, f: system.File):
+        self._fs = fs
+        self._file = f
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @property
+    def index(self) -> int:
+        return self._file.index
+
+    @property
+    def size(self) -> int:
+        return self._file.size
+
+    async def pread(self, offset: int, size: int) -> bytes:
+        """ Reads up to size bytes from offset """
+        while self._file.index in self._fs._writes:
+            await self._fs._writes[self._file.index]
+        size = min(size, self._file.size - offset)
+        if size <= 0:
+            return b''
+        block_size = self._file._block_size
+        first = offset // block_size
+        last = (offset + size - 1) // block_size
+        data = b''.join(await asyncio.gather(*self._fs._read_blocks(self._file, first, last)))
+        start = offset - first * block_size
+        return data[start:start + size]
+
+    async def read(self) -> bytes:
+        return await self.pread(0, self._file.size)
+
+    async def pwrite(self, offset: int, data) -> int:
+        """ Writes data at offset, overwriting existing data and extending the File. Returns the number written """
+        return await self._fs._write(self._file, offset, data)
+
+    async def write(self, data) -> int:
+        """ Appends data to the File """
+        return await self._fs._write(self._file, None, data)
+
+    async def close(self) -> None:
+        await self._fs._run(self._fs.inodes.release, self._file)
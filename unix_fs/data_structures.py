@@ -6,12 +6,19 @@ Superblock
 All Inodes
 Inode Freelist
 Block Freelist
-Root Directory
+Data blocks
 
 Author: Angad Gill
 """
+from collections import namedtuple
+from contextlib import contextmanager
+from errno import ENOSPC
+from functools import lru_cache
 from typing import List
+import bisect
 import struct
+import threading
+import weakref
 
 BLOCK_SIZE = 50
 NUM_DATA_BLOCKS = 100
@@ -20,18 +27,49 @@ ADDRESS_LENGTH = 4  # bytes # Not using this! All addresses are 8 bytes (long in
 NUM_INODES = 10
 INODE_NUM_DIRECT_BLOCKS = 5
 INODE_NUM_1_INDIRECT_BLOCKS = 1 # number of single indirect blocks
+INODE_NUM_2_INDIRECT_BLOCKS = 1  # number of double indirect blocks
+INODE_NUM_EXTENTS = 4  # (start, length) pairs used in place of block pointers by extent mode inodes
+
+INODE_FLAG_EXTENTS = 1  # Inode maps its data with extents instead of address_direct
+INODE_FLAG_INLINE = 2  # Inode holds the data of a small file in place of its block map
+
+BEST_FIT = True  # FreeList.allocate_many takes the smallest free run that fits instead of the next one
+BEST_FIT_MIN_RUN = 16  # best fit prefers runs of at least this many items, which leave files room to grow in place
+
+ROOT_INODE = 0  # index of the root Directory Inode, written by makefs
 
-NUM_FILES_PER_DIR_BLOCK = 5
 MAX_FILENAME_LENGTH = 5  # bytes
 
 
+Extent = namedtuple('Extent', ['start', 'length'])  # run of consecutive indices
+
+
+def _follows(extent: Extent, index: int) -> bool:
+    """ True if index continues extent. Index 0 is a hole (data block 0 is reserved by makefs and never mapped) """
+    return extent.start + extent.length == index if extent.start else index == 0
+
+
+def to_extents(indices: List[int]) -> List[Extent]:
+    """ Groups indices, in order, into Extents of consecutive indices. Runs of 0 become holes: Extent(0, length) """
+    extents = []  # type: List[Extent]
+    for index in indices:
+        if extents and _follows(extents[-1], index):
+            extents[-1] = Extent(extents[-1].start, extents[-1].length + 1)
+        else:
+            extents.append(Extent(index, 1))
+    return extents
+
+
 class Base(object):
     """ Base class with helper functions """
+    __slots__ = ()
+
     @staticmethod
-    def pad_bytes_to_block(byte_data: bytes) -> bytes:
-        """ Pads byte data to BLOCK_SIZE """
-        if len(byte_data) < BLOCK_SIZE:
-            byte_data = byte_data + bytes(BLOCK_SIZE - len(byte_data))
+    def pad_bytes_to_block(byte_data: bytes, block_size: int = None) -> bytes:
+        """ Pads byte data to block_size, BLOCK_SIZE by default """
+        block_size = BLOCK_SIZE if block_size is None else block_size
+        if len(byte_data) < block_size:
+            byte_data = byte_data + bytes(block_size - len(byte_data))
         return byte_data
 
     """ int <--> bytes conversions """
@@ -92,17 +130,32 @@ class Base(object):
 
 
 class Block(Base):
-    """ All data types stored on disk are stored as Blocks. Data is read and written to device in BLOCK_SIZE chunks """
+    """
+    All data types stored on disk are stored as Blocks. Data is read and written to device in BLOCK_SIZE chunks.
+    _struct packs the list self._items. It is compiled once per class, or once per block size for Blocks whose
+    format depends on it.
+    """
+    __slots__ = ('_device',)
+    _struct = struct.Struct('')
 
     def __init__(self, device=None):
         self._device = device
-        self._format = ''  # type: str # Packing format for list self._item
 
     @property
     def address(self) -> int:
         """ Block address of the object on disk """
         return 0
 
+    @property
+    def _layout(self) -> 'Layout':
+        """ Layout of the device. Computed once per device and reused by every address lookup """
+        return Layout.for_device(self._device)
+
+    @property
+    def _block_size(self) -> int:
+        """ Block size of the device, or BLOCK_SIZE for objects not on a device """
+        return BLOCK_SIZE if self._device is None else self._layout.block_size
+
     @property
     def _items(self) -> List:
         """ Returns a list of all properties that are written to disk """
@@ -116,108 +169,560 @@ class Block(Base):
     @property
     def _size(self) -> int:
         """ Byte size of object on disk """
-        return struct.calcsize(self._format)
+        return self._struct.size
 
     def __bytes__(self) -> bytes:
         """
         Magic function which is called when bytes() is called on the object.
         Must return bytes padded to the BLOCK_SIZE of the file system.
         """
-        bytes_data = struct.pack(self._format, *self._items)
-        return self.pad_bytes_to_block(bytes_data)
+        bytes_data = self._struct.pack(*self._items)
+        return self.pad_bytes_to_block(bytes_data, self._block_size)
 
     def __write__(self) -> None:
-        self._device.seek(self.address)
-        self._device.write(self.__bytes__())
+        """
+        Objects that fit in a block are packed straight into the device block, or its cached copy.
+        On a device with a journal the blocks are logged in its running transaction instead
+        """
+        st = self._struct
+        if self._device.journal is not None:
+            self._device.journal.write(self.address, self.__bytes__())
+            return
+        if st.size <= self._device.block_size:
+            self._device.pack_into(st, self.address, *self._items)
+            return
+        self._device.pwrite(self.address, self.__bytes__())
 
     def __decode__(self, byte_data) -> List:
-        byte_data = byte_data[:self._size]  # truncate to remove padding bytes
-        return list(struct.unpack(self._format, byte_data))
+        return list(self._struct.unpack_from(byte_data))  # ignores the padding bytes after the packed data
 
     def __read__(self):
-        self._device.seek(self.address)
-        byte_data = self._device.read(self._size)
+        """ Objects that fit in a block are unpacked straight from the device block, or its cached copy """
+        st = self._struct
+        if st.size <= self._device.block_size:
+            self._items = self._device.unpack_from(st, self.address)
+            return
+        byte_data = self._device.pread(self.address, self._device.num_blocks(st.size))
         self._items = self.__decode__(byte_data)
 
 
 class SuperBlock(Block):
+    """ Geometry of the file system. Written by makefs and read at mount time """
+    __slots__ = ('block_size', 'num_inodes', 'num_data_blocks')
+    _struct = struct.Struct('lll')
+
     def __init__(self, device=None):
         super().__init__(device=device)
-        self._format = 'll'
         self.block_size = BLOCK_SIZE
         self.num_inodes = NUM_INODES
+        self.num_data_blocks = NUM_DATA_BLOCKS
         if device is not None:
             self.__read__()
 
+    @classmethod
+    def from_layout(cls, layout: 'Layout') -> 'SuperBlock':
+        superblock = cls()
+        superblock.block_size = layout.block_size
+        superblock.num_inodes = layout.num_inodes
+        superblock.num_data_blocks = layout.num_data_blocks
+        return superblock
+
     @property
     def _items(self):
-        return [self.block_size, self.num_inodes]
+        return [self.block_size, self.num_inodes, self.num_data_blocks]
 
     @_items.setter
     def _items(self, value):
-        [self.block_size, self.num_inodes] = value
+        [self.block_size, self.num_inodes, self.num_data_blocks] = value
+
+
+class Layout(object):
+    """
+    Geometry of the file system and start block address of each region on disk.
+    Computed once at mount time from the SuperBlock and shared by all Blocks. Module constants are the defaults.
+    Inodes smaller than a block are packed inodes_per_block to a block. Larger ones take inode_blocks blocks each.
+    """
+    def __init__(self, block_size: int = None, num_inodes: int = None, num_data_blocks: int = None):
+        self.block_size = BLOCK_SIZE if block_size is None else block_size
+        self.num_inodes = NUM_INODES if num_inodes is None else num_inodes
+        self.num_data_blocks = NUM_DATA_BLOCKS if num_data_blocks is None else num_data_blocks
+
+        superblock_blocks = self.num_blocks(SuperBlock()._size)
+        self.inode_size = Inode()._size
+        self.inodes_per_block = max(1, self.block_size // self.inode_size)
+        self.inode_blocks = self.num_blocks(self.inode_size) if self.inodes_per_block == 1 else 1
+        inode_table_blocks = -(-self.num_inodes // self.inodes_per_block) * self.inode_blocks
+        inode_freelist_blocks = self.num_blocks(FreeList.num_bytes(self.num_inodes))
+        data_block_freelist_blocks = self.num_blocks(FreeList.num_bytes(self.num_data_blocks))
+
+        self.inode_start = superblock_blocks
+        self.inode_freelist_start = self.inode_start + inode_table_blocks
+        self.data_block_freelist_start = self.inode_freelist_start + inode_freelist_blocks
+        self.data_start = self.data_block_freelist_start + data_block_freelist_blocks
+        self.total_blocks = self.data_start + self.num_data_blocks
+
+    def num_blocks(self, size: int) -> int:
+        return -(-size // self.block_size)
+
+    @classmethod
+    def for_device(cls, device) -> 'Layout':
+        """ Returns the Layout of the device, computing it from the module defaults if it was not mounted """
+        if device is None:
+            return cls()
+        if device.layout is None:
+            device.layout = cls()
+        return device.layout
+
+    @classmethod
+    def from_superblock(cls, superblock: SuperBlock) -> 'Layout':
+        return cls(block_size=superblock.block_size, num_inodes=superblock.num_inodes,
+                   num_data_blocks=superblock.num_data_blocks)
+
+
+class FreeExtents(object):
+    """
+    Index of the runs of free items of a FreeList, sorted both by start and by (length, start), so the smallest run
+    of at least n items and the run holding an index are found by bisection.
+    Adding a run merges it with the runs it touches; removing items splits the runs they are in.
+    """
+    __slots__ = ('_starts', '_lengths', '_sizes')
+
+    def __init__(self, extents: List[Extent] = ()):
+        self._starts = []  # type: List[int]
+        self._lengths = {}  # type: dict # start -> length
+        self._sizes = []  # type: List # (length, start)
+        for extent in extents:
+            self.add(extent.start, extent.length)
+
+    @classmethod
+    def from_freelist(cls, freelist: 'FreeList') -> 'FreeExtents':
+        extents = []  # type: List[Extent]
+        start = freelist._find(0, free=True)
+        while start is not None:
+            end = freelist._find(start, free=False)
+            end = freelist.n if end is None else end
+            extents.append(Extent(start, end - start))
+            start = freelist._find(end, free=True)
+        return cls(extents)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __iter__(self):
+        return (Extent(start, self._lengths[start]) for start in self._starts)
+
+    def _insert(self, start: int, length: int) -> None:
+        bisect.insort(self._starts, start)
+        self._lengths[start] = length
+        bisect.insort(self._sizes, (length, start))
+
+    def _delete(self, start: int) -> int:
+        del self._starts[bisect.bisect_left(self._starts, start)]
+        length = self._lengths.pop(start)
+        del self._sizes[bisect.bisect_left(self._sizes, (length, start))]
+        return length
+
+    def _overlapping(self, start: int, end: int) -> List[int]:
+        """ Starts of the runs that overlap or touch start to end """
+        i = bisect.bisect_right(self._starts, start) - 1
+        if i < 0 or self._starts[i] + self._lengths[self._starts[i]] < start:
+            i += 1
+        j = bisect.bisect_right(self._starts, end)
+        return self._starts[i:j]
+
+    def add(self, start: int, length: int) -> None:
+        """ Marks length items from start free """
+        end = start + length
+        for run in self._overlapping(start, end):
+            end = max(end, run + self._delete(run))
+            start = min(start, run)
+        self._insert(start, end - start)
+
+    def remove(self, start: int, length: int) -> None:
+        """ Marks length items from start used """
+        end = start + length
+        for run in self._overlapping(start, end):
+            run_end = run + self._delete(run)
+            if run < start:
+                self._insert(run, start - run)
+            if run_end > end:
+                self._insert(end, run_end - end)
+
+    def find(self, index: int) -> Extent:
+        """ Returns the run holding index, or None """
+        i = bisect.bisect_right(self._starts, index) - 1
+        if i >= 0 and self._starts[i] + self._lengths[self._starts[i]] > index:
+            return Extent(self._starts[i], self._lengths[self._starts[i]])
+        return None
+
+    def best_fit(self, length: int) -> Extent:
+        """ Returns the smallest run of at least length items, the first of those of the same length, or None """
+        j = bisect.bisect_left(self._sizes, (length, -1))
+        return Extent(self._sizes[j][1], self._sizes[j][0]) if j < len(self._sizes) else None
+
+    def largest(self) -> Extent:
+        """ Returns the first of the longest runs, or None """
+        if not self._sizes:
+            return None
+        j = bisect.bisect_left(self._sizes, (self._sizes[-1][0], -1))
+        return Extent(self._sizes[j][1], self._sizes[j][0])
 
 
 class FreeList(Block):
+    """
+    Bitmap of n items stored 1 bit per item, least significant bit first. A set bit means the item is free.
+    allocate() is next-fit: scanning starts from a cursor after the last allocated item, 64 items at a time.
+    allocate_many() is best-fit (see BEST_FIT) and can be given a goal, such as the item after the last block of a
+    file: it looks the runs up in a FreeExtents index built from the bitmap on first use.
+    Allocation, deallocation and writes of the bitmap hold the lock of the freelist, so threads may share it.
+    Only the blocks of the bitmap changed since the last write are written, and the free items are counted as they
+    change.
+    """
+    __slots__ = ('n', '_cursor', '_bitmap', '_lock', '_free_extents', '_dirty', '_num_free')
+
     def __init__(self, n=0, device=None):
         super().__init__(device=device)
+        self.n = n
+        self._cursor = 0  # index to start the next search from
+        self._lock = threading.RLock()
+        self._free_extents = None  # type: FreeExtents # built by free_extents
+        self._bitmap = bytearray()  # type: bytearray # padded in memory to a whole number of 8-byte words
+        self._dirty = None  # type: set # bitmap blocks changed since the last write. None for all of them
+        self._num_free = 0
         self.list = [True] * n
-        self._format = '{}?'.format(n)  # format as n booleans
 
         if device is not None:
             self.__read__()
 
+    @classmethod
+    def for_device(cls, device) -> 'FreeList':
+        """ Returns the live freelist of the device, reading it from disk on first use """
+        key = cls.__name__
+        if key not in device.freelists:
+            with device.lock:
+                if key not in device.freelists:
+                    device.freelists[key] = cls(device=device)
+        return device.freelists[key]
+
+    @staticmethod
+    def num_bytes(n: int) -> int:
+        """ Bytes on disk of a bitmap of n items """
+        return -(-n // 8)
+
+    @property
+    def _num_bytes(self) -> int:
+        return self.num_bytes(self.n)
+
+    @property
+    def _struct(self) -> struct.Struct:
+        return self._struct_for(self.n)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _struct_for(n: int) -> struct.Struct:
+        return struct.Struct('{}s'.format(FreeList.num_bytes(n)))
+
+    @property
+    def list(self) -> List[bool]:
+        """ Free state of every item as a list of bools """
+        return [bool(self._bitmap[i >> 3] >> (i & 7) & 1) for i in range(self.n)]
+
+    @list.setter
+    def list(self, value: List[bool]) -> None:
+        self.n = len(value)
+        bits = int(''.join(['1' if free else '0' for free in reversed(value)]) or '0', 2)
+        self._bitmap = bytearray(bits.to_bytes(-(-len(value) // 64) * 8, 'little'))
+        self._free_extents = None
+        self._dirty = None
+        self._num_free = bits.bit_count()
+
+    @property
+    def free_extents(self) -> FreeExtents:
+        """ Runs of free items, kept up to date by allocation and deallocation once built """
+        with self._lock:
+            if self._free_extents is None:
+                self._free_extents = FreeExtents.from_freelist(self)
+            return self._free_extents
+
+    @property
+    def num_free(self) -> int:
+        return self._num_free
+
     @property
     def _items(self):
-        return self.list
+        return [bytes(self._bitmap[:self._num_bytes])]
 
     @_items.setter
     def _items(self, value):
-        self.list = value
+        bitmap = bytearray(value[0])
+        bitmap += bytes(-len(bitmap) % 8)
+        if self.n % 8:
+            bitmap[self.n >> 3] &= (1 << (self.n % 8)) - 1  # bits past n are never free
+        self._bitmap = bitmap
+        self._free_extents = None
+        self._dirty = set()
+        self._num_free = int.from_bytes(bitmap, 'little').bit_count()
+
+    def _mark_dirty(self, start: int, length: int) -> None:
+        """ Records the bitmap blocks holding the bits of length items from start as changed """
+        if self._dirty is not None and length:
+            block_size = self._block_size
+            self._dirty.update(range((start >> 3) // block_size, ((start + length - 1) >> 3) // block_size + 1))
+
+    def is_free(self, index: int) -> bool:
+        return bool(self._bitmap[index >> 3] >> (index & 7) & 1)
+
+    def _find(self, start: int = 0, free: bool = True):
+        """ Returns the index of the first free (or used) item at or after start, or None """
+        if start >= self.n:
+            return None
+        full = 0xFFFFFFFFFFFFFFFF
+        skip = 0 if free else full  # value of a word with nothing to find in it
+        w = start >> 6
+        word = int.from_bytes(self._bitmap[w * 8:w * 8 + 8], 'little')
+        if not free:
+            word ^= full
+        word &= ~((1 << (start & 63)) - 1)  # mask off items before start in the first word
+        if not word:
+            words = memoryview(self._bitmap).cast('Q')
+        while not word:
+            w += 1
+            while w < len(words) and words[w] == skip:
+                w += 1
+            if w == len(words):
+                return None
+            word = int.from_bytes(self._bitmap[w * 8:w * 8 + 8], 'little')
+            if not free:
+                word ^= full
+        index = (w << 6) + (word & -word).bit_length() - 1
+        return index if index < self.n else None
+
+    def _find_free(self, start: int = 0):
+        return self._find(start, free=True)
+
+    def _find_run(self, length: int, start: int = 0):
+        """ Returns the start of the first run of length free items at or after start, or None """
+        index = self._find(start, free=True)
+        while index is not None:
+            end = self._find(index, free=False)
+            end = self.n if end is None else end
+            if end - index >= length:
+                return index
+            index = self._find(end, free=True)
+        return None
+
+    def _set_range(self, start: int, length: int, free: bool) -> None:
+        changed = 0
+        for index in range(start, start + length):
+            bit = 1 << (index & 7)
+            if bool(self._bitmap[index >> 3] & bit) != free:
+                self._bitmap[index >> 3] ^= bit
+                changed += 1
+        self._num_free += changed if free else -changed
+        self._mark_dirty(start, length)
+        if self._free_extents is not None:
+            if free:
+                self._free_extents.add(start, length)
+            else:
+                self._free_extents.remove(start, length)
 
     def allocate(self, write_through: bool = True) -> int:
-        """ Finds the first free item and returns index """
-        for i, item in enumerate(self.list):
-            if item:  # is true
-                self.list[i] = False
+        """ Finds the next free item at or after the cursor, wrapping around once, and returns index """
+        with self._lock:
+            index = self._find_free(self._cursor)
+            if index is None:
+                index = self._find_free(0)
+            if index is None:
+                raise Exception('No free items in {}.'.format(self.__class__))
+            self._bitmap[index >> 3] &= ~(1 << (index & 7))
+            self._num_free -= 1
+            self._mark_dirty(index, 1)
+            if self._free_extents is not None:
+                self._free_extents.remove(index, 1)
+            self._cursor = index + 1
+            if write_through:
+                self.__write__()
+            return index
+
+    def deallocate(self, index: int, write_through: bool = True) -> None:
+        with self._lock:
+            if not self._bitmap[index >> 3] >> (index & 7) & 1:
+                self._bitmap[index >> 3] |= 1 << (index & 7)
+                self._num_free += 1
+                self._mark_dirty(index, 1)
+            if self._free_extents is not None:
+                self._free_extents.add(index, 1)
+            if write_through:
+                self.__write__()
+
+    def __write__(self) -> None:
+        """
+        Writes the blocks of the bitmap changed since the last write, or logs them in the journal of the device.
+        Holding the lock keeps an older copy from overwriting a newer one
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            block_size = self._block_size
+            num_bytes = self._num_bytes
+            blocks = range(-(-num_bytes // block_size)) if dirty is None else sorted(dirty)
+            data = {self.address + block: self.pad_bytes_to_block(
+                bytes(self._bitmap[block * block_size:min((block + 1) * block_size, num_bytes)]), block_size)
+                for block in blocks}
+            if self._device.journal is not None:
+                for block_pos, block in data.items():
+                    self._device.journal.write(block_pos, block)
+            elif data:
+                self._device.writev(data)
+
+    def allocate_many(self, n: int, contiguous: bool = True, write_through: bool = True,
+                      goal: int = None) -> List[Extent]:
+        """
+        Allocates n items in one pass and returns them as a list of Extents.
+        With contiguous=True a single run of n free items is used if one exists. With BEST_FIT that is the items
+        from goal if they are free, else the smallest run of at least BEST_FIT_MIN_RUN items, else the smallest run
+        that fits; when no run is long enough, the fewest runs that add up to n. Otherwise (or with contiguous=False)
+        free runs are taken in next-fit order from goal, or the cursor, until n items are allocated.
+        """
+        with self._lock:
+            if n > self.num_free:
+                raise Exception('Not enough free items in {} for {}.'.format(self.__class__, n))
+            if n == 0:
+                return []
+            if contiguous and BEST_FIT:
+                extents = self._allocate_best_fit(n, goal)
+                self._cursor = extents[-1].start + extents[-1].length
                 if write_through:
                     self.__write__()
-                return i
+                return extents
+            if goal is not None:
+                self._cursor = min(goal, self.n)
+            start = None
+            if contiguous:
+                start = self._find_run(n, self._cursor)
+                if start is None:
+                    start = self._find_run(n, 0)
+            if start is not None:
+                extents = [Extent(start, n)]
+                self._set_range(start, n, free=False)
+            else:
+                extents = []  # type: List[Extent]
+                index = self._cursor
+                remaining = n
+                while remaining:
+                    start = self._find(index, free=True)
+                    if start is None:
+                        start = self._find(0, free=True)
+                    end = self._find(start, free=False)
+                    end = self.n if end is None else end
+                    extent = Extent(start, min(end - start, remaining))
+                    self._set_range(extent.start, extent.length, free=False)
+                    extents.append(extent)
+                    remaining -= extent.length
+                    index = extent.start + extent.length
+            self._cursor = extents[-1].start + extents[-1].length
+            if write_through:
+                self.__write__()
+            return extents
+
+    def _allocate_best_fit(self, n: int, goal: int = None) -> List[Extent]:
+        runs = self.free_extents
+        run = runs.find(goal) if goal is not None else None
+        if run is not None and run.start + run.length - goal >= n:
+            run = Extent(goal, n)
         else:
-            raise Exception('No free items in {}.'.format(self.__class__))
-
-    def deallocate(self, index: int, write_through: bool = True) -> None:
-        self.list[index] = True
-        if write_through:
-            self.__write__()
+            run = runs.best_fit(max(n, BEST_FIT_MIN_RUN)) or runs.best_fit(n)
+        if run is not None:
+            self._set_range(run.start, n, free=False)
+            return [Extent(run.start, n)]
+        extents = []  # type: List[Extent]
+        remaining = n
+        while remaining:
+            run = runs.best_fit(remaining) or runs.largest()
+            extent = Extent(run.start, min(run.length, remaining))
+            self._set_range(extent.start, extent.length, free=False)
+            extents.append(extent)
+            remaining -= extent.length
+        return sorted(extents)
+
+    def deallocate_many(self, extents: List[Extent], write_through: bool = True) -> None:
+        with self._lock:
+            for extent in extents:
+                self._set_range(extent.start, extent.length, free=True)
+            if write_through:
+                self.__write__()
 
 
 class InodeFreeList(FreeList):
+    __slots__ = ()
+
     def __init__(self, device=None):
-        super().__init__(n=NUM_INODES, device=device)
+        super().__init__(n=Layout.for_device(device).num_inodes, device=device)
 
     @property
     def address(self) -> int:
-        byte_address = len(bytes(SuperBlock())) + \
-                       len(bytes(Inode()) * NUM_INODES)
-        block_address = int(byte_address/BLOCK_SIZE)
-        return block_address
+        return self._layout.inode_freelist_start
 
 
 class DataBlockFreeList(FreeList):
+    """
+    Freed data blocks are revoked from the journal of the device, if it has one.
+    Blocks for data buffered by delayed allocation are reserved when it is written: allocate_many cannot take
+    reserved blocks for other data, so the buffered data finds room once it is allocated. Single blocks for metadata,
+    like IndirectBlocks, may still use them
+    """
+    __slots__ = ('_reserved',)
+
     def __init__(self, device=None):
-        super().__init__(n=NUM_DATA_BLOCKS, device=device)
+        self._reserved = 0  # blocks reserved and not yet allocated
+        super().__init__(n=Layout.for_device(device).num_data_blocks, device=device)
+
+    @property
+    def num_available(self) -> int:
+        """ Free blocks that are not reserved """
+        return self.num_free - self._reserved
+
+    def reserve(self, n: int) -> None:
+        """ Sets n free blocks aside for a later allocate_many(reserved=n). Raises ENOSPC if there are not n """
+        with self._lock:
+            if n > self.num_available:
+                raise OSError(ENOSPC, 'No space left for {} blocks in {}'.format(n, self.__class__))
+            self._reserved += n
+
+    def unreserve(self, n: int) -> None:
+        with self._lock:
+            self._reserved -= n
+
+    def allocate_many(self, n: int, contiguous: bool = True, write_through: bool = True,
+                      goal: int = None, reserved: int = 0) -> List[Extent]:
+        """ Allocates n blocks, of which reserved were set aside by reserve(). Uses up all of that reservation """
+        with self._lock:
+            if n - reserved > self.num_available:
+                raise OSError(ENOSPC, 'No space left for {} blocks in {}'.format(n, self.__class__))
+            extents = super().allocate_many(n, contiguous, write_through, goal)
+            self._reserved -= reserved
+            return extents
 
     @property
     def address(self) -> int:
-        byte_address = len(bytes(SuperBlock())) + \
-                       len(bytes(Inode()) * NUM_INODES) + \
-                       len(bytes(InodeFreeList()))
-        block_address = int(byte_address/BLOCK_SIZE)
-        return block_address
+        return self._layout.data_block_freelist_start
+
+    def deallocate(self, index: int, write_through: bool = True) -> None:
+        super().deallocate(index, write_through)
+        self._revoke([Extent(index, 1)])
+
+    def deallocate_many(self, extents: List[Extent], write_through: bool = True) -> None:
+        super().deallocate_many(extents, write_through)
+        self._revoke(extents)
+
+    def _revoke(self, extents: List[Extent]) -> None:
+        journal = self._device.journal if self._device is not None else None
+        if journal is not None:
+            journal.revoke(self._layout.data_start, extents)
 
 
 class AllocableBLock(Block):
+    __slots__ = ('index',)
+
     def __init__(self, device=None, index=None):
         super().__init__(device=device)
         self.index = index
@@ -226,6 +731,13 @@ class AllocableBLock(Block):
     def freelist(self) -> FreeList:
         return FreeList(self._device)
 
+    @classmethod
+    def from_allocated(cls, device, index: int) -> 'AllocableBLock':
+        """ Creates the object for an index already allocated in its freelist, without reading it from disk """
+        block = cls(index=index)
+        block._device = device
+        return block
+
     def allocate(self) -> None:
         if self.index is None:
             self.index = self.freelist.allocate()
@@ -241,16 +753,39 @@ class AllocableBLock(Block):
 
 
 class Inode(AllocableBLock):
-    """ Base class for files and directories  """
+    """
+    Base class for files and directories.
+    Data blocks are mapped either by block pointers or, when INODE_FLAG_EXTENTS is set, by extents (one
+    (start, length) pair per run of consecutive blocks). Unused extents have length 0.
+    Block pointers are address_direct, then address_indirect (IndirectBlocks of pointers), then
+    address_double_indirect (IndirectBlocks of pointers to IndirectBlocks). 0 means unassigned.
+    Files may be sparse: unassigned blocks before the end of the file, and extents starting at data block 0 (which
+    makefs reserves, so it is never mapped), are holes that read as zeros. The last mapped block is never a hole.
+    When INODE_FLAG_INLINE is set the Inode maps no blocks: the bytes of the block map fields hold the data instead,
+    up to max_inline bytes.
+    size is the length of the data in bytes.
+    Inodes are read from and written to the InodeTable of the device.
+    Threads sharing an Inode hold its lock: system.File and system.Directory take it in every operation.
+    """
+    __slots__ = ('i_type', 'address_direct', 'flags', 'extents', 'address_indirect', 'address_double_indirect',
+                 'size', '_inline', '_indirect_blocks', '_dirty_indirect', '_cache', '_lock')
+    _struct = struct.Struct('l{}ll{}l{}l{}ll'.format(INODE_NUM_DIRECT_BLOCKS, 2 * INODE_NUM_EXTENTS,
+                                                     INODE_NUM_1_INDIRECT_BLOCKS, INODE_NUM_2_INDIRECT_BLOCKS))
 
     def __init__(self, i_type=0, device=None, index=None):
         super().__init__(device=device, index=index)
-        self._index0_block_address = 1
-
         self.i_type = i_type
         self.address_direct = [0] * INODE_NUM_DIRECT_BLOCKS
-
-        self._format = 'l{}l'.format(len(self.address_direct))
+        self.flags = 0
+        self.extents = [Extent(0, 0)] * INODE_NUM_EXTENTS
+        self.address_indirect = [0] * INODE_NUM_1_INDIRECT_BLOCKS
+        self.address_double_indirect = [0] * INODE_NUM_2_INDIRECT_BLOCKS
+        self.size = 0
+        self._inline = None  # type: bytes # data of an inline Inode
+        self._indirect_blocks = None  # type: dict # IndirectBlocks read so far, by index. Created on first use
+        self._dirty_indirect = None  # type: set # indices of IndirectBlocks changed since the last write
+        self._cache = None  # system.InodeCache holding this Inode. Writes of cached Inodes are deferred to it
+        self._lock = None  # type: RWLock # from the InodeLocks of the device, on first use
 
         if device is not None and index is not None:
             self.__read__()
@@ -260,151 +795,690 @@ class Inode(AllocableBLock):
 
     @property
     def freelist(self) -> FreeList:
-        return InodeFreeList(device=self._device)
+        return InodeFreeList.for_device(self._device)
 
     @property
     def _items(self):
-        return [self.i_type, *self.address_direct]
+        if self.is_inline:
+            fields = self._map_struct.unpack(self._inline.ljust(self.max_inline, b'\x00'))
+            direct = len(self.address_direct)
+            return [self.i_type, *fields[:direct], self.flags, *fields[direct:], self.size]
+        return [self.i_type, *self.address_direct, self.flags, *[i for extent in self.extents for i in extent],
+                *self.address_indirect, *self.address_double_indirect, self.size]
 
     @_items.setter
     def _items(self, value):
+        flags = 1 + INODE_NUM_DIRECT_BLOCKS
+        indirect = flags + 1 + 2 * INODE_NUM_EXTENTS
+        double_indirect = indirect + INODE_NUM_1_INDIRECT_BLOCKS
         self.i_type = value[0]
-        self.address_direct = value[1:1 + len(self.address_direct)]
+        self.address_direct = list(value[1:flags])
+        self.flags = value[flags]
+        self.extents = list(map(Extent, value[flags + 1:indirect:2], value[flags + 2:indirect:2]))
+        self.address_indirect = list(value[indirect:double_indirect])
+        self.address_double_indirect = list(value[double_indirect:-1])
+        self.size = value[-1]
+        self._inline = None
+        self._indirect_blocks = None
+        self._dirty_indirect = None
+        if self.is_inline:
+            self._inline = self._map_struct.pack(*value[1:flags], *value[flags + 1:-1])[:self.size]
+            self.address_direct = [0] * len(self.address_direct)
+            self.extents = [Extent(0, 0)] * len(self.extents)
+            self.address_indirect = [0] * len(self.address_indirect)
+            self.address_double_indirect = [0] * len(self.address_double_indirect)
+
+    @property
+    def _map_struct(self) -> struct.Struct:
+        """ Struct of the block map fields, whose bytes hold the data of inline Inodes """
+        return self._map_struct_for(len(self.address_direct) + 2 * len(self.extents) + len(self.address_indirect) +
+                                    len(self.address_double_indirect))
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _map_struct_for(n: int) -> struct.Struct:
+        return struct.Struct('{}l'.format(n))
+
+    @property
+    def max_inline(self) -> int:
+        """ Most bytes of data an inline Inode holds """
+        return self._map_struct.size
+
+    @property
+    def is_inline(self) -> bool:
+        return bool(self.flags & INODE_FLAG_INLINE)
+
+    def __read__(self):
+        self._items = InodeTable.for_device(self._device).read(self.index)
+
+    @property
+    def lock(self) -> 'RWLock':
+        """ RWLock of the Inode, shared with every other object of the same index on the device """
+        if self._lock is None:
+            self._lock = InodeLocks.for_device(self._device).get(self.index)
+        return self._lock
+
+    def __write__(self) -> None:
+        """ Writes the Inode, or only marks it dirty if it is held by an InodeCache """
+        if self._cache is not None:
+            self._cache.mark_dirty(self)
+            return
+        self.flush()
+
+    @property
+    def delayed(self) -> int:
+        """ Bytes of data waiting to be given blocks. Only system.File delays allocation """
+        return 0
+
+    def flush(self) -> None:
+        """ Writes changed IndirectBlocks before the Inode that points to them """
+        if self._dirty_indirect:
+            for index in sorted(self._dirty_indirect):
+                self._indirect_blocks[index].__write__()
+        self._dirty_indirect = None
+        InodeTable.for_device(self._device).write(self.index, self._items)
 
     @property
     def address(self) -> int:
-        index_0_byte_address = len(bytes(SuperBlock()))
-        index_0_block_address = int(index_0_byte_address/BLOCK_SIZE)
-        return index_0_block_address + self.index
-
-    def _last_assigned_address(self) -> int:
-        index_last_assigned = 0
-        for address in self.address_direct:
-            if address != 0:
-                index_last_assigned = address
-        return index_last_assigned
-
-    def _add_to_address_list(self, block, write_through=True) -> None:
-        # Find the first spot to add the block index to
-        for i in range(len(self.address_direct)):
-            if self.address_direct[i] == 0:
-                self.address_direct[i] = block.index
-                if write_through:
-                    self.__write__()
-                break
+        layout = self._layout
+        return layout.inode_start + self.index // layout.inodes_per_block * layout.inode_blocks
+
+    @property
+    def is_extent_mode(self) -> bool:
+        return bool(self.flags & INODE_FLAG_EXTENTS)
+
+    @property
+    def _used_extents(self) -> List[Extent]:
+        return [extent for extent in self.extents if extent.length != 0]
+
+    def _max_blocks(self) -> int:
+        """ Number of blocks that can be mapped with block pointers """
+        p = IndirectBlock.num_pointers(self._block_size)
+        return len(self.address_direct) + len(self.address_indirect) * p + len(self.address_double_indirect) * p * p
+
+    def _has_blocks(self) -> bool:
+        """ True if any data block is mapped by this Inode """
+        if self.is_extent_mode:
+            return len(self._used_extents) != 0
+        # IndirectBlocks are only allocated to map data blocks, and freed with them
+        return any(self.address_direct) or any(self.address_indirect) or any(self.address_double_indirect)
+
+    def _block_indices(self) -> List[int]:
+        """ Data block indices in file order up to the last mapped block, 0 for holes """
+        if self.is_extent_mode:
+            return [extent.start + i if extent.start else 0
+                    for extent in self._used_extents for i in range(extent.length)]
+        p = IndirectBlock.num_pointers(self._block_size)
+        mapped = [(logical, index) for logical, index in enumerate(self.address_direct) if index]
+        logical = len(self.address_direct)
+        for pointer in self.address_indirect:
+            if pointer:
+                mapped += [(logical + i, index) for i, index in enumerate(self._indirect(pointer).pointers) if index]
+            logical += p
+        for pointer in self.address_double_indirect:
+            for j, pointer_ in enumerate(self._indirect(pointer).pointers if pointer else []):
+                if pointer_:
+                    mapped += [(logical + j * p + i, index)
+                               for i, index in enumerate(self._indirect(pointer_).pointers) if index]
+            logical += p * p
+        indices = [0] * (mapped[-1][0] + 1 if mapped else 0)
+        for logical, index in mapped:
+            indices[logical] = index
+        return indices
+
+    def _indirect_indices(self) -> List[int]:
+        """ Indices of the IndirectBlocks of the Inode """
+        if self.is_extent_mode:
+            return []
+        indices = [index for index in self.address_indirect if index]
+        for pointer in self.address_double_indirect:
+            if pointer:
+                indices.append(pointer)
+                indices += [index for index in self._indirect(pointer).pointers if index]
+        return indices
+
+    def _indirect(self, index: int) -> 'IndirectBlock':
+        """ Returns the IndirectBlock at index, reading it from disk only the first time """
+        if self._indirect_blocks is None:
+            self._indirect_blocks = {}
+        block = self._indirect_blocks.get(index)
+        if block is None:
+            block = IndirectBlock(device=self._device, index=index)
+            self._indirect_blocks[index] = block
+        return block
+
+    def _new_indirect(self) -> 'IndirectBlock':
+        block = IndirectBlock(device=self._device)
+        if self._indirect_blocks is None:
+            self._indirect_blocks = {}
+        self._indirect_blocks[block.index] = block
+        self._mark_indirect_dirty(block)
+        return block
+
+    def _mark_indirect_dirty(self, block: 'IndirectBlock') -> None:
+        if self._dirty_indirect is None:
+            self._dirty_indirect = set()
+        self._dirty_indirect.add(block.index)
+
+    def _block_address(self, logical: int) -> int:
+        """ Data block index of the logical block number of the file. 0 if not mapped """
+        if self.is_extent_mode:
+            for extent in self._used_extents:
+                if logical < extent.length:
+                    return extent.start + logical if extent.start else 0
+                logical -= extent.length
+            return 0
+
+        if logical < len(self.address_direct):
+            return self.address_direct[logical]
+        logical -= len(self.address_direct)
+
+        p = IndirectBlock.num_pointers(self._block_size)
+        if logical < len(self.address_indirect) * p:
+            pointer = self.address_indirect[logical // p]
+            return self._indirect(pointer).pointers[logical % p] if pointer else 0
+        logical -= len(self.address_indirect) * p
+
+        if logical < len(self.address_double_indirect) * p * p:
+            pointer = self.address_double_indirect[logical // (p * p)]
+            if not pointer:
+                return 0
+            pointer = self._indirect(pointer).pointers[logical % (p * p) // p]
+            return self._indirect(pointer).pointers[logical % p] if pointer else 0
+        return 0
+
+    def _block_addresses(self, first: int, count: int) -> List[int]:
+        """ Data block indices of count logical blocks from first, 0 where not mapped, with one pass over the map """
+        addresses = []  # type: List[int]
+        end = first + count
+        if self.is_extent_mode:
+            logical = 0
+            for extent in self._used_extents:
+                start, stop = max(first, logical), min(end, logical + extent.length)
+                if start < stop:
+                    addresses += range(extent.start + start - logical, extent.start + stop - logical) \
+                        if extent.start else [0] * (stop - start)
+                logical += extent.length
+            return addresses + [0] * (count - len(addresses))
+        logical = first
+        while logical < end:
+            pointers, base = self._pointers(logical)
+            stop = min(end, base + len(pointers))
+            addresses += pointers[logical - base:stop - base]
+            logical = stop
+        return addresses
+
+    def _pointers(self, logical: int):
+        """ Returns the block pointers that map logical, as a list, and the logical block of the first one """
+        if logical < len(self.address_direct):
+            return self.address_direct, 0
+        base = len(self.address_direct)
+        p = IndirectBlock.num_pointers(self._block_size)
+        if logical - base < len(self.address_indirect) * p:
+            i = (logical - base) // p
+            pointer = self.address_indirect[i]
+            return self._indirect(pointer).pointers if pointer else [0] * p, base + i * p
+        base += len(self.address_indirect) * p
+        if logical - base < len(self.address_double_indirect) * p * p:
+            i, j = divmod((logical - base) // p, p)
+            pointer = self.address_double_indirect[i]
+            pointer = self._indirect(pointer).pointers[j] if pointer else 0
+            return self._indirect(pointer).pointers if pointer else [0] * p, base + (i * p + j) * p
+        return [0] * p, logical  # past the largest file
+
+    def _set_block_address(self, logical: int, index: int, write_through=True) -> None:
+        """ Maps the logical block number of the file to a data block index, allocating IndirectBlocks as needed """
+        if logical < len(self.address_direct):
+            self.address_direct[logical] = index
+            if write_through:
+                self.__write__()
+            return
+        logical -= len(self.address_direct)
+
+        p = IndirectBlock.num_pointers(self._block_size)
+        if logical < len(self.address_indirect) * p:
+            pointers, i = self.address_indirect, logical // p
         else:
+            logical -= len(self.address_indirect) * p
+            if logical >= len(self.address_double_indirect) * p * p:
+                raise Exception('File full')
+            pointers, i = self.address_double_indirect, logical // (p * p)
+        if not pointers[i]:
+            pointers[i] = self._new_indirect().index
+        block = self._indirect(pointers[i])
+
+        if pointers is self.address_double_indirect:
+            i = logical % (p * p) // p
+            if not block.pointers[i]:
+                block.pointers[i] = self._new_indirect().index
+                self._mark_indirect_dirty(block)
+            block = self._indirect(block.pointers[i])
+
+        block.pointers[logical % p] = index
+        self._mark_indirect_dirty(block)
+        if write_through:
+            self.__write__()
+
+    def _convert_to_block_mode(self) -> None:
+        """ Moves the data blocks mapped by extents to block pointers """
+        indices = self._block_indices()
+        if len(indices) > self._max_blocks():
             raise Exception('File full')
+        self.flags &= ~INODE_FLAG_EXTENTS
+        self.extents = [Extent(0, 0)] * len(self.extents)
+        for logical, index in enumerate(indices):
+            if index:
+                self._set_block_address(logical, index, write_through=False)
+
+    def _truncate_blocks(self, num_blocks: int) -> None:
+        """
+        Unmaps and frees the data blocks after the first num_blocks, and the IndirectBlocks that mapped them.
+        The blocks kept are mapped again from scratch, with extents if they fit.
+        """
+        indices = self._block_indices()
+        if num_blocks >= len(indices):
+            return
+        freelist = DataBlockFreeList.for_device(self._device)
+        freelist.deallocate_many(to_extents(sorted([index for index in indices[num_blocks:] if index] +
+                                                   self._indirect_indices())), write_through=False)
+        self.address_direct = [0] * len(self.address_direct)
+        self.address_indirect = [0] * len(self.address_indirect)
+        self.address_double_indirect = [0] * len(self.address_double_indirect)
+        self.extents = [Extent(0, 0)] * len(self.extents)
+        self._indirect_blocks = None
+        self._dirty_indirect = None
+        indices = indices[:num_blocks]
+        while indices and not indices[-1]:
+            indices.pop()  # holes at the end are not mapped
+        extents = to_extents(indices)
+        if len(extents) <= len(self.extents):
+            self.flags |= INODE_FLAG_EXTENTS
+            self._add_extents(extents, write_through=False)
+        else:
+            self.flags &= ~INODE_FLAG_EXTENTS
+            for logical, index in enumerate(indices):
+                if index:
+                    self._set_block_address(logical, index, write_through=False)
+        freelist.__write__()
+        self.__write__()
+
+    def free(self) -> None:
+        """ Frees the data blocks of the Inode and then the Inode itself, which is written cleared """
+        self._truncate_blocks(0)
+        self.i_type = 0
+        self.flags = 0
+        self.size = 0
+        self._inline = None
+        self.flush()
+        self.deallocate()
+
+    def _merge_extents(self, extents: List[Extent]) -> List[Extent]:
+        """ Returns the used extents with extents appended, each merged into the last extent if adjacent """
+        new_extents = self._used_extents
+        for extent in extents:
+            if new_extents and _follows(new_extents[-1], extent.start):
+                new_extents[-1] = Extent(new_extents[-1].start, new_extents[-1].length + extent.length)
+            else:
+                new_extents.append(extent)
+        return new_extents
+
+    def _add_extents(self, extents: List[Extent], write_through=True) -> None:
+        """ Appends extents to the extent list, merging each one into the last extent if they are adjacent """
+        new_extents = self._merge_extents(extents)
+        if len(new_extents) > len(self.extents):
+            raise Exception('File full')
+        self.extents = new_extents + [Extent(0, 0)] * (len(self.extents) - len(new_extents))
+        if write_through:
+            self.__write__()
+
+
+class RWLock(object):
+    """
+    Lock held by any number of readers or by one writer. The thread holding it for writing may take it again,
+    for reading or writing, so an operation can call others on the same Inode
+    """
+    __slots__ = ('_cond', '_readers', '_writer', '_depth', '__weakref__')
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None  # ident of the thread holding the lock for writing
+        self._depth = 0  # times the writer took the lock
+
+    @contextmanager
+    def reading(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._depth += 1
+            else:
+                while self._writer is not None:
+                    self._cond.wait()
+                self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                if self._writer == me:
+                    self._depth -= 1
+                else:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+
+class InodeLocks(object):
+    """ RWLocks of the Inodes of a device, by index. A lock exists while an Inode object or a thread holds it """
+    __slots__ = ('_locks', '_lock')
+
+    def __init__(self):
+        self._locks = weakref.WeakValueDictionary()  # type: weakref.WeakValueDictionary # index -> RWLock
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_device(cls, device) -> 'InodeLocks':
+        """ Returns the InodeLocks of the device, creating them on first use """
+        if device.inode_locks is None:
+            with device.lock:
+                if device.inode_locks is None:
+                    device.inode_locks = cls()
+        return device.inode_locks
+
+    def get(self, index: int) -> RWLock:
+        with self._lock:
+            lock = self._locks.get(index)
+            if lock is None:
+                lock = RWLock()
+                self._locks[index] = lock
+            return lock
+
+
+class InodeTable(object):
+    """
+    In-memory copy of the Inodes of a device, packed back to back with Inode._struct in one bytearray: inode_size
+    bytes per Inode, with no per Inode objects. The bytearray grows to the highest Inode read so far.
+    Each block of Inodes is read from the device the first time one of its Inodes is used. Writes go to the
+    table and through to the device, or its journal, holding the lock of the table so threads may share it.
+    """
+    __slots__ = ('_device', '_layout', '_records', '_loaded', '_lock')
+
+    def __init__(self, device):
+        self._device = device
+        self._layout = Layout.for_device(device)
+        self._records = bytearray()
+        self._loaded = bytearray(-(-self._layout.num_inodes // self._layout.inodes_per_block))  # 1 per loaded block
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_device(cls, device) -> 'InodeTable':
+        """ Returns the InodeTable of the device, creating it on first use """
+        if device.inode_table is None:
+            with device.lock:
+                if device.inode_table is None:
+                    device.inode_table = cls(device)
+        return device.inode_table
+
+    @property
+    def nbytes(self) -> int:
+        """ Bytes held by the table """
+        return len(self._records) + len(self._loaded)
+
+    def _group(self, index: int) -> int:
+        """ Loads the block of Inodes holding index if needed, and returns its number """
+        layout = self._layout
+        if not 0 <= index < layout.num_inodes:
+            raise Exception('{}: Inode {} out of range'.format(self.__class__, index))
+        group = index // layout.inodes_per_block
+        if not self._loaded[group]:
+            start = group * layout.inodes_per_block * layout.inode_size
+            end = min((group + 1) * layout.inodes_per_block, layout.num_inodes) * layout.inode_size
+            if len(self._records) < end:
+                self._records.extend(bytes(end - len(self._records)))
+            self._records[start:end] = \
+                self._device.pread(layout.inode_start + group * layout.inode_blocks, layout.inode_blocks)[:end - start]
+            self._loaded[group] = 1
+        return group
+
+    def read(self, index: int) -> tuple:
+        """ Returns the items of Inode index """
+        with self._lock:
+            self._group(index)
+            return Inode._struct.unpack_from(self._records, index * self._layout.inode_size)
+
+    def write(self, index: int, items: List) -> None:
+        """ Writes the items of Inode index to the table, and its block of Inodes to the device """
+        layout = self._layout
+        with self._lock:
+            group = self._group(index)
+            Inode._struct.pack_into(self._records, index * layout.inode_size, *items)
+            start = group * layout.inodes_per_block * layout.inode_size
+            block_pos = layout.inode_start + group * layout.inode_blocks
+            records = self._records[start:start + layout.inodes_per_block * layout.inode_size]
+            if self._device.journal is not None:
+                self._device.journal.write(block_pos, records)
+            else:
+                self._device.pwrite(block_pos, records)
 
 
 class DataBlock(AllocableBLock):
-    """ All data stored as utf-8 text characters """
+    """ Raw bytes of file data. The size of the file, not the block, says how many of them are in use """
+    __slots__ = ('data',)
+
     def __init__(self, device=None, index=None):
         super().__init__(device=device, index=index)
-        self.data = None
-        self._format = '{}s'.format(BLOCK_SIZE)
-        if device is not None and index is not None:
-            self.__read__()
+        self.data = b''  # type: bytes
+        if device is not None and index is not None and type(self) is DataBlock:
+            self.__read__()  # subclasses read once their own format is set
         if device is not None and index is None:
             self.allocate()
 
     @property
     def freelist(self) -> FreeList:  # List to check when allocating / deallocating
-        return DataBlockFreeList(device=self._device)
+        return DataBlockFreeList.for_device(self._device)
+
+    @property
+    def _struct(self) -> struct.Struct:
+        return self._struct_for(self._block_size)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _struct_for(block_size: int) -> struct.Struct:
+        return struct.Struct('{}s'.format(block_size))
 
     @property
     def _items(self):
-        return [self.str_to_bytes(self.data, pad_to=0)]
+        return [bytes(self.data)]
 
     @_items.setter
     def _items(self, value):
-        self.data = self.bytes_to_str(value[0], strip='\x00')
+        self.data = value[0]
 
     @property
     def address(self) -> int:
-        index_0_byte_address = len(bytes(SuperBlock())) + \
-                       len(bytes(Inode()) * NUM_INODES) + \
-                       len(bytes(InodeFreeList())) + \
-                       len(bytes(DataBlockFreeList()))  # + BLOCK_SIZE  # for the root directory
-        index_0_block_address = int(index_0_byte_address/BLOCK_SIZE)
-        return index_0_block_address + self.index
+        return self._layout.data_start + self.index
 
-    def is_full(self) -> bool:
-        self.__read__()
-        return len(self.data) == BLOCK_SIZE
-
-    def append(self, new_data: str, write_through=True) -> str:
-        """ Append data to self.data up to BLOCK_SIZE. Return remaining """
-        if self.data is None:
-            end = BLOCK_SIZE
-            self.data = new_data[:end]
-        else:
-            end = BLOCK_SIZE - len(self.data)
-            self.data += new_data[:end]
-        if write_through:
-            self.__write__()
-        return new_data[end:]
 
+class IndirectBlock(DataBlock):
+    """ Data block holding pointers to other data blocks. 0 means unassigned """
+    __slots__ = ('pointers',)
 
-class DirectoryBlock(DataBlock):
-    """ Data written to the block pointed to by the Directory Inode """
-    def __init__(self, device=None, index=None, name=''):
+    def __init__(self, device=None, index=None):
         super().__init__(device=device, index=index)
-        self.name = name
-        self.entry_names = [''] * NUM_FILES_PER_DIR_BLOCK
-        self.entry_inode_indices = [0] * NUM_FILES_PER_DIR_BLOCK
+        self.pointers = [0] * self.num_pointers(self._block_size)
 
-        self._format = '{}s'.format(MAX_FILENAME_LENGTH) + \
-                       ''.join(['{}s'.format(MAX_FILENAME_LENGTH)] * NUM_FILES_PER_DIR_BLOCK) + \
-                       '{}l'.format(NUM_FILES_PER_DIR_BLOCK)
+        if device is not None and index is not None:
+            self.__read__()
+
+    @staticmethod
+    def num_pointers(block_size: int = None) -> int:
+        return (BLOCK_SIZE if block_size is None else block_size) // struct.calcsize('l')
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _struct_for(block_size: int) -> struct.Struct:
+        return struct.Struct('{}l'.format(IndirectBlock.num_pointers(block_size)))
+
+    @property
+    def _items(self):
+        return self.pointers
+
+    @_items.setter
+    def _items(self, value):
+        self.pointers = list(value)
+
+
+class DirectoryHeader(DataBlock):
+    """
+    First block of a Directory: its name and the state of its linear hash table of DirectoryBlock buckets.
+    The table has 2 ** level + split buckets. Buckets below split have already been split at this level.
+    """
+    __slots__ = ('name', 'level', 'split', 'num_entries')
+    _struct = struct.Struct('{}slll'.format(MAX_FILENAME_LENGTH))
+
+    def __init__(self, device=None, index=None):
+        super().__init__(device=device, index=index)
+        self.name = ''
+        self.level = 0
+        self.split = 0  # next bucket to split
+        self.num_entries = 0
 
         if device is not None and index is not None:
             self.__read__()
 
+    @property
+    def num_buckets(self) -> int:
+        return (1 << self.level) + self.split
+
     @property
     def _items(self):
-        return [self.str_to_bytes(self.name, pad_to=0)] + \
-               [self.str_to_bytes(f, pad_to=0) for f in self.entry_names] + \
-               self.entry_inode_indices
+        return [self.str_to_bytes(self.name, pad_to=0), self.level, self.split, self.num_entries]
 
     @_items.setter
     def _items(self, value):
         self.name = self.bytes_to_str(value[0], strip='\x00')
-        self.entry_names = [self.bytes_to_str(v, strip='\x00') for v in value[1:1+NUM_FILES_PER_DIR_BLOCK]]
-        self.entry_inode_indices = value[1+NUM_FILES_PER_DIR_BLOCK:]
+        [self.level, self.split, self.num_entries] = value[1:]
+
+
+class DirectoryBlock(DataBlock):
+    """
+    Bucket of a Directory hash table: as many entries (name and inode index) as fit in a block, and the index of
+    the next DirectoryBlock of the bucket when it overflows. 0 means no overflow block. Unused entries have name ''.
+    Names are kept as the raw NUL padded bytes read from disk, and searched without decoding them.
+    """
+    __slots__ = ('overflow', '_names', 'entry_inode_indices')
+
+    def __init__(self, device=None, index=None):
+        super().__init__(device=device, index=index)
+        self.overflow = 0
+        num_entries = self.num_entries(self._block_size)
+        self._names = bytearray(MAX_FILENAME_LENGTH * num_entries)
+        self.entry_inode_indices = [0] * num_entries
+
+        if device is not None and index is not None:
+            self.__read__()
+
+    @staticmethod
+    def num_entries(block_size: int = None) -> int:
+        """ Number of entries that fit in a block """
+        block_size = BLOCK_SIZE if block_size is None else block_size
+        return (block_size - struct.calcsize('l')) // (struct.calcsize('l') + MAX_FILENAME_LENGTH)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def _struct_for(block_size: int) -> struct.Struct:
+        num_entries = DirectoryBlock.num_entries(block_size)
+        return struct.Struct('l{}l{}s'.format(num_entries, num_entries * MAX_FILENAME_LENGTH))
+
+    @property
+    def _items(self):
+        return [self.overflow, *self.entry_inode_indices, bytes(self._names)]
+
+    @_items.setter
+    def _items(self, value):
+        self.overflow = value[0]
+        self.entry_inode_indices = list(value[1:-1])
+        self._names = bytearray(value[-1])
+
+    @staticmethod
+    def _key(entry_name: str) -> bytes:
+        """ entry_name as stored on disk """
+        key = entry_name.encode()
+        if len(key) > MAX_FILENAME_LENGTH:
+            raise Exception('Given entry_name "{}" is too long (> {})'.format(entry_name, MAX_FILENAME_LENGTH))
+        return key + bytes(MAX_FILENAME_LENGTH - len(key))
+
+    def _slot(self, key: bytes) -> int:
+        """ Position of the entry stored as key, or -1 """
+        i = self._names.find(key)
+        while i != -1 and i % MAX_FILENAME_LENGTH:
+            i = self._names.find(key, i + 1)
+        return -1 if i == -1 else i // MAX_FILENAME_LENGTH
+
+    @property
+    def entry_names(self) -> List[str]:
+        return self.bytes_to_str_list(bytes(self._names), strip='\x00')
+
+    @entry_names.setter
+    def entry_names(self, value: List[str]) -> None:
+        self._names = bytearray(b''.join([self._key(name) for name in value]))
+
+    @property
+    def entries(self) -> List[tuple]:
+        """ (name, inode index) of every used entry """
+        return [(name, inode) for name, inode in zip(self.entry_names, self.entry_inode_indices) if name != '']
+
+    @entries.setter
+    def entries(self, value: List[tuple]) -> None:
+        num_entries = len(self.entry_inode_indices)
+        if len(value) > num_entries:
+            raise Exception('{} {}: {} entries do not fit in {}'.format(self.__class__, self.index, len(value),
+                                                                      num_entries))
+        self.entry_names = [name for name, _ in value] + [''] * (num_entries - len(value))
+        self.entry_inode_indices = [inode for _, inode in value] + [0] * (num_entries - len(value))
 
     def is_full(self) -> bool:
-        self.__read__()
-        full = True
-        for e in self.entry_names:
-            if e == '':
-                full = False
-        return full
+        return self._slot(bytes(MAX_FILENAME_LENGTH)) == -1
+
+    def find(self, entry_name):
+        """ Returns the inode index of entry_name, or None """
+        i = self._slot(self._key(entry_name))
+        return None if i == -1 else self.entry_inode_indices[i]
 
     def add_entry(self, entry_name, entry_inode_index, write_through=True):
         """ Add entry to Dir Block, in the first available location """
-        if len(entry_name) > MAX_FILENAME_LENGTH:
-            raise Exception('Given entry_name "" is too long (> {})'.format(entry_name, MAX_FILENAME_LENGTH))
-
-        for i in range(NUM_FILES_PER_DIR_BLOCK):
-            if self.entry_names[i] == '' and self.entry_inode_indices[i] == 0:
-                self.entry_names[i] = entry_name
-                self.entry_inode_indices[i] = entry_inode_index
-                if write_through:
-                    self.__write__()
-                break
-        else:
-            raise Exception('{} {} ("{}") full'.format(self.__class__, self.index, self.name))
+        key = self._key(entry_name)
+        i = self._slot(bytes(MAX_FILENAME_LENGTH))
+        if i == -1:
+            raise Exception('{} {} full'.format(self.__class__, self.index))
+        self._names[i * MAX_FILENAME_LENGTH:(i + 1) * MAX_FILENAME_LENGTH] = key
+        self.entry_inode_indices[i] = entry_inode_index
+        if write_through:
+            self.__write__()
 
     def remove_entry(self, entry_name, entry_inode_index, write_through=True):
         """ Remove entry based on name and index """
-        for i in range(NUM_FILES_PER_DIR_BLOCK):
-            if self.entry_names[i] == entry_name and self.entry_inode_indices[i] == entry_inode_index:
-                self.entry_names[i] = ''
-                self.entry_inode_indices[i] = 0
-                if write_through:
-                    self.__write__()
-                break
-        else:
-            raise Exception('{} {} ("{}") does not contain entry "{}"'.
-                            format(self.__class__, self.index,
-                                   self.name, entry_name))
+        i = self._slot(self._key(entry_name))
+        if i == -1 or self.entry_inode_indices[i] != entry_inode_index:
+            raise Exception('{} {} does not contain entry "{}"'.format(self.__class__, self.index, entry_name))
+        self._names[i * MAX_FILENAME_LENGTH:(i + 1) * MAX_FILENAME_LENGTH] = bytes(MAX_FILENAME_LENGTH)
+        self.entry_inode_indices[i] = 0
+        if write_through:
+            self.__write__()
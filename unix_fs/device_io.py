@@ -5,15 +5,177 @@ Author: Angad Gill
 """
 
 import io
+import mmap
 import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
 
 from unix_fs.data_structures import BLOCK_SIZE
 
+DEFAULT_CACHE_SIZE = 64  # blocks
+MAX_IOVECS = 1024  # IOV_MAX on Linux: most buffers one preadv/pwritev call takes
+
+
+class BlockCache(object):
+    """
+    Write-back LRU cache of disk blocks, keyed by block position.
+    Dirty blocks are written to the disk when evicted or when flush() is called.
+    Blocks read ahead of use are read without holding the lock of the Disk: generation counts the writes of cached
+    blocks to the disk, so prefetch() can drop blocks whose disk copy may have changed while they were read.
+    """
+    def __init__(self, disk, capacity: int = DEFAULT_CACHE_SIZE):
+        if capacity < 1:
+            raise Exception('{} capacity must be at least 1'.format(self.__class__))
+        self.disk = disk
+        self.capacity = capacity
+        self._blocks = OrderedDict()  # type: OrderedDict # block_pos -> bytearray, least recently used first
+        self._dirty = set()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefetched = 0  # blocks inserted by prefetch()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __contains__(self, block_pos):
+        return block_pos in self._blocks
+
+    @property
+    def stats(self) -> dict:
+        """ Counters used to size the cache for a workload """
+        lookups = self.hits + self.misses
+        return {'capacity': self.capacity,
+                'size': len(self._blocks),
+                'dirty': len(self._dirty),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'prefetched': self.prefetched,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def get(self, block_pos: int) -> bytearray:
+        """ Returns the cached block, reading it from disk on a miss """
+        block = self._blocks.get(block_pos)
+        if block is not None:
+            self.hits += 1
+            self._blocks.move_to_end(block_pos)
+            return block
+        self.misses += 1
+        block_size = self.disk.block_size
+        block = bytearray(self.disk._read_raw(block_pos * block_size, block_size))
+        if len(block) < block_size:
+            block += bytes(block_size - len(block))  # past end of disk reads as zeros
+        self._insert(block_pos, block)
+        return block
+
+    def put(self, block_pos: int, data: bytes) -> None:
+        """ Replaces a whole block and marks it dirty """
+        block_size = self.disk.block_size
+        block = bytearray(data[:block_size])
+        if len(block) < block_size:
+            block += bytes(block_size - len(block))
+        if block_pos in self._blocks:
+            self._blocks[block_pos] = block
+            self._blocks.move_to_end(block_pos)
+        else:
+            self._insert(block_pos, block)
+        self._dirty.add(block_pos)
+
+    def overwrite(self, block_pos: int) -> bytearray:
+        """ Returns the cached block for the caller to overwrite whole, without reading it on a miss. Marks it dirty """
+        block = self._blocks.get(block_pos)
+        if block is None:
+            block = bytearray(self.disk.block_size)
+            self._insert(block_pos, block)
+        else:
+            self._blocks.move_to_end(block_pos)
+        self._dirty.add(block_pos)
+        return block
+
+    def readv(self, block_positions: List[int], buffers: List) -> None:
+        """ Copies the blocks into buffers, reading all missing blocks from disk with one Disk._readv_raw """
+        missing = {block_pos: bytearray(self.disk.block_size) for block_pos in sorted(set(block_positions))
+                   if block_pos not in self._blocks}
+        self.disk._readv_raw(list(missing.items()))
+        for block_pos, buffer in zip(block_positions, buffers):
+            block = missing.get(block_pos)
+            if block is None:
+                block = self.get(block_pos)
+            buffer[:] = block
+        self.misses += len(missing)
+        for block_pos, block in missing.items():
+            self._insert(block_pos, block)
+
+    def prefetch(self, blocks: List[Tuple[int, bytearray]], generation: int) -> None:
+        """
+        Inserts (block position, block) pairs read from disk ahead of use, unless a cached block was written to
+        disk since generation. Blocks cached in the meantime are newer and are kept
+        """
+        if generation != self.generation:
+            return
+        for block_pos, block in blocks:
+            if block_pos not in self._blocks:
+                self._insert(block_pos, block)
+                self.prefetched += 1
+
+    def mark_dirty(self, block_pos: int) -> None:
+        """ Marks a block returned by get() as modified in place """
+        self._dirty.add(block_pos)
+
+    def flush(self) -> None:
+        """ Writes all dirty blocks to disk in block order, with one write per run of adjacent blocks """
+        if self._dirty:
+            self.disk._writev_raw([(block_pos, self._blocks[block_pos]) for block_pos in sorted(self._dirty)])
+            self._dirty.clear()
+            self.generation += 1
+
+    def invalidate(self) -> None:
+        """ Flushes and then drops every cached block """
+        self.flush()
+        self._blocks.clear()
+
+    def _insert(self, block_pos: int, block: bytearray) -> None:
+        self._blocks[block_pos] = block
+        while len(self._blocks) > self.capacity:
+            self._evict()
+
+    def _evict(self) -> None:
+        block_pos, block = self._blocks.popitem(last=False)
+        if block_pos in self._dirty:
+            self.disk._write_raw(block_pos * self.disk.block_size, block)
+            self._dirty.discard(block_pos)
+            self.generation += 1
+        self.evictions += 1
+
 
 class Disk(object):
-    """ Base class for writing to a raw disk """
-    def __init__(self, root):
+    """
+    Base class for writing to a raw disk.
+    If cache_size is non-zero, all reads and writes go through a write-back BlockCache of that many blocks.
+    block_size is set from the SuperBlock at mount time. Until then it is BLOCK_SIZE.
+    pread, pwrite, readv, writev, unpack_from and pack_into take their position as an argument and may be called
+    from many threads. read, readinto and write share the position set by seek and are for one thread only.
+    If the device has a journal.Journal, pread and unpack_from return the journaled copy of a metadata block until
+    it is checkpointed. readv, readinto and read do not: they read File data, which is never journaled.
+    """
+    def __init__(self, root, cache_size: int = 0, block_size: int = None):
         self.root = root
+        self._block_size = block_size
+        self._pos = 0  # byte position of the next read or write
+        self.cache = BlockCache(self, cache_size) if cache_size else None
+        self.lock = threading.RLock()  # guards the BlockCache and the creation of the objects below
+        self.layout = None  # data_structures.Layout, set at mount time or on first use
+        self.freelists = {}  # live data_structures.FreeList objects by class name
+        self.inode_table = None  # data_structures.InodeTable, created by the first Inode read or write
+        self.inode_locks = None  # data_structures.InodeLocks, created on first use
+        self.dentries = None  # system.DentryCache, created by the first path lookup
+        self.inodes = None  # system.InodeCache, created on first use
+        self.readahead = None  # system.Readahead, created by the first File read
+        self.journal = None  # journal.Journal, set at mount time if the device has one
         self.open()
 
     def open(self):
@@ -27,18 +189,339 @@ class Disk(object):
         self._disk = io.open(self.root, 'rb+', buffering = 0)
 
     def close(self):
+        if self.readahead is not None:
+            self.readahead.close()
+        if not self._disk.closed:
+            self.sync()
+            if self.journal is not None:
+                self.journal.checkpoint()
         self._disk.close()
 
+    def sync(self):
+        """
+        Writes all dirty cached Inodes and then all dirty cached blocks to disk. With a journal, the metadata
+        changes are committed to it first, which also makes them durable
+        """
+        if self.inodes is not None:
+            self.inodes.flush()
+        if self.journal is not None:
+            self.journal.commit()
+        self.write_back()
+
+    def write_back(self):
+        """ Writes all dirty cached blocks to disk, without waiting for them to be durable """
+        if self.cache is not None:
+            with self.lock:
+                self.cache.flush()
+
+    def fsync(self):
+        """ Writes all dirty cached blocks and waits until everything written is on disk """
+        self.write_back()
+        os.fsync(self._disk.fileno())
+
+    @property
+    def block_size(self) -> int:
+        return self._block_size or BLOCK_SIZE
+
+    def num_blocks(self, size: int) -> int:
+        """ Number of blocks needed to hold size bytes """
+        return -(-size // self.block_size)
+
     def read(self, n_blocks = 1):
         """ Read n blocks """
-        return self._disk.read(n_blocks * BLOCK_SIZE)
+        data = self._pread(self._pos, n_blocks * self.block_size)
+        self._pos += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        """ Read len(buffer) bytes into the writable buffer. Returns int n: number of bytes read """
+        view = memoryview(buffer).cast('B')
+        if self.cache is None:
+            n = self._readinto_raw(self._pos, view)
+        else:
+            with self.lock:
+                n = self._readinto_cached(self._pos, view)
+        self._pos += n
+        return n
 
     def write(self, b):
         """ Write bytearray b. Returns int n: number of bytes written """
-        n = self._disk.write(b)
+        n = self._pwrite(self._pos, b)
+        self._pos += n
         return n  # number of bytes actually written
 
+    def pread(self, block_pos: int, n_blocks: int = 1) -> bytes:
+        """ Read n blocks from block position block_pos, without moving the position of read and write """
+        return self._pread(block_pos * self.block_size, n_blocks * self.block_size)
+
+    def pwrite(self, block_pos: int, b) -> int:
+        """ Write bytearray b at block position block_pos, without moving the position of read and write """
+        return self._pwrite(block_pos * self.block_size, b)
+
+    def prefetch(self, block_pos: int, n_blocks: int) -> None:
+        """
+        Reads n blocks from block_pos ahead of use: into the cache with one call, or without a cache, by asking
+        the OS to read them into its page cache. Thread-safe: the disk is read without holding the lock
+        """
+        if self.cache is None:
+            self._advise(block_pos * self.block_size, n_blocks * self.block_size)
+            return
+        with self.lock:
+            missing = [(pos, bytearray(self.block_size)) for pos in range(block_pos, block_pos + n_blocks)
+                       if pos not in self.cache]
+            generation = self.cache.generation
+        if missing:
+            self._readv_raw(missing)
+            with self.lock:
+                self.cache.prefetch(missing, generation)
+
     def seek(self, block_pos):
         """ Seek to integer block position. Does not return anything."""
-        self._disk.seek(block_pos * BLOCK_SIZE)
+        self._pos = block_pos * self.block_size
+
+    def readv(self, block_positions: List[int], buffers: List = None) -> List:
+        """
+        Read the blocks at block_positions, in one call per run of adjacent blocks. Returns a buffer per block.
+        buffers, if given, are writable buffers of block_size bytes to read the blocks into.
+        """
+        if buffers is None:
+            buffers = [bytearray(self.block_size) for _ in block_positions]
+        if self.cache is None:
+            self._readv_raw(list(zip(block_positions, buffers)))
+        else:
+            with self.lock:
+                self.cache.readv(block_positions, buffers)
+        return buffers
+
+    def writev(self, blocks: Dict[int, bytes]) -> int:
+        """ Write blocks {block position: data}, in one call per run of adjacent blocks. Returns int n: bytes written """
+        if self.cache is None:
+            return self._writev_raw(sorted(blocks.items()))
+        with self.lock:
+            return sum(self._write_cached(block_pos * self.block_size, b) for block_pos, b in blocks.items())
+
+    def unpack_from(self, st: struct.Struct, block_pos: int) -> tuple:
+        """ Unpacks st from the start of the block at block_pos, in place in the cached block if there is a cache """
+        if self.journal is not None:
+            block = self.journal.get(block_pos)
+            if block is not None:
+                return st.unpack_from(block)
+        if self.cache is not None:
+            with self.lock:
+                return st.unpack_from(self.cache.get(block_pos))
+        buffer = bytearray(st.size)
+        self._readinto_raw(block_pos * self.block_size, memoryview(buffer))  # past end of disk reads as zeros
+        return st.unpack_from(buffer)
+
+    def pack_into(self, st: struct.Struct, block_pos: int, *items) -> None:
+        """ Packs items with st into the block at block_pos, zero padded. In place in the cached block if there is one """
+        block_size = self.block_size
+        if self.cache is None:
+            block = bytearray(block_size)
+            st.pack_into(block, 0, *items)
+            self._write_raw(block_pos * block_size, block)
+            return
+        with self.lock:
+            block = self.cache.overwrite(block_pos)
+            st.pack_into(block, 0, *items)
+            block[st.size:] = bytes(block_size - st.size)
+
+    def write_uncached(self, blocks: List[Tuple[int, bytes]]) -> int:
+        """ Write (block position, data) pairs sorted by position straight to the disk, bypassing the cache """
+        return self._writev_raw(blocks)
+
+    def _iovec_runs(self, blocks: List[Tuple[int, bytes]]):
+        """
+        Groups (block position, buffer) pairs sorted by position into runs of adjacent blocks.
+        Yields (byte offset, buffers) for each run. A buffer shorter than block_size ends its run.
+        """
+        block_size = self.block_size
+        run_start, run = 0, []  # type: Tuple[int, List]
+        for block_pos, buffer in blocks:
+            if run and (block_pos != run_start + len(run) or len(run[-1]) != block_size or len(run) == MAX_IOVECS):
+                yield run_start * block_size, run
+                run = []
+            if not run:
+                run_start = block_pos
+            run.append(buffer)
+        if run:
+            yield run_start * block_size, run
+
+    def _readv_raw(self, blocks: List[Tuple[int, bytes]]) -> int:
+        return sum(self._preadv(offset, buffers) for offset, buffers in self._iovec_runs(blocks))
+
+    def _writev_raw(self, blocks: List[Tuple[int, bytes]]) -> int:
+        return sum(self._pwritev(offset, buffers) for offset, buffers in self._iovec_runs(blocks))
+
+    def _preadv(self, offset: int, buffers: List) -> int:
+        return os.preadv(self._disk.fileno(), buffers, offset)
+
+    def _pwritev(self, offset: int, buffers: List) -> int:
+        return os.pwritev(self._disk.fileno(), buffers, offset)
+
+    def _pread(self, offset: int, size: int) -> bytes:
+        if self.cache is None:
+            data = self._read_raw(offset, size)
+        else:
+            with self.lock:
+                data = self._read_cached(offset, size)
+        if self.journal is not None:
+            data = self.journal.overlay(offset, data)
+        return data
+
+    def _pwrite(self, offset: int, b) -> int:
+        if self.cache is None:
+            return self._write_raw(offset, b)
+        with self.lock:
+            return self._write_cached(offset, b)
+
+    def _read_raw(self, offset: int, size: int) -> bytes:
+        return os.pread(self._disk.fileno(), size, offset)
+
+    def _advise(self, offset: int, size: int) -> None:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(self._disk.fileno(), offset, size, os.POSIX_FADV_WILLNEED)
+
+    def _readinto_raw(self, offset: int, view: memoryview) -> int:
+        return os.preadv(self._disk.fileno(), [view], offset)
+
+    def _write_raw(self, offset: int, b) -> int:
+        return os.pwrite(self._disk.fileno(), b, offset)
+
+    def _read_cached(self, offset: int, size: int) -> bytes:
+        block_size = self.block_size
+        data = bytearray()
+        end = offset + size
+        while offset < end:
+            block_pos, start = divmod(offset, block_size)
+            stop = min(block_size, start + end - offset)
+            data += self.cache.get(block_pos)[start:stop]
+            offset += stop - start
+        return bytes(data)
+
+    def _readinto_cached(self, offset: int, view: memoryview) -> int:
+        block_size = self.block_size
+        read = 0
+        while read < len(view):
+            block_pos, start = divmod(offset + read, block_size)
+            stop = min(block_size, start + len(view) - read)
+            view[read:read + stop - start] = self.cache.get(block_pos)[start:stop]
+            read += stop - start
+        return read
+
+    def _write_cached(self, offset: int, b) -> int:
+        block_size = self.block_size
+        view = memoryview(b)
+        written = 0
+        while written < len(view):
+            block_pos, start = divmod(offset + written, block_size)
+            stop = min(block_size, start + len(view) - written)
+            chunk = view[written:written + stop - start]
+            if start == 0 and stop == block_size:
+                self.cache.put(block_pos, chunk)
+            else:
+                # Partial block: read-modify-write the cached copy
+                block = self.cache.get(block_pos)
+                block[start:stop] = chunk
+                self.cache.mark_dirty(block_pos)
+            written += stop - start
+        return written
+
+
+class MmapDisk(Disk):
+    """
+    Disk backed by a memory mapping of the whole file. Block reads and writes are slices of the mapping.
+    The mapping grows when a write goes past the end of the file.
+    """
+    def open(self):
+        super().open()
+        size = os.fstat(self._disk.fileno()).st_size
+        self._map = mmap.mmap(self._disk.fileno(), size) if size else None  # cannot map an empty file
+
+    def close(self):
+        if self.readahead is not None:
+            self.readahead.close()
+        if not self._disk.closed:
+            self.sync()
+            if self.journal is not None:
+                self.journal.checkpoint()
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+        self._disk.close()
+
+    def sync(self):
+        """ Writes all dirty cached blocks to the mapping and the mapping to disk """
+        super().sync()
+        if self._map is not None:
+            self._map.flush()
+
+    def fsync(self):
+        self.write_back()
+        if self._map is not None:
+            self._map.flush()
+        os.fsync(self._disk.fileno())
+
+    def _size(self) -> int:
+        return len(self._map) if self._map is not None else 0
+
+    def _grow(self, size: int) -> None:
+        with self.lock:
+            if size <= self._size():
+                return  # grown by another thread
+            if self._map is None:
+                self._disk.truncate(size)
+                self._map = mmap.mmap(self._disk.fileno(), size)
+            else:
+                self._map.resize(size)
+
+    def _read_raw(self, offset: int, size: int) -> bytes:
+        return self._map[offset:offset + size] if self._map is not None else b''
+
+    def _advise(self, offset: int, size: int) -> None:
+        start = offset - offset % mmap.PAGESIZE  # madvise takes whole pages
+        stop = min(offset + size, self._size())
+        if stop > start and hasattr(mmap, 'MADV_WILLNEED'):
+            self._map.madvise(mmap.MADV_WILLNEED, start, stop - start)
+
+    def _readinto_raw(self, offset: int, view: memoryview) -> int:
+        if self._map is None:
+            return 0
+        n = max(0, min(len(view), self._size() - offset))
+        view[:n] = self._map[offset:offset + n]
+        return n
+
+    def _write_raw(self, offset: int, b) -> int:
+        view = memoryview(b)
+        if offset + len(view) > self._size():
+            self._grow(offset + len(view))
+        self._map[offset:offset + len(view)] = view
+        return len(view)
+
+    def unpack_from(self, st: struct.Struct, block_pos: int) -> tuple:
+        offset = block_pos * self.block_size
+        if self.cache is not None or self.journal is not None or offset + st.size > self._size():
+            return super().unpack_from(st, block_pos)
+        return st.unpack_from(self._map, offset)
+
+    def pack_into(self, st: struct.Struct, block_pos: int, *items) -> None:
+        block_size = self.block_size
+        offset = block_pos * block_size
+        if self.cache is not None:
+            return super().pack_into(st, block_pos, *items)
+        if offset + block_size > self._size():
+            self._grow(offset + block_size)
+        st.pack_into(self._map, offset, *items)
+        self._map[offset + st.size:offset + block_size] = bytes(block_size - st.size)
+
+    def _preadv(self, offset: int, buffers: List) -> int:
+        read = 0
+        for buffer in buffers:
+            read += self._readinto_raw(offset + read, memoryview(buffer).cast('B'))
+        return read
 
+    def _pwritev(self, offset: int, buffers: List) -> int:
+        written = 0
+        for buffer in buffers:
+            written += self._write_raw(offset + written, buffer)
+        return written
@@ -0,0 +1,358 @@
+"""
+Write-ahead journal of metadata blocks
+
+The journal is the last journal_blocks blocks of the device, after the data blocks. Its first block is a header:
+magic, number of journal blocks and sequence of the first transaction to replay. Transactions follow from block 1,
+each as descriptor blocks, each followed by the blocks it lists, and then a commit block.
+
+Author: Angad Gill
+"""
+import struct
+import threading
+import zlib
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Set, Tuple
+
+from unix_fs.data_structures import Extent
+
+DEFAULT_JOURNAL_BLOCKS = 1024
+COMMIT_FRACTION = 4  # a transaction is committed when it fills this fraction (1/4) of the journal
+HEADER_MAGIC = 0x4A524E4C
+DESCRIPTOR_MAGIC = 0x4A445343
+COMMIT_MAGIC = 0x4A434D54
+HEADER = struct.Struct('<IQQ')  # magic, number of journal blocks, sequence of the first transaction to replay
+DESCRIPTOR = struct.Struct('<IQI')  # magic, sequence, number of entries
+ENTRY = struct.Struct('<q')  # block position of a logged block, or -(block position + 1) of a revoked one
+COMMIT = struct.Struct('<IQII')  # magic, sequence, number of entries, crc32 of the descriptors and logged blocks
+MIN_BLOCK_SIZE = DESCRIPTOR.size + ENTRY.size
+
+
+def transaction(device):
+    """ A transaction of the Journal of device, or a context that does nothing if the device has none """
+    if device.journal is None:
+        return nullcontext()
+    return device.journal.transaction()
+
+
+class Journal(object):
+    """
+    Write-ahead log of the metadata blocks of a device.
+    Block.__write__ and InodeTable.write hand whole blocks to write() instead of writing them in place. Logged
+    blocks stay in memory, and Disk.pread and Disk.unpack_from read the logged copy, until a checkpoint writes
+    them to their place on the device.
+    transaction() groups the writes of one operation, and commit() waits for open transactions to end, so the
+    journal only ever holds whole operations. commit() writes every block logged since the last commit with one
+    fsync. Threads calling commit() while another thread commits wait for it and then share one commit: group
+    commit.
+    Freeing a data block revokes its logged copies, so recovery never writes stale metadata over data written
+    to the block later. File data is not journaled: cached data blocks are written back before the records of the
+    commit that points to them, and made durable by the same fsync.
+    """
+    def __init__(self, device, num_blocks: int, sequence: int = 1):
+        if device.block_size < MIN_BLOCK_SIZE:
+            raise Exception('{}: block size must be at least {}'.format(self.__class__, MIN_BLOCK_SIZE))
+        if num_blocks < 3:
+            raise Exception('{}: needs at least 3 blocks'.format(self.__class__))
+        self._device = device
+        self.start = device.layout.total_blocks
+        self.num_blocks = num_blocks
+        self.sequence = sequence  # of the running transaction
+        self._durable = sequence - 1  # last committed sequence
+        self._head = 1  # next free journal block
+        self._running = {}  # type: Dict[int, bytes] # block position -> block, logged since the last commit
+        self._revoked = set()  # type: Set[int] # block positions with committed copies, freed since the last commit
+        self._committing = {}  # type: Dict[int, bytes] # blocks of the commit in progress
+        self._committed = {}  # type: Dict[int, bytes] # committed blocks not yet written to their place
+        self._cond = threading.Condition(threading.Lock())
+        self._local = threading.local()  # depth of the open transactions of each thread
+        self._handles = 0  # threads with an open transaction
+        self._locked = False  # a commit is waiting for open transactions: new ones wait for it
+        self._in_commit = False
+        self.commits = 0
+        self.checkpoints = 0
+        self.blocks_written = 0  # journal blocks written by commits
+        self.recovered = 0  # transactions replayed by recover()
+
+    @classmethod
+    def format(cls, device, num_blocks: int) -> None:
+        """ Writes an empty journal of num_blocks blocks after the data blocks of device """
+        cls(device, num_blocks)._write_header(1)
+
+    @classmethod
+    def open(cls, device) -> 'Journal':
+        """
+        Returns the Journal of device after replaying its committed transactions, or None if the device has
+        no journal. Sets device.journal.
+        """
+        start = device.layout.total_blocks
+        if device.block_size < HEADER.size:
+            return None
+        magic, num_blocks, sequence = HEADER.unpack_from(device.pread(start).ljust(HEADER.size, b'\0'))
+        if magic != HEADER_MAGIC:
+            return None
+        journal = cls(device, num_blocks, sequence)
+        journal.recover()
+        device.journal = journal
+        return journal
+
+    @property
+    def stats(self) -> dict:
+        with self._cond:
+            return {'commits': self.commits,
+                    'checkpoints': self.checkpoints,
+                    'blocks_written': self.blocks_written,
+                    'running': len(self._running),
+                    'committed': len(self._committed)}
+
+    def write(self, block_pos: int, data) -> None:
+        """ Logs data, one or more blocks from block_pos, in the running transaction. The last block is zero padded """
+        block_size = self._device.block_size
+        view = memoryview(data).cast('B')
+        with self._cond:
+            for i in range(0, len(view), block_size):
+                block = bytes(view[i:i + block_size])
+                if len(block) < block_size:
+                    block += bytes(block_size - len(block))
+                self._running[block_pos + i // block_size] = block
+                self._revoked.discard(block_pos + i // block_size)
+
+    def get(self, block_pos: int):
+        """ The latest logged copy of the block at block_pos not yet written to its place, or None """
+        with self._cond:
+            block = self._running.get(block_pos)
+            if block is None:
+                block = self._committing.get(block_pos)
+                if block is None:
+                    block = self._committed.get(block_pos)
+            return block
+
+    def overlay(self, offset: int, data: bytes) -> bytes:
+        """ data read from the device at byte offset, with the logged copies of its blocks in place """
+        if not (self._running or self._committing or self._committed) or not data:
+            return data
+        block_size = self._device.block_size
+        patched = None
+        for block_pos in range(offset // block_size, (offset + len(data) - 1) // block_size + 1):
+            block = self.get(block_pos)
+            if block is None:
+                continue
+            if patched is None:
+                patched = bytearray(data)
+            start = max(offset, block_pos * block_size)
+            stop = min(offset + len(data), (block_pos + 1) * block_size)
+            patched[start - offset:stop - offset] = block[start - block_pos * block_size:stop - block_pos * block_size]
+        return data if patched is None else bytes(patched)
+
+    def revoke(self, data_start: int, extents: List[Extent]) -> None:
+        """ Drops the logged copies of the data blocks in extents, which were just freed """
+        with self._cond:
+            for block_pos in [block_pos for block_pos in {**self._running, **self._committing, **self._committed}
+                              if any(extent.start <= block_pos - data_start < extent.start + extent.length
+                                     for extent in extents)]:
+                self._running.pop(block_pos, None)
+                in_journal = self._committing.pop(block_pos, None) is not None
+                if self._committed.pop(block_pos, None) is not None or in_journal:
+                    self._revoked.add(block_pos)  # recovery must skip the copies in the journal
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups the writes of the with block into the running transaction. Nested transactions join the outer one.
+        A transaction that ends with the running transaction over its size limit commits it. New transactions wait
+        for the commit of a full running transaction, so it never outgrows the journal.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        committed = False
+        while not depth:
+            with self._cond:
+                while self._locked or (self._in_commit and self._full() and not committed):
+                    self._cond.wait()
+                if committed or not self._full():
+                    self._handles += 1
+                    break
+            self.commit()
+            committed = True
+        self._local.depth = depth + 1
+        try:
+            yield self
+        finally:
+            self._local.depth = depth
+            if not depth:
+                with self._cond:
+                    self._handles -= 1
+                    if not self._handles:
+                        self._cond.notify_all()
+                    full = self._full()
+                if full:
+                    self.commit()
+
+    def _full(self) -> bool:
+        """ True if the running transaction, with the dirty cached Inodes commit() adds to it, fills its share """
+        blocks = len(self._running)
+        if self._device.inodes is not None:
+            blocks += self._device.inodes.num_dirty * self._device.layout.inode_blocks
+        return blocks * COMMIT_FRACTION >= self.num_blocks
+
+    def commit(self) -> None:
+        """
+        Makes every change logged before the call durable. Waits for open transactions to end, then writes the
+        running transaction to the journal and fsyncs the device. Calls made during a commit wait for it, and the
+        next of them commits for all the others.
+        """
+        if getattr(self._local, 'depth', 0):
+            raise Exception('{}: commit inside a transaction'.format(self.__class__))
+        with self._cond:
+            target = self.sequence
+            while self._in_commit and self._durable < target:
+                self._cond.wait()
+            if self._durable >= target:
+                return  # committed by another thread
+            self._in_commit = True
+            self._locked = True
+            while self._handles:
+                self._cond.wait()
+        try:
+            if self._device.inodes is not None:
+                self._device.inodes.write_back()
+            with self._cond:
+                self._locked = False
+                self._cond.notify_all()
+                sequence = self.sequence
+                self.sequence += 1
+                self._committing, self._running = self._running, {}
+                revoked, self._revoked = self._revoked, set()
+                blocks = sorted(self._committing.items())
+            if blocks or revoked:
+                self._write(sequence, blocks, sorted(revoked))
+            with self._cond:
+                self._committed.update(self._committing)
+                self._committing = {}
+                self._durable = sequence
+        finally:
+            with self._cond:
+                self._locked = False
+                self._in_commit = False
+                self._cond.notify_all()
+
+    def checkpoint(self) -> None:
+        """ Commits, then writes every committed block to its place and empties the journal """
+        self.commit()
+        with self._cond:
+            while self._in_commit:
+                self._cond.wait()
+            self._in_commit = True
+        try:
+            self._checkpoint(self.sequence)
+            self._device.fsync()
+        finally:
+            with self._cond:
+                self._in_commit = False
+                self._cond.notify_all()
+
+    def recover(self) -> None:
+        """
+        Replays the committed transactions in the journal, skipping blocks revoked by the same or a later
+        transaction, and empties the journal. A transaction with a missing or bad commit block ends the replay
+        """
+        transactions = []  # type: List[Tuple[int, List[Tuple[int, bytes]], List[int]]]
+        sequence = self.sequence
+        pos = 1
+        while True:
+            entries, blocks, crc = [], [], 0  # type: List[int], List[Tuple[int, bytes]], int
+            committed = False
+            while pos < self.num_blocks:
+                block = self._device.pread(self.start + pos)
+                pos += 1
+                magic, block_sequence, count = DESCRIPTOR.unpack_from(block)
+                if block_sequence != sequence:
+                    break
+                if magic == DESCRIPTOR_MAGIC:
+                    crc = zlib.crc32(block, crc)
+                    for i in range(count):
+                        entry = ENTRY.unpack_from(block, DESCRIPTOR.size + i * ENTRY.size)[0]
+                        entries.append(entry)
+                        if entry >= 0 and pos < self.num_blocks:
+                            logged = self._device.pread(self.start + pos)
+                            pos += 1
+                            crc = zlib.crc32(logged, crc)
+                            blocks.append((entry, logged))
+                    continue
+                committed = magic == COMMIT_MAGIC and count == len(entries) and COMMIT.unpack_from(block)[3] == crc
+                break
+            if not committed:
+                break
+            transactions.append((sequence, blocks, [-entry - 1 for entry in entries if entry < 0]))
+            sequence += 1
+
+        revoked = {}  # type: Dict[int, int] # block position -> last sequence revoking it
+        for transaction_sequence, _, revokes in transactions:
+            for block_pos in revokes:
+                revoked[block_pos] = transaction_sequence
+        replay = {}  # type: Dict[int, bytes]
+        for transaction_sequence, blocks, _ in transactions:
+            for block_pos, block in blocks:
+                if revoked.get(block_pos, 0) < transaction_sequence:
+                    replay[block_pos] = block
+        if replay:
+            self._device.writev(replay)
+            self._device.fsync()
+        self.sequence = sequence
+        self._durable = sequence - 1
+        self._write_header(sequence)
+        self._device.fsync()
+        self.recovered = len(transactions)
+
+    def _write(self, sequence: int, blocks: List[Tuple[int, bytes]], revoked: List[int]) -> None:
+        """ Writes a transaction to the journal and fsyncs, first checkpointing if the journal is full """
+        block_size = self._device.block_size
+        per_descriptor = (block_size - DESCRIPTOR.size) // ENTRY.size
+        entries = [block_pos for block_pos, _ in blocks] + [-block_pos - 1 for block_pos in revoked]
+        images = dict(blocks)
+        records = []  # type: List[bytes]
+        crc = 0
+        for i in range(0, len(entries), per_descriptor):
+            chunk = entries[i:i + per_descriptor]
+            descriptor = bytearray(block_size)
+            DESCRIPTOR.pack_into(descriptor, 0, DESCRIPTOR_MAGIC, sequence, len(chunk))
+            for j, entry in enumerate(chunk):
+                ENTRY.pack_into(descriptor, DESCRIPTOR.size + j * ENTRY.size, entry)
+            records.append(descriptor)
+            records.extend(images[entry] for entry in chunk if entry >= 0)
+        for record in records:
+            crc = zlib.crc32(record, crc)
+        commit = bytearray(block_size)
+        COMMIT.pack_into(commit, 0, COMMIT_MAGIC, sequence, len(entries), crc)
+        records.append(commit)
+        if len(records) > self.num_blocks - 1:
+            raise Exception('{}: transaction of {} blocks does not fit in {} blocks'.format(
+                self.__class__, len(records), self.num_blocks - 1))
+        if self._head + len(records) > self.num_blocks:
+            self._checkpoint(sequence)
+        self._device.write_back()  # File data first: the cache would only write it at the fsync, after the records
+        self._device.write_uncached([(self.start + self._head + i, record) for i, record in enumerate(records)])
+        self._device.fsync()
+        self._head += len(records)
+        self.commits += 1
+        self.blocks_written += len(records)
+
+    def _checkpoint(self, sequence: int) -> None:
+        """ Writes the committed blocks to their place, then empties the journal. The next to replay is sequence """
+        with self._cond:
+            blocks = dict(self._committed)
+            # Written holding the lock: a block revoked after this point is not written over its new data
+            if blocks:
+                self._device.writev(blocks)
+        if blocks:
+            self._device.fsync()
+        self._write_header(sequence)  # made durable by the fsync of the next commit
+        with self._cond:
+            for block_pos, block in blocks.items():
+                if self._committed.get(block_pos) is block:
+                    del self._committed[block_pos]
+        self._head = 1
+        self.checkpoints += 1
+
+    def _write_header(self, sequence: int) -> None:
+        header = bytearray(self._device.block_size)
+        HEADER.pack_into(header, 0, HEADER_MAGIC, self.num_blocks, sequence)
+        self._device.write_uncached([(self.start, header)])
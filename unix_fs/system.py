@@ -3,119 +3,911 @@ File/Directory level abstractions go here
 
 Author: Angad Gill
 """
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Tuple
-from unix_fs.data_structures import Inode, DataBlock, DirectoryBlock
+from unix_fs.data_structures import Inode, DirectoryHeader, DirectoryBlock, DataBlockFreeList, Extent, \
+    INODE_FLAG_EXTENTS, INODE_FLAG_INLINE, MAX_FILENAME_LENGTH, ROOT_INODE, to_extents
+from unix_fs.journal import transaction
+
+DIRECTORY_MAX_LOAD = 0.75  # average fraction of bucket entries in use at which a Directory bucket is split
+DEFAULT_DENTRY_CACHE_SIZE = 16384  # entries
+DEFAULT_INODE_CACHE_SIZE = 4096  # Inodes
+MAX_DELAYED_BLOCKS = 1024  # blocks of File data buffered before they are allocated
+INLINE_DATA = True  # Files of up to Inode.max_inline bytes keep their data in the Inode
+READAHEAD_MIN_BLOCKS = 4  # first readahead window of a File
+READAHEAD_MAX_BLOCKS = 256  # largest readahead window, if the BlockCache holds twice as many blocks
+DEFAULT_READAHEAD_FILES = 1024  # Files whose reads are tracked
 
 class File(Inode):
+    """
+    File data is bytes. str data is encoded as utf-8 when written.
+    Reads and writes of whole blocks go straight between the caller's buffer and the device.
+    Allocation is delayed: data written past the allocated blocks is buffered in memory, and flush() allocates
+    blocks for all of it at once, contiguous if the freelist has a long enough run. Files held by an InodeCache
+    are flushed when the cache writes them back (Disk.sync, eviction) or when their last reference is released,
+    and once MAX_DELAYED_BLOCKS are buffered. Other Files are flushed by every write. Blocks for the buffered data
+    are reserved in the DataBlockFreeList as it is written, so a write that would not fit fails with ENOSPC.
+    Small Files are inline: with INLINE_DATA, data written to an empty File stays in its Inode, and reads of it need
+    no block reads, until the File grows past max_inline bytes and its data moves to data blocks.
+    """
+    __slots__ = ('_delayed', '_reserved')
+
     def __init__(self, device=None, index=None):
+        self._delayed = None  # type: bytearray # data past the allocated blocks, up to size
+        self._reserved = 0  # blocks reserved in the DataBlockFreeList for the delayed data
         super().__init__(i_type=1, device=device, index=index)
 
-    def write(self, data):
-        """ Write to the File. Allocate DataBlocks and write text to them """
-        # TODO: This is basically "append" right now. Update when "seek" is added
-        # Check to see if any DataBlock is already assigned
-        if sum(self.address_direct) != 0:
-            # If assigned, append data to last block
-            last_assigned = self._last_assigned_address()
-            block = DataBlock(device=self._device, index=last_assigned)
-            excess_data = block.append(data)
-        else:
-            excess_data = data
-
-        # Add all excess data into new blocks
-        while len(excess_data) > 0:
-            # assign a new block and add to Inode
-            block = DataBlock(device=self._device)
-            self._add_to_address_list(block)
-            # Write to block
-            excess_data = block.append(excess_data)
-
-    def read(self):
-        """ Reads and returns the first block, for now """
-        data = ''
-        for address in self.address_direct:
-            if address != 0:
-                block = DataBlock(device=self._device, index=address)
-                data += block.data
+    @staticmethod
+    def _as_bytes(data) -> memoryview:
+        if isinstance(data, str):
+            data = data.encode()
+        return memoryview(data).cast('B')
+
+    def write(self, data) -> int:
+        """ Append to the File. Allocate DataBlocks and write data to them """
+        with self.lock.writing():
+            return self.pwrite(self.size, data)
+
+    def _reserve(self, first: int, last: int, reserved: int = 0) -> List[int]:
+        """
+        Allocates and maps data blocks for the logical blocks first to last that are holes or past the mapped
+        blocks, in one freelist pass, and returns those logical blocks. Unmapped blocks before first stay holes.
+        The allocation uses up reserved blocks of the reservation of the File.
+        Only the map of the range is read, and appended blocks are merged into the last extent.
+        The blocks are allocated right after the previous block of the File if they are free, so the File keeps
+        growing in place
+        """
+        missing = [logical for logical, index in enumerate(self._block_addresses(first, last - first + 1), first)
+                   if not index]
+        if not missing:
+            return missing
+        if not self._has_blocks():
+            # Empty files map their data with extents
+            self.flags |= INODE_FLAG_EXTENTS
+
+        freelist = DataBlockFreeList.for_device(self._device)
+        previous = self._block_address(missing[0] - 1) if missing[0] else 0
+        extents = freelist.allocate_many(len(missing), write_through=False, goal=previous + 1 if previous else None,
+                                         reserved=reserved)
+        self._reserved -= reserved
+        new_indices = [index for extent in extents for index in range(extent.start, extent.start + extent.length)]
+        if self.is_extent_mode:
+            mapped = sum(extent.length for extent in self.extents)
+            if missing[0] >= mapped:
+                gap = [Extent(0, missing[0] - mapped)] if missing[0] > mapped else []
+                new_extents = self._merge_extents(gap + to_extents(new_indices))
+            else:
+                # Holes filled: the whole file is mapped again
+                indices = self._block_indices()
+                indices += [0] * (last + 1 - len(indices))
+                for logical, index in zip(missing, new_indices):
+                    indices[logical] = index
+                new_extents = to_extents(indices)
+        if (not self.is_extent_mode or len(new_extents) > len(self.extents)) and last >= self._max_blocks():
+            freelist.deallocate_many(extents, write_through=False)
+            raise Exception('File full')
+        freelist.__write__()
+
+        if self.is_extent_mode and len(new_extents) <= len(self.extents):
+            self.extents = new_extents + [Extent(0, 0)] * (len(self.extents) - len(new_extents))
+            return missing
+        if self.is_extent_mode:
+            # Too fragmented for the extent list: map the file with block pointers instead
+            self._convert_to_block_mode()
+        for logical, index in zip(missing, new_indices):
+            self._set_block_address(logical, index, write_through=False)
+        return missing
+
+    def _runs(self, first: int, count: int) -> List[Tuple[int, int, int]]:
+        """
+        Splits count logical blocks from first into runs of consecutive data blocks.
+        Returns (logical block, data block index, length) for each run. Runs of holes have data block index 0.
+        """
+        runs = []  # type: List[Tuple[int, int, int]]
+        for logical, index in enumerate(self._block_addresses(first, count), first):
+            if runs and (runs[-1][1] + runs[-1][2] == index if runs[-1][1] else index == 0):
+                runs[-1] = (runs[-1][0], runs[-1][1], runs[-1][2] + 1)
+            else:
+                runs.append((logical, index, 1))
+        return runs
+
+    def preadinto(self, offset: int, buffer) -> int:
+        """
+        Reads up to len(buffer) bytes from offset into the writable buffer. Returns the number of bytes read.
+        Only the blocks covering the range are read, with one Disk.readv. Whole blocks are read straight into buffer.
+        Holes are filled with zeros without reading the device.
+        """
+        with self.lock.reading():
+            view = memoryview(buffer).cast('B')
+            size = min(len(view), self.size - offset)
+            if size <= 0:
+                return 0
+            if self.is_inline:
+                view[:size] = self._inline[offset:offset + size]
+                return size
+            allocated = self.size - self.delayed
+            if offset + size > allocated:
+                start = max(offset, allocated)
+                view[start - offset:size] = self._delayed[start - allocated:offset + size - allocated]
+            if offset < allocated:
+                self._readinto_blocks(offset, view[:min(size, allocated - offset)])
+            return size
+
+    def _readinto_blocks(self, offset: int, view: memoryview) -> None:
+        """ Reads len(view) bytes from offset from the data blocks """
+        block_size = self._block_size
+        size = len(view)
+        first = offset // block_size
+        last = (offset + size - 1) // block_size
+        Readahead.for_device(self._device).access(self, first, last)
+        positions = []  # type: List[int]
+        buffers = []  # type: List
+        partial = []  # type: List[Tuple[int, bytearray]] # blocks that start or end outside the range
+        for logical, index in enumerate(self._block_addresses(first, last - first + 1), first):
+            start = logical * block_size - offset
+            if not index:
+                view[max(start, 0):min(start + block_size, size)] = bytes(min(start + block_size, size) - max(start, 0))
+                continue
+            positions.append(self._layout.data_start + index)
+            if start >= 0 and start + block_size <= size:
+                buffers.append(view[start:start + block_size])
+            else:
+                buffers.append(bytearray(block_size))
+                partial.append((start, buffers[-1]))
+        if positions:
+            self._device.readv(positions, buffers)
+        for start, block in partial:
+            view[max(start, 0):min(start + block_size, size)] = block[max(-start, 0):min(block_size, size - start)]
+
+    def pread(self, offset: int, size: int) -> bytes:
+        """ Reads up to size bytes from offset """
+        with self.lock.reading():
+            buffer = bytearray(max(0, min(size, self.size - offset)))
+            self.preadinto(offset, buffer)
+            return bytes(buffer)
+
+    def pwrite(self, offset: int, data) -> int:
+        """
+        Writes data at offset, overwriting existing data and extending the File. Returns the number written.
+        Data past the allocated blocks is delayed: it is buffered until flush() allocates blocks for all of it.
+        Writing past the end of the File leaves a hole between the end and offset
+        """
+        with self.lock.writing(), transaction(self._device):
+            view = self._as_bytes(data)
+            if len(view) == 0:
+                return 0
+            if not self._write_inline(offset, view):
+                self._write(offset, view)
+            self.__write__()
+            return len(view)
+
+    def _write(self, offset: int, view: memoryview) -> None:
+        """ Writes view at offset to the data blocks and the delayed data """
+        if offset > self.size:
+            self._extend(offset)
+        end = offset + len(view)
+        allocated = self.size - self.delayed
+        if end > allocated:
+            self._reserve_delayed(end)
+        if offset < allocated:
+            self._write_blocks(offset, view[:allocated - offset], allocated)
+        if end > allocated:
+            if self._delayed is None:
+                self._delayed = bytearray()
+            start = max(offset, allocated)
+            self._delayed[start - allocated:end - allocated] = view[start - offset:]
+        self.size = max(self.size, end)
+        if self.delayed > MAX_DELAYED_BLOCKS * self._block_size:
+            self._allocate_delayed()
+
+    def _write_inline(self, offset: int, view: memoryview) -> bool:
+        """
+        Writes view at offset into the Inode if the File is inline, or empty, and stays within max_inline bytes.
+        Otherwise moves the data of an inline File to data blocks, and returns False
+        """
+        if not self.is_inline and (self.size or not INLINE_DATA):
+            return False
+        end = offset + len(view)
+        if max(end, self.size) > self.max_inline:
+            self._promote()
+            return False
+        data = bytearray(self._inline or b'')
+        data += bytes(max(0, offset - len(data)))
+        data[offset:end] = view
+        self._inline = bytes(data)
+        self.flags |= INODE_FLAG_INLINE
+        self.size = len(data)
+        return True
+
+    def _promote(self) -> None:
+        """
+        Moves the data of an inline File to a newly allocated data block. It is not delayed, so a write that then
+        fails does not lose it
+        """
+        if self.is_inline:
+            data, self._inline = self._inline, None
+            self.flags &= ~INODE_FLAG_INLINE
+            self.size = len(data)
+            self._write_blocks(0, memoryview(data), 0)
+
+    def _write_blocks(self, offset: int, view: memoryview, allocated: int, reserved: int = 0) -> None:
+        """
+        Writes view at offset to data blocks, allocating the missing ones with reserved blocks of the reservation.
+        allocated bytes are on the device
+        """
+        block_size = self._block_size
+        end = offset + len(view)
+        first = offset // block_size
+        last = (end - 1) // block_size
+        new = self._reserve(first, last, reserved)
+
+        for logical, index, length in self._runs(first, last - first + 1):
+            run_start = logical * block_size
+            run_end = run_start + length * block_size
+            start, stop = max(run_start, offset), min(run_end, end)
+            block_pos = self._layout.data_start + index
+            if start == run_start and (stop == run_end or stop >= allocated):
+                # Whole blocks, or blocks with nothing after the new data: write straight from data
+                self._device.pwrite(block_pos, view[start - offset:stop - offset])
+            else:
+                # Keep the existing bytes around the new data in the first and last blocks. Blocks that were
+                # holes are zeros
+                byte_data = bytearray(self._device.pread(block_pos, length))
+                for hole in {logical, logical + length - 1}.intersection(new):
+                    byte_data[(hole - logical) * block_size:(hole - logical + 1) * block_size] = bytes(block_size)
+                byte_data[start - run_start:stop - run_start] = view[start - offset:stop - offset]
+                self._device.pwrite(block_pos, byte_data)
+
+    @property
+    def delayed(self) -> int:
+        return len(self._delayed) if self._delayed is not None else 0
+
+    def _reserve_delayed(self, end: int) -> None:
+        """
+        Reserves blocks for the delayed data once the File is end bytes long, so they can be allocated later.
+        Raises ENOSPC, before anything is written, if there are not enough free blocks
+        """
+        block_size = self._block_size
+        needed = -(-max(end, self.size) // block_size) - (self.size - self.delayed) // block_size
+        if needed > self._reserved:
+            DataBlockFreeList.for_device(self._device).reserve(needed - self._reserved)
+            self._reserved = needed
+
+    def _unreserve(self) -> None:
+        """ Returns the blocks reserved for the delayed data that were not allocated """
+        if self._reserved:
+            DataBlockFreeList.for_device(self._device).unreserve(self._reserved)
+            self._reserved = 0
+
+    def _allocate_delayed(self) -> None:
+        """
+        Allocates blocks for the delayed data, in one run if the freelist has one, and writes it to them.
+        The data stays buffered until it is written, so a failed allocation loses nothing
+        """
+        if self.delayed:
+            allocated = self.size - self.delayed
+            self._write_blocks(allocated, memoryview(self._delayed), allocated, self._reserved)
+            self._delayed = None
+        self._unreserve()
+
+    @property
+    def _items(self):
+        items = Inode._items.fget(self)
+        items[-1] -= self.delayed  # the InodeTable holds the size of the data in blocks
+        return items
+
+    @_items.setter
+    def _items(self, value):
+        Inode._items.fset(self, value)
+        self._delayed = None
+        self._unreserve()
+
+    def flush(self) -> None:
+        """ Writes the delayed data to newly allocated blocks, then the File """
+        self._allocate_delayed()
+        super().flush()
+
+    def read(self) -> bytes:
+        """ Reads and returns the contents of the File, with one device read per run of consecutive blocks """
+        with self.lock.reading():
+            return self.pread(0, self.size)
+
+    def _extend(self, length: int) -> None:
+        """
+        Extends the File to length bytes with a hole, which uses no blocks. The rest of the last block is written
+        with zeros first, as it may hold bytes of an earlier, longer File
+        """
+        block_size = self._block_size
+        pad = min(length, -(-self.size // block_size) * block_size) - self.size
+        if pad > 0 and (self.delayed or self._block_address(self.size // block_size)):
+            self.pwrite(self.size, bytes(pad))
+        if length > self.size:
+            self._allocate_delayed()
+            self.size = length
+
+    def truncate(self, length: int) -> None:
+        """ Shrinks the File to length bytes, freeing the blocks past the end, or extends it with a hole """
+        with self.lock.writing(), transaction(self._device):
+            if self.is_inline and length <= self.max_inline:
+                self._inline = self._inline[:length] + bytes(max(0, length - self.size))
+                self.size = length
+                self.__write__()
+                return
+            self._promote()
+            if length >= self.size:
+                self._extend(length)
+                self.__write__()
+                return
+            allocated = self.size - self.delayed
+            if length >= allocated:
+                del self._delayed[length - allocated:]
             else:
-                break
-        return data
+                self._delayed = None
+                self._unreserve()
+                self._truncate_blocks(self._layout.num_blocks(length))
+            self.size = length
+            self.__write__()
+
+    def free(self) -> None:
+        self._delayed = None
+        self._unreserve()
+        super().free()
 
 
 class Directory(Inode):
-    def __init__(self, device, index=None):
+    """
+    Entries are kept in a linear hash table. Logical block 0 is the DirectoryHeader and logical block 1 + b is
+    the first DirectoryBlock of bucket b. A name hashes to one bucket, so add, remove and lookup read one
+    DirectoryBlock (plus overflow blocks, if the bucket has any) however large the directory is.
+    The table grows one bucket at a time: once the average bucket is DIRECTORY_MAX_LOAD full, bucket
+    header.split is split into itself and a new bucket at the end of the table.
+    """
+    __slots__ = ('_header',)
+
+    def __init__(self, device=None, index=None):
         super().__init__(i_type=2, device=device, index=index)
+        self._header = None  # type: DirectoryHeader
+
+    @property
+    def header(self) -> DirectoryHeader:
+        """ The DirectoryHeader, creating it and the first bucket the first time it is used """
+        if self._header is None:
+            if self._has_blocks():
+                self._header = DirectoryHeader(device=self._device, index=self._block_address(0))
+            else:
+                self._header = DirectoryHeader(device=self._device)
+                bucket = DirectoryBlock(device=self._device)
+                self._header.__write__()
+                bucket.__write__()
+                self._set_block_address(0, self._header.index, write_through=False)
+                self._set_block_address(1, bucket.index)
+        return self._header
 
     # TODO: Name assignment to directory is clunky
     @property
     def name(self) -> str:
-        if self.address_direct[0] == 0:
+        if not self._has_blocks():
             raise AttributeError("{}.name not set yet".format(self.__class__))
-        else:
-            block = DirectoryBlock(device=self._device, index=self.address_direct[0])
-            return block.name
+        return self.header.name
 
     @name.setter
-    def name(self, name, write_through=True) -> None:
-        if self.address_direct[0] == 0:
+    def name(self, name) -> None:
+        self.header.name = name
+        self.header.__write__()
+
+    @staticmethod
+    def _hash(entry_name: str) -> int:
+        return zlib.crc32(entry_name.encode())
+
+    def _bucket(self, entry_name: str) -> int:
+        """ Hash table bucket of entry_name """
+        h = self._hash(entry_name)
+        bucket = h % (1 << self.header.level)
+        if bucket < self.header.split:
+            bucket = h % (1 << (self.header.level + 1))
+        return bucket
+
+    def _chain(self, bucket: int):
+        """ Yields the DirectoryBlocks of bucket: the first one and then its overflow blocks """
+        index = self._block_address(1 + bucket)
+        while index:
+            block = DirectoryBlock(device=self._device, index=index)
+            yield block
+            index = block.overflow
+
+    def _write_chain(self, blocks: List[DirectoryBlock], entries: List[tuple]) -> None:
+        """ Writes entries to the blocks of a bucket, adding overflow blocks or freeing unused ones """
+        capacity = len(blocks[0].entry_inode_indices)
+        needed = max(1, -(-len(entries) // capacity))
+        for block in blocks[needed:]:
+            block.deallocate()
+        blocks = blocks[:needed]
+        while len(blocks) < needed:
             block = DirectoryBlock(device=self._device)
-            self._add_to_address_list(block)
-        else:
-            block = DirectoryBlock(device=self._device, index=self.address_direct[0])
-        block.name = name
-        if write_through:
+            blocks[-1].overflow = block.index
+            blocks.append(block)
+        blocks[-1].overflow = 0
+        for i, block in enumerate(blocks):
+            block.entries = entries[i * capacity:(i + 1) * capacity]
             block.__write__()
 
+    def _split(self) -> None:
+        """
+        Moves the entries of bucket header.split that now hash to the new bucket at the end of the table.
+        Once the table has as many buckets as the Directory can map, it stops growing and the buckets get longer
+        overflow chains instead
+        """
+        header = self.header
+        old = header.split
+        new = old + (1 << header.level)
+        if 1 + new >= self._max_blocks():
+            return
+        new_block = DirectoryBlock(device=self._device)
+        self._set_block_address(1 + new, new_block.index)  # before the header, so a failure leaves it as it was
+        header.split += 1
+        if header.split == 1 << header.level:
+            header.level += 1
+            header.split = 0
+
+        blocks = list(self._chain(old))
+        entries = [entry for block in blocks for entry in block.entries]
+        self._write_chain(blocks, [entry for entry in entries if self._bucket(entry[0]) == old])
+        self._write_chain([new_block], [entry for entry in entries if self._bucket(entry[0]) == new])
+
     def add(self, entry_name, entry_inode):
-        """ Add to the Directory. Allocate DirectoryBlocks and write name and inodes to them """
-
-        # Check to see if name already exits
-        existing_names, _ = self.read()
-        if entry_name in existing_names:
-            raise Exception('{}: entry already exists'.format(self.__class__))
-
-        # Check to see if any DirectoryBlocks is already assigned
-        if sum(self.address_direct) != 0:
-            # If assigned, append data to last block
-            last_assigned = self._last_assigned_address()
-            block = DirectoryBlock(device=self._device, index=last_assigned)
-            if block.is_full():
-                # Assign a new block
-                block = DirectoryBlock(device=self._device)
-                self._add_to_address_list(block)
-        else:
-            # assign a new block and add to Inode
-            block = DirectoryBlock(device=self._device)
-            self._add_to_address_list(block)
-        # Write to block
-        block.add_entry(entry_name=entry_name, entry_inode_index=entry_inode)
+        """ Add to the Directory, in the first free entry of the bucket of entry_name """
+        with self.lock.writing(), transaction(self._device):
+            header = self.header
+            free = None
+            for block in self._chain(self._bucket(entry_name)):
+                if block.find(entry_name) is not None:
+                    raise Exception('{}: entry already exists'.format(self.__class__))
+                if free is None and not block.is_full():
+                    free = block
+                last = block
+            if free is None:
+                # Every block of the bucket is full: chain an overflow block
+                free = DirectoryBlock(device=self._device)
+                last.overflow = free.index
+                last.__write__()
+            free.add_entry(entry_name=entry_name, entry_inode_index=entry_inode)
+            DentryCache.for_device(self._device).put(self.index, entry_name, entry_inode)
+
+            header.num_entries += 1
+            if header.num_entries > DIRECTORY_MAX_LOAD * len(free.entry_inode_indices) * header.num_buckets:
+                self._split()
+            header.__write__()
 
     def remove(self, entry_name, entry_inode):
         """ Remove from Directory """
-        if sum(self.address_direct) == 0:
-            raise Exception('{} {} contains no files'.format(self.__class__, self.index))
+        with self.lock.writing(), transaction(self._device):
+            if not self._has_blocks():
+                raise Exception('{} {} contains no files'.format(self.__class__, self.index))
 
-        for address in self.address_direct:
-            block = DirectoryBlock(device=self._device, index=address)
-            try:
-                block.remove_entry(entry_name=entry_name, entry_inode_index=entry_inode)
-            # TODO: Change this to not use try except
-            except Exception:
-                continue
+            for block in self._chain(self._bucket(entry_name)):
+                if block.find(entry_name) is not None:
+                    block.remove_entry(entry_name=entry_name, entry_inode_index=entry_inode)
+                    DentryCache.for_device(self._device).put(self.index, entry_name, None)
+                    self.header.num_entries -= 1
+                    self.header.__write__()
+                    return
+            raise Exception('{} {} does not contain entry "{}"'.format(self.__class__, self.index, entry_name))
+
+    def lookup(self, entry_name) -> int:
+        """
+        Returns the inode index of entry_name. The result, or its absence, is put in the DentryCache while the lock
+        is held, so add and remove cannot change the entry in between. A name too long for an entry is absent
+        """
+        with self.lock.reading():
+            entry_inode = None
+            if self._has_blocks() and len(entry_name.encode()) <= MAX_FILENAME_LENGTH:
+                for block in self._chain(self._bucket(entry_name)):
+                    entry_inode = block.find(entry_name)
+                    if entry_inode is not None:
+                        break
+            DentryCache.for_device(self._device).put(self.index, entry_name, entry_inode)
+            if entry_inode is not None:
+                return entry_inode
+            raise FileNotFoundError('{} {} does not contain entry "{}"'.format(self.__class__, self.index, entry_name))
+
+    def rename(self, entry_name, new_directory: 'Directory', new_name) -> None:
+        """ Moves entry_name to new_name in new_directory, which may be this Directory """
+        first, second = sorted([self, new_directory], key=lambda directory: directory.index)  # in index order
+        with first.lock.writing(), second.lock.writing(), transaction(self._device):
+            entry_inode = self.lookup(entry_name)
+            new_directory.add(new_name, entry_inode)
+            self.remove(entry_name, entry_inode)
+
+    def free(self) -> None:
+        """ Frees the overflow blocks of every bucket, then the Directory. Drops its cached entries """
+        if self._has_blocks():
+            for bucket in range(self.header.num_buckets):
+                for block in list(self._chain(bucket))[1:]:
+                    block.deallocate()
+        DentryCache.for_device(self._device).invalidate(self.index)
+        self._header = None
+        super().free()
 
     def read(self) -> Tuple[List[str], List[int]]:
-        """ Reads entry names and inode numners from directory """
-        entry_names = []  # type: List
-        entry_inodes = []  # type: List
-        for address in self.address_direct:
-            if address != 0:
-                block = DirectoryBlock(device=self._device, index=address)
-                for e in block.entry_names:
-                    if e != '':
-                        entry_names += [e]
-                for e in block.entry_inode_indices:
-                    if e != 0:
-                        entry_inodes += [e]
+        """ Reads entry names and inode numners from directory, in hash table order """
+        with self.lock.reading():
+            entry_names = []  # type: List
+            entry_inodes = []  # type: List
+            if not self._has_blocks():
+                return entry_names, entry_inodes
+            for bucket in range(self.header.num_buckets):
+                for block in self._chain(bucket):
+                    for name, inode in block.entries:
+                        entry_names += [name]
+                        entry_inodes += [inode]
+            return entry_names, entry_inodes
+
+
+class Readahead(object):
+    """
+    Sequential read detector of the Files of a device. A read of a File that starts at block 0 or where the
+    previous read ended is sequential, and doubles the readahead window of the File, from READAHEAD_MIN_BLOCKS up
+    to READAHEAD_MAX_BLOCKS or half the capacity of the BlockCache. Any other read resets the window.
+    Sequential reads read the next window of blocks ahead with Disk.prefetch, one call per run of consecutive
+    data blocks, into the BlockCache (or the page cache of the OS if there is none), so the reads that follow are
+    served from memory. A new window is read once the reader is half way through the previous one.
+    With background=True blocks past the current read are read by a background thread, overlapping the reader.
+    """
+    def __init__(self, device, background: bool = False, capacity: int = DEFAULT_READAHEAD_FILES):
+        self._device = device
+        self.capacity = capacity
+        self._files = OrderedDict()  # type: OrderedDict # index -> (next block, window, end of blocks read ahead)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='unix_fs.readahead') \
+            if background else None
+        self.sequential = 0  # sequential reads
+        self.blocks = 0  # blocks read ahead
+
+    @classmethod
+    def for_device(cls, device) -> 'Readahead':
+        """ Returns the Readahead of the device, creating it on first use """
+        if device.readahead is None:
+            with device.lock:
+                if device.readahead is None:
+                    device.readahead = cls(device)
+        return device.readahead
+
+    @property
+    def max_window(self) -> int:
+        cache = self._device.cache
+        return READAHEAD_MAX_BLOCKS if cache is None else max(1, min(READAHEAD_MAX_BLOCKS, cache.capacity // 2))
+
+    def access(self, f: File, first: int, last: int) -> None:
+        """ Called before logical blocks first to last of f are read, holding the lock of f """
+        num_blocks = self._device.num_blocks(f.size - f.delayed)
+        with self._lock:
+            state = self._files.pop(f.index, None)
+            if state is None and first != 0 or state is not None and state[0] != first:
+                self._files[f.index] = (last + 1, READAHEAD_MIN_BLOCKS, 0)  # not sequential
+                self._trim()
+                return
+            if state is None:
+                window, ahead = READAHEAD_MIN_BLOCKS, 0
+            else:
+                window, ahead = min(state[1] * 2, self.max_window), state[2]
+            start = max(last + 1 if self._executor else first, ahead)
+            end = min(last + 1 + window, num_blocks)
+            if ahead - (last + 1) > window // 2 or start >= end:
+                end = ahead  # enough read ahead already
+            self._files[f.index] = (last + 1, window, end)
+            self._trim()
+            self.sequential += 1
+            if start >= end:
+                return
+            self.blocks += end - start
+        data_start = f._layout.data_start
+        runs = [(data_start + index, length) for _, index, length in f._runs(start, end - start) if index]
+        if self._executor is None:
+            self._prefetch(runs)
+        else:
+            self._executor.submit(self._prefetch, runs)
+
+    def _prefetch(self, runs: List[Tuple[int, int]]) -> None:
+        for block_pos, length in runs:
+            self._device.prefetch(block_pos, length)
+
+    def _trim(self) -> None:
+        while len(self._files) > self.capacity:
+            self._files.popitem(last=False)
+
+    def close(self) -> None:
+        """ Waits for the blocks being read ahead """
+        if self._executor is not None:
+            self._executor.shutdown()
+
+
+class DentryCache(object):
+    """
+    LRU cache of directory entries: (parent Directory index, name) -> child inode index.
+    None is a negative entry: the name is known not to exist in the parent.
+    Directory.add and Directory.remove keep the entries of the device up to date.
+    """
+    MISSING = object()  # returned by get() when nothing is cached for the name
+
+    def __init__(self, capacity: int = DEFAULT_DENTRY_CACHE_SIZE):
+        if capacity < 1:
+            raise Exception('{} capacity must be at least 1'.format(self.__class__))
+        self.capacity = capacity
+        self._entries = OrderedDict()  # type: OrderedDict # (parent, name) -> child index, least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_device(cls, device) -> 'DentryCache':
+        """ Returns the DentryCache of the device, creating it on first use """
+        if device.dentries is None:
+            with device.lock:
+                if device.dentries is None:
+                    device.dentries = cls()
+        return device.dentries
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'capacity': self.capacity,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def get(self, parent: int, name: str):
+        """ Returns the cached child index, None for a negative entry, or MISSING """
+        key = (parent, name)
+        with self._lock:
+            child = self._entries.get(key, self.MISSING)
+            if child is self.MISSING:
+                self.misses += 1
             else:
-                break
-        return entry_names, entry_inodes
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return child
+
+    def put(self, parent: int, name: str, child) -> None:
+        key = (parent, name)
+        with self._lock:
+            self._entries[key] = child
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, parent: int = None) -> None:
+        """ Drops the entries of the parent Directory, or every entry """
+        with self._lock:
+            if parent is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == parent]:
+                del self._entries[key]
+
+
+class InodeCache(object):
+    """
+    Table of live File and Directory objects of a device, by inode index. get() returns the same object for an
+    index until it is evicted, so repeated opens of a hot file read nothing from the device.
+    Cached Inodes are written back: __write__ only marks them dirty, and they are written when evicted or
+    flushed (Disk.sync and Disk.close flush the InodeCache of the device).
+    get() takes a reference and release() drops it. Only Inodes with no references are evicted, least
+    recently used first, so the cache may hold more than capacity Inodes while they are in use.
+    Objects constructed directly, e.g. File(device, index), are not cached and must not be mixed with cached
+    objects of the same index.
+    unlink() frees an Inode when its last reference is released, so open files outlive their directory entry.
+    The delayed data of a File (see File) is allocated when the File is written back or its last reference is
+    released.
+    Threads may share the cache. Its lock is taken after the lock of any Inode, never before.
+    With a journal, create, release and unlink run in a transaction opened before the lock is taken. Every change
+    is made in a transaction opened after the locks of the Inodes it changes, so Journal.commit, which waits for
+    open transactions, never waits for a thread that waits for an Inode.
+    """
+    INODE_TYPES = {1: File, 2: Directory}  # i_type -> class
+
+    def __init__(self, device, capacity: int = DEFAULT_INODE_CACHE_SIZE):
+        if capacity < 1:
+            raise Exception('{} capacity must be at least 1'.format(self.__class__))
+        self._device = device
+        self.capacity = capacity
+        self._inodes = OrderedDict()  # type: OrderedDict # index -> Inode, least recently used first
+        self._refs = {}  # type: dict # index -> number of references taken by get() and create()
+        self._dirty = set()
+        self._delayed = set()  # indices of Files written back by write_back() with their delayed data still buffered
+        self._unlinked = set()  # indices of referenced Inodes to free at their last release()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def for_device(cls, device) -> 'InodeCache':
+        """ Returns the InodeCache of the device, creating it on first use """
+        if device.inodes is None:
+            with device.lock:
+                if device.inodes is None:
+                    device.inodes = cls(device)
+        return device.inodes
+
+    def __len__(self):
+        return len(self._inodes)
+
+    def __contains__(self, index: int):
+        return index in self._inodes
+
+    @property
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'capacity': self.capacity,
+                    'size': len(self._inodes),
+                    'referenced': sum(1 for refs in self._refs.values() if refs),
+                    'dirty': len(self._dirty),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    @property
+    def num_dirty(self) -> int:
+        """ Number of dirty Inodes, read without the lock, so it may already be out of date """
+        return len(self._dirty)
+
+    def get(self, index: int) -> Inode:
+        """ Returns the live File or Directory for index, reading it from the device if it is not cached """
+        with transaction(self._device), self._lock:  # evicting a File may allocate its blocks
+            inode = self._inodes.get(index)
+            if inode is None:
+                self.misses += 1
+                inode = self._load(index)
+                self._insert(inode)
+            else:
+                self.hits += 1
+                self._inodes.move_to_end(index)
+            self._refs[index] += 1
+            self._evict()
+            return inode
+
+    def create(self, cls) -> Inode:
+        """ Allocates a new cls (File or Directory) and returns it cached, with one reference """
+        with transaction(self._device), self._lock:
+            inode = cls(device=self._device)
+            self._insert(inode)
+            self._refs[inode.index] += 1
+            self.mark_dirty(inode)
+            self._evict()
+            return inode
+
+    def release(self, inode: Inode) -> None:
+        """ Drops a reference taken by get() or create() """
+        with transaction(self._device), self._lock:
+            if not self._refs.get(inode.index):
+                raise Exception('{} {} is not referenced'.format(inode.__class__, inode.index))
+            self._refs[inode.index] -= 1
+            if not self._refs[inode.index]:
+                if inode.index in self._unlinked:
+                    self._unlinked.remove(inode.index)
+                    self._free(inode)
+                elif inode.delayed:
+                    inode.flush()  # closed: its data is complete, so allocate it at once
+                    self._dirty.discard(inode.index)
+                    self._delayed.discard(inode.index)
+            self._evict()
+
+    def unlink(self, inode: Inode) -> None:
+        """ Frees the Inode and its blocks now if nothing references it, or else at its last release() """
+        with transaction(self._device), self._lock:
+            if self._refs.get(inode.index):
+                self._unlinked.add(inode.index)
+            else:
+                self._free(inode)
+
+    def _free(self, inode: Inode) -> None:
+        index = inode.index
+        if self._inodes.get(index) is inode:
+            del self._inodes[index]
+            del self._refs[index]
+            self._dirty.discard(index)
+            self._delayed.discard(index)
+        inode._cache = None
+        inode.free()
+
+    def mark_dirty(self, inode: Inode) -> None:
+        with self._lock:
+            self._dirty.add(inode.index)
+
+    def flush(self) -> None:
+        """
+        Writes all dirty Inodes to the device, in index order. Each is written holding its lock, so no thread
+        is changing it
+        """
+        with self._lock:
+            dirty = sorted(self._dirty | self._delayed)
+        for index in dirty:
+            with self._lock:
+                inode = self._inodes.get(index)
+            if inode is None:
+                continue  # evicted, and written, since
+            with inode.lock.writing(), transaction(self._device), self._lock:
+                if (index in self._dirty or index in self._delayed) and self._inodes.get(index) is inode:
+                    self._dirty.discard(index)
+                    self._delayed.discard(index)
+                    inode.flush()
+
+    def write_back(self) -> None:
+        """
+        Writes all dirty Inodes without taking their locks. For Journal.commit, while no transaction is open.
+        Files are written as they are: allocating their delayed data needs their lock, so flush() does it later
+        """
+        with self._lock:
+            for index in sorted(self._dirty):
+                inode = self._inodes[index]
+                Inode.flush(inode)
+                if inode.delayed:
+                    self._delayed.add(index)
+            self._dirty.clear()
+
+    def _load(self, index: int) -> Inode:
+        raw = Inode(device=self._device, index=index)
+        if raw.i_type not in self.INODE_TYPES:
+            raise FileNotFoundError('Inode {} is not a File or Directory'.format(index))
+        inode = self.INODE_TYPES[raw.i_type].from_allocated(self._device, index)
+        inode._items = raw._items
+        return inode
+
+    def _insert(self, inode: Inode) -> None:
+        inode._cache = self
+        self._inodes[inode.index] = inode
+        self._refs[inode.index] = 0
+
+    def _evict(self) -> None:
+        """ Writes back and drops unreferenced Inodes, least recently used first, until the cache fits """
+        if len(self._inodes) <= self.capacity:
+            return
+        for index in [index for index in self._inodes if not self._refs[index]]:
+            inode = self._inodes.pop(index)
+            del self._refs[index]
+            if index in self._dirty or index in self._delayed:
+                self._dirty.discard(index)
+                self._delayed.discard(index)
+                inode.flush()
+            inode._cache = None
+            self.evictions += 1
+            if len(self._inodes) <= self.capacity:
+                return
+
+
+def resolve(device, path: str) -> int:
+    """
+    Returns the inode index of the absolute path, walking it from the root Directory one name at a time.
+    Names are looked up in the DentryCache first, so walking a cached path reads nothing from the device.
+    Directories are read through the InodeCache of the device, and Directory.lookup fills the DentryCache.
+    """
+    dentries = DentryCache.for_device(device)
+    inodes = InodeCache.for_device(device)
+    index = ROOT_INODE
+    for name in path.split('/'):
+        if name in ('', '.'):
+            continue
+        child = dentries.get(index, name)
+        if child is DentryCache.MISSING:
+            directory = inodes.get(index)
+            try:
+                if not isinstance(directory, Directory):
+                    raise NotADirectoryError('{}: inode {} is not a directory'.format(path, index))
+                child = directory.lookup(name)
+            except FileNotFoundError:
+                child = None
+            finally:
+                inodes.release(directory)
+        if child is None:
+            raise FileNotFoundError('{}: no entry "{}"'.format(path, name))
+        index = child
+    return index
@@ -1 +1,251 @@
-""" FUSE interface for the file system """
\ No newline at end of file
+"""
+FUSE interface for the file system
+
+Mounts a disk image made by utils.makefs:
+python -m unix_fs.unix_fs <image> <mountpoint> [foreground/background]
+
+Author: Angad Gill
+"""
+import logging
+import os
+import posixpath
+import stat
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+from errno import EEXIST, EINVAL, EIO, EISDIR, ENAMETOOLONG, ENOENT, ENOTDIR, ENOTEMPTY
+from itertools import count
+from sys import argv, exit
+
+from fuse import FUSE, FuseOSError, Operations, LoggingMixIn
+
+from unix_fs import data_structures as ds
+from unix_fs import device_io
+from unix_fs import system
+from unix_fs.journal import transaction
+from unix_fs import utils
+
+ERRNOS = {FileNotFoundError: ENOENT, NotADirectoryError: ENOTDIR, IsADirectoryError: EISDIR,
+          FileExistsError: EEXIST}  # errno of the OSErrors raised by unix_fs without one
+
+
+class UnixFS(LoggingMixIn, Operations):
+    """
+    FUSE operations on a mounted unix_fs device. FUSE calls them from many threads.
+    Each Inode has an RWLock (data_structures.InodeLocks), so requests on different files never wait for each
+    other. Reads of a File share its lock. Writes, truncates and changes to the entries of a Directory hold it
+    alone. File and Directory take the lock themselves; the operations here hold it across the steps that must
+    see no change in between.
+    Changes to the tree (create, mkdir, unlink, rmdir, rename) are serialized by the namespace lock, which is
+    taken before any Inode lock. On a device with a journal each change is one transaction, and fsync commits the
+    journal: concurrent fsyncs share one commit. Without a journal fsync writes everything back and fsyncs the image.
+    Inodes have no mode, owner or times: getattr reports fixed ones and chmod, chown and utimens are ignored.
+    """
+    def __init__(self, device):
+        self.device = device
+        self.inodes = system.InodeCache.for_device(device)
+        self.locks = ds.InodeLocks.for_device(device)
+        self._namespace_lock = threading.Lock()
+        self._handles = {}  # type: dict # file handle -> File, referenced in the InodeCache until release
+        self._next_handle = count(1)
+        self._mount_time = time.time()
+
+    def __call__(self, op, *args):
+        try:
+            return super().__call__(op, *args)
+        except OSError as e:
+            if e.errno is None:
+                raise FuseOSError(ERRNOS.get(type(e), EIO))
+            raise
+
+    @contextmanager
+    def _inode(self, index: int):
+        """ The cached File or Directory of index, referenced until the end of the with block """
+        inode = self.inodes.get(index)
+        try:
+            yield inode
+        finally:
+            self.inodes.release(inode)
+
+    def _resolve(self, path: str) -> int:
+        return system.resolve(self.device, path)
+
+    def _exists(self, path: str) -> bool:
+        try:
+            self._resolve(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _entry(self, path: str):
+        """ Returns the index of the parent Directory of path, and the name of path in it """
+        parent, name = posixpath.split(path)
+        if not name:
+            raise FuseOSError(EINVAL)
+        if len(name.encode()) > ds.MAX_FILENAME_LENGTH:
+            raise FuseOSError(ENAMETOOLONG)
+        return self._resolve(parent), name
+
+    def _stat(self, inode: ds.Inode) -> dict:
+        if isinstance(inode, system.Directory):
+            mode, nlink = stat.S_IFDIR | 0o755, 2
+        else:
+            mode, nlink = stat.S_IFREG | 0o644, 1
+        return {'st_mode': mode, 'st_nlink': nlink, 'st_size': inode.size, 'st_uid': os.getuid(),
+                'st_gid': os.getgid(), 'st_atime': self._mount_time, 'st_mtime': self._mount_time,
+                'st_ctime': self._mount_time}
+
+    def _add(self, path: str, cls) -> ds.Inode:
+        """ Creates a cls Inode at path and returns it, referenced once """
+        parent_index, name = self._entry(path)
+        if self._exists(path):
+            raise FuseOSError(EEXIST)
+        with self.locks.get(parent_index).writing(), self._inode(parent_index) as parent:
+            if not isinstance(parent, system.Directory):
+                raise FuseOSError(ENOTDIR)
+            with transaction(self.device):
+                inode = self.inodes.create(cls)
+                parent.add(name, inode.index)
+            return inode
+
+    def _open(self, inode: ds.Inode) -> int:
+        fh = next(self._next_handle)
+        self._handles[fh] = inode
+        return fh
+
+    def getattr(self, path, fh=None):
+        with self._inode(self._resolve(path)) as inode:
+            return self._stat(inode)
+
+    def readdir(self, path, fh):
+        with self._inode(self._resolve(path)) as directory:
+            if not isinstance(directory, system.Directory):
+                raise FuseOSError(ENOTDIR)
+            return ['.', '..'] + directory.read()[0]
+
+    def create(self, path, mode, fi=None):
+        with self._namespace_lock:
+            return self._open(self._add(path, system.File))
+
+    def open(self, path, flags):
+        return self._open(self.inodes.get(self._resolve(path)))
+
+    def release(self, path, fh):
+        self.inodes.release(self._handles.pop(fh))
+
+    def read(self, path, size, offset, fh):
+        return self._handles[fh].pread(offset, size)
+
+    def write(self, path, data, offset, fh):
+        return self._handles[fh].pwrite(offset, data)
+
+    def truncate(self, path, length, fh=None):
+        with self._inode(self._resolve(path)) as f:
+            if not isinstance(f, system.File):
+                raise FuseOSError(EISDIR)
+            f.truncate(length)
+
+    def mkdir(self, path, mode):
+        with self._namespace_lock:
+            self.inodes.release(self._add(path, system.Directory))
+
+    @staticmethod
+    def _check_removable(inode: ds.Inode, is_dir: bool) -> None:
+        """ Raises unless inode is a File (is_dir=False) or an empty Directory (is_dir=True) """
+        if isinstance(inode, system.Directory) != is_dir:
+            raise FuseOSError(EISDIR if not is_dir else ENOTDIR)
+        if is_dir and inode.read()[0]:
+            raise FuseOSError(ENOTEMPTY)
+
+    def _remove(self, path: str, is_dir: bool) -> None:
+        """ Removes the File or empty Directory at path. Its Inode is freed once no open file references it """
+        parent_index, name = self._entry(path)
+        index = self._resolve(path)
+        with self.locks.get(parent_index).writing(), self.locks.get(index).writing(), \
+                self._inode(parent_index) as parent, self._inode(index) as inode:
+            self._check_removable(inode, is_dir)
+            with transaction(self.device):
+                parent.remove(name, index)
+                self.inodes.unlink(inode)
+
+    def unlink(self, path):
+        with self._namespace_lock:
+            self._remove(path, is_dir=False)
+
+    def rmdir(self, path):
+        with self._namespace_lock:
+            self._remove(path, is_dir=True)
+
+    def rename(self, old, new):
+        """ Moves old to new. An existing new is replaced in the same transaction, so a crash leaves one of them """
+        with self._namespace_lock:
+            if new.startswith(old + '/'):
+                raise FuseOSError(EINVAL)  # a Directory cannot move into itself
+            old_parent, old_name = self._entry(old)
+            new_parent, new_name = self._entry(new)
+            index = self._resolve(old)
+            target = self._resolve(new) if self._exists(new) else None
+            if target == index:
+                return
+            with ExitStack() as stack:
+                for i in dict.fromkeys([old_parent, new_parent, index] + ([target] if target is not None else [])):
+                    stack.enter_context(self.locks.get(i).writing())
+                source = stack.enter_context(self._inode(old_parent))
+                destination = stack.enter_context(self._inode(new_parent))
+                if not isinstance(destination, system.Directory):
+                    raise FuseOSError(ENOTDIR)
+                if target is not None:
+                    inode = stack.enter_context(self._inode(index))
+                    replaced = stack.enter_context(self._inode(target))
+                    self._check_removable(replaced, is_dir=isinstance(inode, system.Directory))
+                with transaction(self.device):
+                    if target is not None:
+                        destination.remove(new_name, target)
+                        self.inodes.unlink(replaced)
+                    source.rename(old_name, destination, new_name)
+
+    def statfs(self, path):
+        layout = self.device.layout
+        freelist = ds.DataBlockFreeList.for_device(self.device)
+        blocks_free = freelist.num_free
+        inodes_free = ds.InodeFreeList.for_device(self.device).num_free
+        return {'f_bsize': layout.block_size, 'f_frsize': layout.block_size, 'f_blocks': layout.num_data_blocks,
+                'f_bfree': blocks_free, 'f_bavail': freelist.num_available, 'f_files': layout.num_inodes,
+                'f_ffree': inodes_free, 'f_favail': inodes_free, 'f_namemax': ds.MAX_FILENAME_LENGTH}
+
+    def fsync(self, path, datasync, fh):
+        self.device.sync()
+        if self.device.journal is None:
+            self.device.fsync()  # sync only writes back: the journal commit is what makes it durable
+
+    def destroy(self, path):
+        self.device.close()
+
+    def chmod(self, path, mode):
+        return 0
+
+    def chown(self, path, uid, gid):
+        return 0
+
+    def utimens(self, path, times=None):
+        return 0
+
+
+if __name__ == '__main__':
+    def error_msg():
+        print('usage: %s <image> <mountpoint> [foreground/background]' % argv[0])
+        exit(1)
+
+    if len(argv) < 4:
+        error_msg()
+
+    if argv[3] == 'foreground':
+        foreground = True
+    elif argv[3] == 'background':
+        foreground = False
+    else:
+        error_msg()
+
+    logging.basicConfig(level=logging.INFO)
+    fuse = FUSE(UnixFS(utils.mount(argv[1], cache_size=device_io.DEFAULT_CACHE_SIZE)), argv[2],
+                foreground=foreground, nothreads=False)
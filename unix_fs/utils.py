@@ -5,30 +5,58 @@ Author: Angad Gill
 """
 from unix_fs import device_io
 from unix_fs import data_structures as ds
+from unix_fs import journal
+from unix_fs import system
 
 
-def makefs(root_path, verbose=False):
+def makefs(root_path, verbose=False, block_size=None, num_inodes=None, num_data_blocks=None, journal_blocks=0):
     """
         Layout:
         Superblock
         All Inodes
         Inode Freelist
         Block Freelist
-        Root Directory
+        Data blocks
+        Journal, if journal_blocks is non-zero
+
+        The root Directory is Inode ROOT_INODE. Its blocks are allocated when the first entry is added.
+        Geometry defaults to the data_structures module constants and is stored in the SuperBlock.
+        The size of the journal is stored in its own header block, after the data blocks.
     """
     if verbose:
         print("Creating file system at {}".format(root_path))
-    bootstrap_data = bytes(ds.SuperBlock())
-    bootstrap_data += bytes(ds.BLOCK_SIZE * ds.NUM_INODES)
-    bootstrap_data += bytes(ds.InodeFreeList())
-    bootstrap_data += bytes(ds.DataBlockFreeList())
-    # TODO: Update write a real root directory
-    bootstrap_data += bytes(ds.DirectoryBlock())
-    bootstrap_data += bytes(ds.BLOCK_SIZE * ds.NUM_DATA_BLOCKS)
-    disk = device_io.Disk(root_path)
-    disk.open()
-    disk.seek(0)
-    disk.write(bootstrap_data)
-    # TODO: remove this hack when real root directory is written
+    layout = ds.Layout(block_size=block_size, num_inodes=num_inodes, num_data_blocks=num_data_blocks)
+    with open(root_path, 'wb') as f:
+        f.truncate((layout.total_blocks + journal_blocks) * layout.block_size)  # zero filled, without writing them
+    disk = device_io.Disk(root_path, block_size=layout.block_size)
+    disk.layout = layout
+    if journal_blocks:
+        journal.Journal.format(disk, journal_blocks)
+    superblock = ds.SuperBlock.from_layout(layout)
+    superblock._device = disk
+    superblock.__write__()
+    for freelist_class in [ds.InodeFreeList, ds.DataBlockFreeList]:
+        freelist = freelist_class(device=disk)
+        freelist.list = [True] * freelist.n
+        freelist.__write__()
+    # Data block 0 is never used: 0 means unassigned in block pointers
     ds.DataBlockFreeList(device=disk).allocate()
+    root = system.Directory(device=disk)
+    root.__write__()
+    disk.close()
+
+
+def mount(root_path, cache_size=0, use_mmap=False):
+    """
+    Opens the file system at root_path with the geometry stored in its SuperBlock. Returns the device.
+    use_mmap selects the memory-mapped MmapDisk backend instead of Disk.
+    If the file system has a journal, the transactions committed to it are replayed.
+    """
+    disk = device_io.Disk(root_path)
+    layout = ds.Layout.from_superblock(ds.SuperBlock(device=disk))
     disk.close()
+    disk_class = device_io.MmapDisk if use_mmap else device_io.Disk
+    disk = disk_class(root_path, cache_size=cache_size, block_size=layout.block_size)
+    disk.layout = layout
+    journal.Journal.open(disk)
+    return disk